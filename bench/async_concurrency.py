@@ -0,0 +1,159 @@
+"""
+مقارنة الخادم المتزامن (waitress) بنسخة ASGI (uvicorn + gf_server_async)
+تحت عدد كبير من الاتصالات شبه الخاملة (هواتف بطيئة: طلب بحث ثم انتظار).
+
+    python bench/async_concurrency.py [--connections 2000] [--duration 20]
+
+كل اتصال keep-alive يرسل طلب البحث AJAX ثم ينتظر 0.5–2 ثانية ويعيد.
+النتيجة: عدد الطلبات المكتملة، زمن الاستجابة p50/p99، والأخطاء.
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def prepare_database(env: dict):
+    subprocess.run([sys.executable, os.path.join(ROOT, "gf_server.py"), "migrate"],
+                   env=env, check=True, capture_output=True)
+    code = (
+        "import gf_server as g\n"
+        "rows = [['reference', 'designation', 'prix', 'fournisseur', 'date']]\n"
+        "rows += [['REF%05d' % i, 'Article %d' % i, '%d,50' % (i % 90), 'Fournisseur %d' % (i % 40),"
+        " '2024-01-%02d' % (i % 28 + 1)] for i in range(20000)]\n"
+        "print(g.import_rows(g.TEST_CLIENT_ID, rows)['saved'])\n"
+    )
+    subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT, check=True, capture_output=True)
+
+
+def session_cookie(env: dict) -> str:
+    code = ("import gf_server as g\n"
+            "print(g.app.session_interface.get_signing_serializer(g.app)"
+            ".dumps({'client_id': g.TEST_CLIENT_ID}))")
+    return subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+async def read_response(reader) -> int:
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    await reader.readexactly(length)
+    return status
+
+
+async def client(port, cookie, query, deadline, latencies, errors):
+    request = (
+        f"GET /client/LOCAL-TEST/lines?ajax=1&q={query} HTTP/1.1\r\n"
+        f"Host: 127.0.0.1:{port}\r\n"
+        f"Cookie: session={cookie}\r\n"
+        "Connection: keep-alive\r\n\r\n"
+    ).encode()
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        errors.append("connect")
+        return
+    try:
+        await asyncio.sleep(random.uniform(0, 2))
+        while time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await asyncio.wait_for(read_response(reader), timeout=30)
+            if status != 200:
+                errors.append(status)
+            latencies.append(time.perf_counter() - t0)
+            await asyncio.sleep(random.uniform(0.5, 2.0))
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def load(port, cookie, query, connections, duration):
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(client(port, cookie, query, deadline, latencies, errors)
+                           for _ in range(connections)))
+    return latencies, errors
+
+
+def wait_for_port(port, timeout=30):
+    import socket
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"port {port} not ready")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--duration", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--query", default="ref0123",
+                        help="recherche envoyée par chaque connexion")
+    args = parser.parse_args()
+
+    # اتصالات كثيرة → نرفع حد الملفات المفتوحة (للعملية وللخوادم الأبناء)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, args.connections * 3)), hard))
+
+    env = dict(os.environ)
+    tmp = None
+    if not env.get("DATABASE_URL"):
+        tmp = tempfile.TemporaryDirectory()
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp.name, 'bench.db')}"
+    prepare_database(env)
+    cookie = session_cookie(env)
+
+    servers = {
+        "waitress": [sys.executable, "gf_server.py", "serve", "--port", "8801",
+                     "--threads", str(args.threads),
+                     "--connection-limit", str(args.connections + 100)],
+        "asgi": [sys.executable, "-m", "uvicorn", "gf_server_async:app", "--port", "8802",
+                 "--log-level", "warning", "--backlog", str(args.connections + 100)],
+    }
+    ports = {"waitress": 8801, "asgi": 8802}
+
+    print(f"{args.connections} connexions, {args.duration} s")
+    print(f"{'serveur':<10} {'requêtes':>9} {'req/s':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} {'erreurs':>8}")
+    for name, cmd in servers.items():
+        proc = subprocess.Popen(cmd, cwd=ROOT, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(ports[name])
+            latencies, errors = asyncio.run(load(ports[name], cookie, args.query,
+                                                 args.connections, args.duration))
+        finally:
+            proc.terminate()
+            proc.wait()
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000 if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0
+        print(f"{name:<10} {len(latencies):>9} {len(latencies) / args.duration:>8.1f} "
+              f"{p50:>9.1f} {p99:>9.1f} {len(errors):>8}")
+
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
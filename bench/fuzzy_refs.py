@@ -0,0 +1,85 @@
+"""
+البحث التقريبي في المراجع على كتالوج كبير (فهرس trigram في الذاكرة، وضع SQLite):
+زمن بناء RefNgramIndex، الذاكرة، وزمن الاستعلام p50/p99 لمراجع بأخطاء كتابة
+(تبديل حرفين، حرف ناقص، حرف خاطئ).
+
+    python bench/fuzzy_refs.py [--references 1000000] [--queries 500]
+
+لا يلمس القاعدة: المراجع مولّدة، والمرحلتان هما نفس ما يفعله fuzzy_references.
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+import resource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# gf_server يحتاج DATABASE_URL عند الاستيراد؛ المحرك لا يتصل فعلاً هنا
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.gettempdir(), 'gf_bench.db')}")
+
+import gf_server as g  # noqa: E402
+
+
+def make_reference(rng) -> str:
+    # شكل مراجع القطع: بادئة حروف + أرقام، أحياناً بفاصل
+    prefix = "".join(rng.choices(string.ascii_uppercase, k=rng.randint(1, 3)))
+    digits = "".join(rng.choices(string.digits, k=rng.randint(4, 7)))
+    return prefix + rng.choice(("", "", "-", " ")) + digits
+
+
+def typo(ref: str, rng) -> str:
+    chars = list(ref)
+    i = rng.randrange(len(chars) - 1)
+    kind = rng.choice(("swap", "drop", "replace"))
+    if kind == "swap":
+        chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    elif kind == "drop":
+        del chars[i]
+    else:
+        chars[i] = rng.choice(string.ascii_uppercase + string.digits)
+    return "".join(chars)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--references", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    refs = [make_reference(rng) for _ in range(args.references)]
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    index = g.RefNgramIndex()
+    for ref in refs:
+        index.add(ref)
+    build = time.perf_counter() - t0
+    # ru_maxrss بالكيلوبايت على Linux
+    memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * 1024
+
+    latencies, found = [], 0
+    for _ in range(args.queries):
+        wanted = rng.choice(refs)
+        key = g.normalize_search(typo(wanted, rng))
+        t0 = time.perf_counter()
+        ranked = g.rank_references(key, index.candidates(key, g.FUZZY_CANDIDATES))
+        latencies.append(time.perf_counter() - t0)
+        found += wanted in ranked
+
+    latencies.sort()
+    print(f"{len(index.keys)} références, index construit en {build:.1f} s, "
+          f"{memory / 1e6:.0f} Mo")
+    print(f"requête : p50 {statistics.median(latencies) * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms, "
+          f"référence voulue trouvée {found}/{args.queries}")
+
+
+if __name__ == "__main__":
+    main()
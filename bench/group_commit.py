@@ -0,0 +1,106 @@
+"""
+عدد عمليات commit مع وبدون group commit، تحت رفع صغير متكرر من عملاء كثيرين
+(كل خيط = عميل GF يرسل بضعة سطور ثم ينتظر قليلاً).
+
+    python bench/group_commit.py [--tenants 32] [--lines 5] [--duration 10] [--think-ms 20]
+
+كل وضع في عملية جديدة وقاعدة مؤقتة جديدة. النتيجة: رفع/ثانية، commit/ثانية،
+سطور لكل commit، وزمن الرفع p50/p99.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, sys, threading, time
+sys.path.insert(0, {root!r})
+import gf_server as g
+from sqlalchemy import event
+
+g.init_db()
+
+commits = [0]
+@event.listens_for(g.engine, "commit")
+def count_commit(conn):
+    commits[0] += 1
+
+lock = threading.Lock()
+latencies = []
+errors = [0]
+deadline = time.monotonic() + {duration}
+
+
+def tenant(tid):
+    n = 0
+    while time.monotonic() < deadline:
+        plan = [(0, [{{"reference": "T%d-%d-%d" % (tid, n, i), "prix": i, "fournisseur": "F%d" % (i % 3)}}
+                     for i in range({lines})])]
+        n += 1
+        t0 = time.perf_counter()
+        if g.group_commit_eligible(plan):
+            saved, failed = g.ingest_grouped("T%02d" % tid, plan)
+        else:
+            saved, failed = g.ingest_chunked("T%02d" % tid, plan)
+        with lock:
+            latencies.append(time.perf_counter() - t0)
+            errors[0] += len(failed)
+        time.sleep({think_ms} / 1000.0)
+
+
+start = commits[0]
+threads = [threading.Thread(target=tenant, args=(i,)) for i in range({tenants})]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+
+latencies.sort()
+print(json.dumps({{
+    "uploads": len(latencies),
+    "commits": commits[0] - start,
+    "errors": errors[0],
+    "p50_ms": latencies[len(latencies) // 2] * 1000,
+    "p99_ms": latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000,
+}}))
+"""
+
+
+def run(grouped: bool, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   GF_GROUP_COMMIT="1" if grouped else "0",
+                   GF_DB_POOL_SIZE=str(args.tenants))
+        if not os.environ.get("DATABASE_URL"):
+            env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        code = CHILD.format(root=ROOT, duration=args.duration, lines=args.lines,
+                            tenants=args.tenants, think_ms=args.think_ms)
+        out = subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT,
+                             capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tenants", type=int, default=32)
+    parser.add_argument("--lines", type=int, default=5, help="lignes par upload")
+    parser.add_argument("--duration", type=int, default=10)
+    parser.add_argument("--think-ms", type=int, default=20, help="pause entre deux uploads")
+    args = parser.parse_args()
+
+    print(f"{args.tenants} clients × {args.lines} lignes, {args.duration} s")
+    print(f"{'mode':<8} {'uploads/s':>10} {'commits/s':>10} {'lignes/commit':>14} "
+          f"{'p50 (ms)':>9} {'p99 (ms)':>9} {'erreurs':>8}")
+    for name, grouped in (("normal", False), ("groupé", True)):
+        r = run(grouped, args)
+        per_commit = r["uploads"] * args.lines / max(1, r["commits"])
+        print(f"{name:<8} {r['uploads'] / args.duration:>10.1f} {r['commits'] / args.duration:>10.1f} "
+              f"{per_commit:>14.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+مقارنة وضع SQLite المحسّن (WAL + PRAGMAs + طابور الكاتب الواحد) بالإعدادات الافتراضية
+تحت خيوط متزامنة كما في waitress: كتّاب يرفعون دفعات صغيرة وقرّاء يبحثون.
+
+    python bench/sqlite_mode.py [--writers 4] [--readers 8] [--duration 10] [--batch 20]
+
+كل وضع في عملية جديدة وقاعدة مؤقتة جديدة. النتيجة: سطور/ثانية، بحث/ثانية،
+p99 البحث، وعدد أخطاء "database is locked".
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, sys, threading, time
+sys.path.insert(0, {root!r})
+import gf_server as g
+from sqlalchemy import text
+
+g.init_db()
+# قاعدة فيها بيانات مسبقاً حتى يكون للبحث عمل حقيقي
+g.import_rows(g.TEST_CLIENT_ID, [["reference", "designation", "prix", "fournisseur"]] +
+              [["REF%06d" % i, "Article %d" % i, "%d" % (i % 90), "F%d" % (i % 30)]
+               for i in range(20000)])
+
+deadline = time.monotonic() + {duration}
+lock = threading.Lock()
+stats = {{"lines": 0, "searches": 0, "locked": 0, "errors": 0, "latencies": []}}
+
+
+def record(key, n=1):
+    with lock:
+        stats[key] += n
+
+
+def writer(wid):
+    n = 0
+    while time.monotonic() < deadline:
+        chunk = [{{"reference": "W%d-%d-%d" % (wid, n, i), "prix": i, "fournisseur": "F%d" % wid}}
+                 for i in range({batch})]
+        n += 1
+        saved, failed = g.ingest_chunked(g.TEST_CLIENT_ID, [(0, chunk)])
+        record("lines", saved)
+        if failed:
+            record("errors")
+
+
+def reader(rid):
+    queries = ["ref01", "article 12", "f7", ""]
+    i = rid
+    while time.monotonic() < deadline:
+        sql, params, _, _ = g.build_lines_query(g.TEST_CLIENT_ID, {{"q": queries[i % len(queries)]}})
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            with g.engine.connect() as conn:
+                conn.execute(text(sql), params).fetchall()
+        except Exception as e:
+            record("locked" if "locked" in str(e) else "errors")
+            continue
+        with lock:
+            stats["searches"] += 1
+            stats["latencies"].append(time.perf_counter() - t0)
+
+
+class LockedCounter:
+    # ingest_chunked يسجّل الأخطاء في السجل: نعدّ منها "database is locked"
+    def write(self, msg):
+        if "database is locked" in msg:
+            record("locked")
+    def flush(self):
+        pass
+
+
+import logging
+logging.getLogger(g.app.logger.name).addHandler(logging.StreamHandler(LockedCounter()))
+
+threads = ([threading.Thread(target=writer, args=(i,)) for i in range({writers})] +
+           [threading.Thread(target=reader, args=(i,)) for i in range({readers})])
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+
+lat = sorted(stats.pop("latencies")) or [0]
+stats["p99_ms"] = lat[max(0, int(len(lat) * 0.99) - 1)] * 1000
+print(json.dumps(stats))
+"""
+
+
+def run(tuned: bool, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                   GF_SQLITE_TUNED="1" if tuned else "0",
+                   GF_DB_POOL_SIZE=str(args.writers + args.readers))
+        code = CHILD.format(root=ROOT, duration=args.duration, batch=args.batch,
+                            writers=args.writers, readers=args.readers)
+        out = subprocess.run([sys.executable, "-c", code], env=env, cwd=ROOT,
+                             capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--duration", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=20, help="lignes par upload")
+    args = parser.parse_args()
+
+    print(f"{args.writers} écrivains, {args.readers} lecteurs, {args.duration} s")
+    print(f"{'mode':<10} {'lignes/s':>10} {'recherches/s':>13} {'p99 (ms)':>9} "
+          f"{'locked':>7} {'erreurs':>8}")
+    for name, tuned in (("défaut", False), ("optimisé", True)):
+        r = run(tuned, args)
+        print(f"{name:<10} {r['lines'] / args.duration:>10.0f} "
+              f"{r['searches'] / args.duration:>13.1f} {r['p99_ms']:>9.1f} "
+              f"{r['locked']:>7} {r['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
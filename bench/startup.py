@@ -0,0 +1,70 @@
+"""
+قياس زمن الإقلاع البارد: استيراد gf_server + أول طلب، في عملية جديدة كل مرة.
+
+    python bench/startup.py [--runs 10]
+
+يقارن الوضع الحالي (فحص نسخة المخطط عند أول طلب) مع الوضع القديم
+(تنفيذ init_db كاملاً قبل الخدمة). يستعمل DATABASE_URL إن وُجد، وإلا SQLite مؤقتة.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+import gf_server
+t1 = time.perf_counter()
+if {eager}:
+    gf_server.init_db()
+client = gf_server.app.test_client()
+resp = client.get("/login")
+t2 = time.perf_counter()
+assert resp.status_code == 200, resp.status_code
+print(f"{{(t1 - t0) * 1000:.2f}} {{(t2 - t0) * 1000:.2f}}")
+"""
+
+
+def run(mode: str, runs: int, env: dict) -> tuple:
+    code = CHILD.format(root=ROOT, eager=(mode == "eager"))
+    imports, firsts = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], env=env,
+                             capture_output=True, text=True, check=True).stdout.split()
+        imports.append(float(out[0]))
+        firsts.append(float(out[1]))
+    return statistics.median(imports), statistics.median(firsts)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    tmp = None
+    if not env.get("DATABASE_URL"):
+        tmp = tempfile.TemporaryDirectory()
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp.name, 'bench.db')}"
+
+    # المخطط موجود مسبقاً كما في الإنتاج
+    subprocess.run([sys.executable, os.path.join(ROOT, "gf_server.py"), "migrate"],
+                   env=env, check=True, capture_output=True)
+
+    print(f"{'mode':<8} {'import (ms)':>12} {'1er requête (ms)':>18}")
+    for mode in ("lazy", "eager"):
+        imp, first = run(mode, args.runs, env)
+        print(f"{mode:<8} {imp:>12.1f} {first:>18.1f}")
+
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,47 @@
+import io
 import os
-from datetime import datetime
-
-from flask import Flask, request, jsonify, render_template_string, redirect, url_for
-from sqlalchemy import create_engine, text
+import re
+import math
+import time
+import sqlite3
+import csv
+import codecs
+import json
+import gzip
+import queue
+import zlib
+import hashlib
+import signal
+import socket
+import shutil
+import tempfile
+import argparse
+import threading
+import unicodedata
+from array import array
+from functools import lru_cache
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime, date, timedelta, timezone
+
+from flask import Flask, Response, request, jsonify, render_template_string, redirect, url_for
+from markupsafe import Markup
+from sqlalchemy import bindparam, create_engine, event, text, inspect
 from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+
+try:
+    # قراءة XLSX اختيارية (مكتبة Python خالصة)
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    # ضغط brotli اختياري للملفات الثابتة (وإلا gzip فقط)
+    import brotli
+except ImportError:
+    brotli = None
 
 # -------- إعداد مسار SQLite احتياطي (للتجريب المحلي فقط) --------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -16,7 +54,108 @@ if not DATABASE_URL:
     DATABASE_URL = f"sqlite:///{SQLITE_PATH}"
 
 # -------- تهيئة محرك SQLAlchemy --------
-engine: Engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# حجم الـ pool لكل عملية: يُفضّل أن يساوي عدد خيوط waitress
+DB_POOL_SIZE    = int(os.environ.get("GF_DB_POOL_SIZE") or 5)
+DB_MAX_OVERFLOW = int(os.environ.get("GF_DB_MAX_OVERFLOW") or 10)
+
+engine: Engine = create_engine(DATABASE_URL, pool_pre_ping=True,
+                               pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+
+def _reset_engine_after_fork():
+    # كل عملية ابن تبدأ بـ pool خاص بها ولا تلمس اتصالات الأب
+    engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_engine_after_fork)
+
+IS_SQLITE   = engine.dialect.name == "sqlite"
+IS_POSTGRES = engine.dialect.name == "postgresql"
+
+# -------- وضع SQLite المحسّن (التثبيتات المحلية بدون PostgreSQL) --------
+# GF_SQLITE_TUNED=0 → إعدادات SQLite الافتراضية القديمة (للمقارنة: bench/sqlite_mode.py)
+SQLITE_TUNED     = IS_SQLITE and os.environ.get("GF_SQLITE_TUNED", "1") != "0"
+SQLITE_BUSY_MS   = int(os.environ.get("GF_SQLITE_BUSY_MS") or 5000)
+SQLITE_CACHE_MB  = int(os.environ.get("GF_SQLITE_CACHE_MB") or 64)
+SQLITE_MMAP_MB   = int(os.environ.get("GF_SQLITE_MMAP_MB") or 256)
+
+
+def tune_sqlite_engine(eng):
+    """
+    PRAGMAs لكل اتصال جديد: WAL (القرّاء لا ينتظرون الكاتب)، synchronous=NORMAL
+    (fsync عند checkpoint فقط، آمن مع WAL)، cache وmmap أكبر، وbusy_timeout
+    بدل الخطأ الفوري "database is locked".
+    مع GF_GROUP_COMMIT=1: synchronous=FULL (الرد بعد fsync، وكلفته موزعة على المجموعة).
+    """
+    @event.listens_for(eng, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=FULL" if GROUP_COMMIT else "PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_MS}")
+        cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+        cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.close()
+
+
+if SQLITE_TUNED:
+    tune_sqlite_engine(engine)
+
+
+class WriterQueue:
+    """
+    كاتب واحد في كل مرة وبترتيب الوصول (FIFO، عكس Lock العادي)؛ القراءات لا تمر من هنا.
+    SQLite يقبل كاتباً واحداً فقط: الانتظار هنا أرخص من إعادة المحاولة على "database is locked".
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+
+    @contextmanager
+    def turn(self):
+        with self.cond:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            while ticket != self.serving:
+                self.cond.wait()
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.serving += 1
+                self.cond.notify_all()
+
+
+sqlite_writer = WriterQueue() if SQLITE_TUNED else None
+
+
+@contextmanager
+def write_transaction():
+    """engine.begin() لمسارات الكتابة؛ في وضع SQLite المحسّن تمر عبر طابور الكاتب الواحد."""
+    if sqlite_writer is None:
+        with engine.begin() as conn:
+            yield conn
+        return
+    with sqlite_writer.turn():
+        with engine.begin() as conn:
+            yield conn
+
+
+# مفتاح أساسي تلقائي حسب نوع القاعدة (SERIAL لا يولّد قيمة في SQLite)
+ID_PK = "INTEGER PRIMARY KEY AUTOINCREMENT" if IS_SQLITE else "SERIAL PRIMARY KEY"
+
+# -------- تقسيم جدول lines (PostgreSQL فقط، اختياري) --------
+# GF_PG_PARTITIONING=1      → lines مقسّم شهرياً حسب created_at
+# GF_PG_HASH_PARTITIONS=N   → كل شهر مقسّم داخلياً إلى N أجزاء حسب client_id
+# GF_PG_PARTITION_MONTHS_AHEAD → عدد الأشهر القادمة التي ننشئ أجزاءها مسبقاً
+PG_PARTITIONING           = os.environ.get("GF_PG_PARTITIONING") == "1"
+PG_HASH_PARTITIONS        = int(os.environ.get("GF_PG_HASH_PARTITIONS") or 0)
+PG_PARTITION_MONTHS_AHEAD = int(os.environ.get("GF_PG_PARTITION_MONTHS_AHEAD") or 3)
+LINES_PARTITIONED         = IS_POSTGRES and PG_PARTITIONING
 
 app = Flask(__name__)
 # مفتاح سري للـ session (استعمل قيمة حقيقية في الإنتاج من متغيّر بيئة)
@@ -30,9 +169,20 @@ TEST_API_KEY   = "TESTKEY123"
 
 # ============= DB HELPERS =============
 
+# رقم نسخة المخطط: يُرفع عند كل تغيير في init_db
+SCHEMA_VERSION = 9
+
+# GF_AUTO_MIGRATE=0 → لا ننشئ المخطط عند أول طلب (يجب تشغيل: python gf_server.py migrate)
+AUTO_MIGRATE = os.environ.get("GF_AUTO_MIGRATE", "1") != "0"
+
+
 def init_db():
-    """إنشاء الجداول إذا لم تكن موجودة في قاعدة PostgreSQL/SQLite."""
+    """إنشاء/ترحيل الجداول في قاعدة PostgreSQL/SQLite (الأمر: python gf_server.py migrate)."""
     with engine.begin() as conn:
+        if IS_POSTGRES:
+            # عمليتان تبدآن معاً لا تنفذان الترحيل في نفس الوقت
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('gf_schema'))"))
+
         # جدول العملاء
         conn.execute(text("""
             CREATE TABLE IF NOT EXISTS clients (
@@ -43,9 +193,9 @@ def init_db():
         """))
 
         # جدول الموردين
-        conn.execute(text("""
+        conn.execute(text(f"""
             CREATE TABLE IF NOT EXISTS suppliers (
-                id SERIAL PRIMARY KEY,
+                id {ID_PK},
                 client_id TEXT NOT NULL,
                 supplier_code TEXT,
                 name TEXT NOT NULL,
@@ -58,9 +208,83 @@ def init_db():
         """))
 
         # جدول السطور
+        if LINES_PARTITIONED:
+            create_partitioned_lines(conn, "lines")
+            if lines_is_partitioned(conn):
+                ensure_line_partitions(conn)
+        else:
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS lines (
+                    id {ID_PK},
+                    client_id TEXT NOT NULL,
+                    supplier_id INTEGER,
+                    reference TEXT,
+                    designation TEXT,
+                    marque TEXT,
+                    prix DOUBLE PRECISION,
+                    date TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (supplier_id) REFERENCES suppliers(id)
+                )
+            """))
+
+        if IS_SQLITE:
+            # قواعد SQLite أنشأها الإصدار الأول بـ SERIAL: id لا يُولَّد تلقائياً
+            rebuild_serial_id_table(conn, "suppliers")
+            rebuild_serial_id_table(conn, "lines")
+
+        # أعمدة أُضيفت بعد الإصدار الأول (تُضاف للقواعد القديمة أيضاً)
+        add_missing_columns(conn, "lines", LINES_EXTRA_COLUMNS)
+        add_missing_columns(conn, "suppliers", SUPPLIERS_EXTRA_COLUMNS)
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS suppliers_client_change_idx
+            ON suppliers (client_id, change_seq)
+        """))
+        if IS_SQLITE:
+            create_tenant_change_seq(conn)
+
+        # ملخص الأسعار لكل (مرجع، مورد): يُحدَّث في upload_lines
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS price_stats (
+                client_id TEXT NOT NULL,
+                reference TEXT NOT NULL,
+                supplier_id INTEGER NOT NULL,
+                last_price DOUBLE PRECISION,
+                last_date TEXT,
+                min_price DOUBLE PRECISION,
+                max_price DOUBLE PRECISION,
+                sum_price DOUBLE PRECISION,
+                price_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (client_id, reference, supplier_id)
+            )
+        """))
+        create_search_indexes(conn)
+        if IS_POSTGRES and inspect(conn).has_table("lines_legacy"):
+            # partition-lines قبل نقل أسماء الفهارس: ما زالت محجوزة على lines_legacy
+            rename_legacy_line_indexes(conn)
+        create_lines_indexes(conn)
+
+        # تاريخ الأسعار المضغوط لكل (مرجع، مورد، شهر): يملؤه الأمر compact
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS price_history (
+                client_id TEXT NOT NULL,
+                reference TEXT NOT NULL,
+                supplier_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                last_price DOUBLE PRECISION,
+                last_date TEXT,
+                min_price DOUBLE PRECISION,
+                max_price DOUBLE PRECISION,
+                sum_price DOUBLE PRECISION,
+                price_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (client_id, reference, supplier_id, month)
+            )
+        """))
+        normalize_price_dates(conn)
+        # السطور الخام بعد الضغط (compact --archive)
         conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS lines (
-                id SERIAL PRIMARY KEY,
+            CREATE TABLE IF NOT EXISTS lines_archive (
+                id BIGINT PRIMARY KEY,
                 client_id TEXT NOT NULL,
                 supplier_id INTEGER,
                 reference TEXT,
@@ -68,10 +292,30 @@ def init_db():
                 marque TEXT,
                 prix DOUBLE PRECISION,
                 date TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (supplier_id) REFERENCES suppliers(id)
+                created_at TIMESTAMP,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+
+        # إحصائيات كل عميل (عدد السطور، لكل مورد، آخر رفع): تُحدَّث في upload_lines
+        new_stats = not inspect(conn).has_table("client_stats")
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS client_stats (
+                client_id TEXT PRIMARY KEY,
+                total_lines BIGINT NOT NULL DEFAULT 0,
+                last_upload_at TIMESTAMP
+            )
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS supplier_stats (
+                client_id TEXT NOT NULL,
+                supplier_id INTEGER NOT NULL,
+                line_count BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (client_id, supplier_id)
             )
         """))
+        if new_stats:
+            rebuild_client_stats(conn)
 
         # إدخال عميل تجريبي
         conn.execute(text("""
@@ -84,6 +328,673 @@ def init_db():
             "key": TEST_API_KEY,
         })
 
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        conn.execute(text("DELETE FROM schema_version"))
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": SCHEMA_VERSION})
+
+
+def current_schema_version() -> int:
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except Exception:
+        # الجدول غير موجود → قاعدة جديدة
+        return 0
+
+
+_schema_ready = False
+_schema_lock  = threading.Lock()
+
+
+@app.before_request
+def ensure_schema():
+    """
+    فحص رخيص عند أول طلب فقط (استعلام واحد) بدل تنفيذ كل الـ DDL عند الاستيراد.
+    إن كان المخطط أقدم: نرحّله تلقائياً، أو نرجع 503 إن كان GF_AUTO_MIGRATE=0.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return None
+
+    with _schema_lock:
+        if not _schema_ready:
+            if current_schema_version() < SCHEMA_VERSION:
+                if not AUTO_MIGRATE:
+                    return jsonify({"ok": False, "error": "schema_outdated"}), 503
+                init_db()
+            _schema_ready = True
+    return None
+
+
+# -------- أعمدة إضافية (ترحيل تدريجي) --------
+# (الاسم، النوع، تعبئة السطور الموجودة: تعبير SQL أو دالة (conn, table) أو None)
+LINES_EXTRA_COLUMNS = [
+    ("change_seq", "BIGINT",
+     "id" if IS_SQLITE else "nextval('gf_change_seq')"),
+    ("date_d", "DATE", lambda conn, table: backfill_line_dates(conn, table)),
+    ("search_key", "TEXT", lambda conn, table: backfill_search_columns(conn, table)),
+]
+
+SUPPLIERS_EXTRA_COLUMNS = [
+    ("change_seq", "BIGINT",
+     "id" if IS_SQLITE else "nextval('gf_change_seq')"),
+    ("search_name", "TEXT", lambda conn, table: backfill_search_columns(conn, table)),
+]
+
+
+SERIAL_ID_RE = re.compile(r"\bid\s+SERIAL\s+PRIMARY\s+KEY\b", re.IGNORECASE)
+
+
+def rebuild_serial_id_table(conn, table: str) -> bool:
+    """
+    SQLite فقط: "id SERIAL PRIMARY KEY" ليس اسماً بديلاً لـ rowid، فيبقى id فارغاً
+    عند الإدخال (RETURNING id → None). نعيد بناء الجدول بـ INTEGER PRIMARY KEY
+    بنفس الأعمدة والبيانات؛ الصفوف بلا id تأخذ رقماً جديداً. الفهارس تُنشأ بعدها في init_db.
+    """
+    ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :t"),
+                       {"t": table}).scalar()
+    if not ddl or not SERIAL_ID_RE.search(ddl):
+        return False
+
+    new_ddl = SERIAL_ID_RE.sub(f"id {ID_PK}", ddl, count=1)
+    new_ddl = re.sub(r"^CREATE TABLE\s+\"?\w+\"?", f"CREATE TABLE {table}_rebuild", new_ddl, count=1)
+    conn.execute(text(f"DROP TABLE IF EXISTS {table}_rebuild"))
+    conn.execute(text(new_ddl))
+    conn.execute(text(f"INSERT INTO {table}_rebuild SELECT * FROM {table} ORDER BY id"))
+    conn.execute(text(f"DROP TABLE {table}"))
+    conn.execute(text(f"ALTER TABLE {table}_rebuild RENAME TO {table}"))
+    app.logger.warning("table %s reconstruite (id SERIAL → INTEGER PRIMARY KEY)", table)
+    return True
+
+
+def add_missing_columns(conn, table: str, columns: list) -> list:
+    """
+    إضافة الأعمدة الناقصة إلى جدول موجود ثم تعبئتها مرة واحدة (عند الإضافة فقط)،
+    حتى لا يتكرر مسح الجدول في كل تشغيل. يرجع أسماء الأعمدة المُضافة.
+    """
+    if IS_POSTGRES:
+        conn.execute(text("CREATE SEQUENCE IF NOT EXISTS gf_change_seq"))
+
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    added = []
+    for name, ddl_type, backfill in columns:
+        if name in existing:
+            continue
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl_type}"))
+        if callable(backfill):
+            backfill(conn, table)
+        elif backfill:
+            conn.execute(text(f"UPDATE {table} SET {name} = {backfill}"))
+        added.append(name)
+    return added
+
+
+# ============= التواريخ (عمود date_d) =============
+
+# الصيغ التي يرسلها GF (ISO أولاً ثم الصيغ الفرنسية)
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%d/%m/%Y",
+    "%d/%m/%y",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%d/%m/%Y %H:%M:%S",
+    "%d/%m/%Y %H:%M",
+    "%Y/%m/%d",
+]
+
+
+class DateParser:
+    """
+    محلّل تواريخ لدفعة كاملة: يحفظ نتيجة كل نص سبق تحليله، ويجرّب أولاً
+    آخر صيغة نجحت (سطور نفس الدفعة تأتي عادةً بنفس الصيغة).
+    """
+
+    def __init__(self):
+        self.memo = {}
+        self.last_format = None
+
+    def parse(self, value) -> date:
+        if not value:
+            return None
+        value = value.strip()
+        if value in self.memo:
+            return self.memo[value]
+
+        result = None
+        formats = DATE_FORMATS if self.last_format is None else [self.last_format] + DATE_FORMATS
+        for fmt in formats:
+            try:
+                result = datetime.strptime(value, fmt).date()
+                self.last_format = fmt
+                break
+            except ValueError:
+                continue
+        if result is None:
+            try:
+                result = datetime.fromisoformat(value).date()
+            except ValueError:
+                pass
+
+        if len(self.memo) > 10000:
+            self.memo.clear()
+        self.memo[value] = result
+        return result
+
+
+def date_param(d: date):
+    """SQLite يخزن DATE كنص ISO، و psycopg2 يتعامل مع date مباشرة."""
+    if d is None:
+        return None
+    return d.isoformat() if IS_SQLITE else d
+
+
+def backfill_line_dates(conn, table: str = "lines", batch_size: int = 5000) -> int:
+    """تعبئة date_d للسطور القديمة (وتوحيد نص date إلى ISO حين ينجح التحليل)."""
+    parser = DateParser()
+    last_id = 0
+    updated = 0
+    while True:
+        rows = conn.execute(text(f"""
+            SELECT id, date FROM {table}
+            WHERE id > :last AND date_d IS NULL AND date IS NOT NULL AND date <> ''
+            ORDER BY id
+            LIMIT :n
+        """), {"last": last_id, "n": batch_size}).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        params = []
+        for line_id, raw in rows:
+            d = parser.parse(raw)
+            if d is not None:
+                params.append({"id": line_id, "d": date_param(d), "iso": d.isoformat()})
+        if params:
+            conn.execute(text(f"UPDATE {table} SET date_d = :d, date = :iso WHERE id = :id"), params)
+            updated += len(params)
+    return updated
+
+
+# ============= أعمدة البحث المُطبَّعة =============
+
+@lru_cache(maxsize=65536)
+def normalize_search(value) -> str:
+    """
+    casefold + حذف العلامات (é → e) + حذف الفواصل:
+    "Régulateur" → "regulateur"، "ABC-123" → "abc123".
+    """
+    if not value:
+        return ""
+    value = unicodedata.normalize("NFKD", str(value).casefold())
+    return "".join(ch for ch in value if ch.isalnum() and not unicodedata.combining(ch))
+
+
+def line_search_key(reference, designation, marque) -> str:
+    # "|" لا يظهر في النص المُطبَّع، فلا تتطابق كلمة عبر حقلين
+    return "|".join((normalize_search(reference),
+                     normalize_search(designation),
+                     normalize_search(marque)))
+
+
+def backfill_search_columns(conn, table: str, batch_size: int = 5000) -> int:
+    """تعبئة search_key (lines) أو search_name (suppliers) للصفوف القديمة."""
+    if table == "suppliers":
+        select_cols, column = "name", "search_name"
+        compute = normalize_search
+    else:
+        select_cols, column = "reference, designation, marque", "search_key"
+        compute = line_search_key
+
+    last_id = 0
+    updated = 0
+    while True:
+        rows = conn.execute(text(f"""
+            SELECT id, {select_cols} FROM {table}
+            WHERE id > :last AND {column} IS NULL
+            ORDER BY id
+            LIMIT :n
+        """), {"last": last_id, "n": batch_size}).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        conn.execute(text(f"UPDATE {table} SET {column} = :v WHERE id = :id"),
+                     [{"id": r[0], "v": compute(*r[1:])} for r in rows])
+        updated += len(rows)
+    return updated
+
+
+# فهارس lines (الاسم → الأعمدة)، على الجدول الأب فتشمل كل الأجزاء إن كان مقسّماً
+LINES_INDEXES = {
+    "lines_client_change_idx": "(client_id, change_seq)",
+    "lines_client_date_idx": ("(client_id, date_d DESC NULLS LAST, id DESC)" if IS_POSTGRES
+                              else "(client_id, date_d, id)"),
+    "lines_client_ref_idx": "(client_id, reference)",
+    "lines_supplier_idx": "(supplier_id)",
+}
+LINES_TRGM_INDEX = "lines_search_key_trgm_idx"
+LINES_REF_TRGM_INDEX = "lines_ref_key_trgm_idx"
+
+# نفس تطبيع normalize_search تقريباً (بدون حذف العلامات)، كتعبير يقبل فهرس GIN
+PG_REF_KEY_SQL = "regexp_replace(lower(reference), '[^[:alnum:]]', '', 'g')"
+
+
+def create_lines_indexes(conn, table: str = "lines", suffix: str = ""):
+    """
+    فهارس lines (ومنها GIN trigram إن كان pg_trgm مثبتاً).
+    suffix: أسماء مؤقتة لـ lines_new أثناء partition-lines.
+    """
+    for name, columns in LINES_INDEXES.items():
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name}{suffix} ON {table} {columns}"))
+    if IS_POSTGRES and pg_extension_installed(conn, "pg_trgm"):
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {LINES_TRGM_INDEX}{suffix}
+            ON {table} USING gin (search_key gin_trgm_ops)
+        """))
+        # مرشحو البحث التقريبي: مراجع lines نفسها (مثل RefNgramIndex على SQLite).
+        # client_id داخل فهرس GIN يتطلب btree_gin؛ بدونه يُدمج مع lines_client_ref_idx
+        lead = "client_id, " if pg_extension_installed(conn, "btree_gin") else ""
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {LINES_REF_TRGM_INDEX}{suffix}
+            ON {table} USING gin ({lead}({PG_REF_KEY_SQL}) gin_trgm_ops)
+        """))
+
+
+def rename_legacy_line_indexes(conn):
+    """فهارس lines_legacy تأخذ اللاحقة _legacy، فتتحرر أسماؤها لفهارس lines الجديد."""
+    names = conn.execute(text("""
+        SELECT indexname FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = 'lines_legacy'
+    """)).scalars().all()
+    for name in names:
+        if not name.endswith("_legacy"):
+            conn.execute(text(f"ALTER INDEX {name} RENAME TO {name}_legacy"))
+
+
+def pg_extension_installed(conn, name: str) -> bool:
+    return bool(conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = :name)"
+    ), {"name": name}).scalar())
+
+
+def create_search_indexes(conn):
+    """
+    PostgreSQL: فهارس GIN trigram تخدم LIKE '%...%' مباشرة، والبحث التقريبي في المراجع
+    (فهرس lines نفسه في create_lines_indexes).
+    SQLite: لا يوجد فهرس للبحث داخل النص؛ نكتفي بالأعمدة المُطبَّعة (بدون LOWER لكل صف)،
+    والبحث التقريبي عبر فهرس في الذاكرة (RefNgramIndex).
+    """
+    if not IS_POSTGRES:
+        return
+
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except Exception as e:
+        # المستخدم قد لا يملك صلاحية إنشاء الامتدادات
+        app.logger.warning("pg_trgm indisponible, recherche sans index trigram : %s", e)
+        return
+
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gin"))
+    except Exception as e:
+        # اختياري: فهرس المراجع التقريبي يعمل بدونه (انظر create_lines_indexes)
+        app.logger.warning("btree_gin indisponible : %s", e)
+
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS suppliers_search_name_trgm_idx
+        ON suppliers USING gin (search_name gin_trgm_ops)
+    """))
+    # كان مصدر البحث التقريبي؛ أصبح lines_ref_key_trgm_idx
+    conn.execute(text("DROP INDEX IF EXISTS price_stats_ref_trgm_idx"))
+
+
+# ============= تسلسل التغييرات (للمزامنة التفاضلية) =============
+
+def next_change_seq_sql() -> str:
+    """
+    تعبير SQL يعطي رقم التغيير التالي.
+    PostgreSQL: تسلسل مشترك. SQLite: المعامل :seq من reserve_change_seqs.
+    """
+    if IS_SQLITE:
+        return ":seq"
+    return "nextval('gf_change_seq')"
+
+
+def create_tenant_change_seq(conn):
+    """
+    SQLite: آخر رقم تغيير لكل عميل في جدول مستقل، لا MAX على lines: بعد compact
+    (أو drop-months) قد تُحذف كل سطور العميل، والمؤشر يجب ألا يرجع إلى الوراء.
+    """
+    new_table = not inspect(conn).has_table("tenant_change_seq")
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS tenant_change_seq (
+            client_id TEXT PRIMARY KEY,
+            last_seq BIGINT NOT NULL DEFAULT 0
+        )
+    """))
+    if new_table:
+        conn.execute(text("""
+            INSERT INTO tenant_change_seq (client_id, last_seq)
+            SELECT client_id, MAX(seq) FROM (
+                SELECT client_id, MAX(change_seq) AS seq FROM lines GROUP BY client_id
+                UNION ALL
+                SELECT client_id, MAX(change_seq) AS seq FROM suppliers GROUP BY client_id
+            ) t
+            WHERE seq IS NOT NULL
+            GROUP BY client_id
+        """))
+
+
+def reserve_change_seqs(conn, client_id: str, n: int) -> int:
+    """SQLite: يحجز n رقم تغيير متتالية للعميل داخل المعاملة conn، ويرجع أولها."""
+    last = conn.execute(text("""
+        INSERT INTO tenant_change_seq (client_id, last_seq) VALUES (:cid, :n)
+        ON CONFLICT (client_id) DO UPDATE SET last_seq = tenant_change_seq.last_seq + :n
+        RETURNING last_seq
+    """), {"cid": client_id, "n": n}).scalar_one()
+    return last - n + 1
+
+
+def lock_tenant_changes(conn, client_id: str):
+    """
+    نسلسل كتابات نفس العميل حتى تُرى أرقام التغيير بنفس ترتيب الـ commit:
+    بدون هذا قد يقرأ جهاز مؤشراً أكبر قبل أن تظهر معاملة أخذت رقماً أصغر.
+    """
+    if IS_POSTGRES:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:k))"),
+                     {"k": f"gf_changes:{client_id}"})
+
+
+# ============= تقسيم lines في PostgreSQL =============
+
+LINES_PARTITIONED_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id BIGINT NOT NULL DEFAULT nextval('lines_id_seq'),
+        client_id TEXT NOT NULL,
+        supplier_id INTEGER,
+        reference TEXT,
+        designation TEXT,
+        marque TEXT,
+        prix DOUBLE PRECISION,
+        date TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY ({pk}),
+        FOREIGN KEY (supplier_id) REFERENCES suppliers(id)
+    ) PARTITION BY RANGE (created_at)
+"""
+
+PARTITION_NAME_RE = re.compile(r"lines_y(\d{4})m(\d{2})")
+
+
+def _month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d: date, n: int) -> date:
+    m = d.month - 1 + n
+    return date(d.year + m // 12, m % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    # الاسم لا يعتمد على الجدول الأب حتى يبقى ثابتاً بعد ترحيل lines_new → lines
+    return f"lines_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return bool(conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1
+            FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = :t AND pg_table_is_visible(c.oid)
+        )
+    """), {"t": table}).scalar())
+
+
+def lines_is_partitioned(conn) -> bool:
+    return is_partitioned(conn, "lines")
+
+
+def create_partitioned_lines(conn, table: str = "lines"):
+    """
+    إنشاء جدول lines مقسّم (RANGE شهري على created_at، و HASH على client_id اختيارياً).
+    إن كان الجدول موجوداً وغير مقسّم لا نلمسه: التحويل يتم عبر الأمر partition-lines.
+    """
+    # مفتاح التقسيم يجب أن يكون جزءاً من المفتاح الأساسي
+    pk = "id, created_at, client_id" if PG_HASH_PARTITIONS > 0 else "id, created_at"
+    conn.execute(text("CREATE SEQUENCE IF NOT EXISTS lines_id_seq"))
+    conn.execute(text(LINES_PARTITIONED_DDL.format(table=table, pk=pk)))
+    if not is_partitioned(conn, table):
+        return
+    add_missing_columns(conn, table, LINES_EXTRA_COLUMNS)
+
+    # جزء احتياطي للقيم خارج الأشهر المُنشأة (يبقى فارغاً عادةً)
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS lines_default PARTITION OF {table} DEFAULT"))
+    # يسمح بمسح الأجزاء بالترتيب (الأحدث أولاً) لصفحة client_lines
+    conn.execute(text(f"""
+        CREATE INDEX IF NOT EXISTS lines_client_created_idx
+        ON {table} (client_id, created_at DESC, id DESC)
+    """))
+
+
+def ensure_line_partitions(conn, parent: str = "lines", first_month: date = None,
+                           months_ahead: int = None) -> int:
+    """
+    إنشاء الأجزاء الشهرية الناقصة من first_month (افتراضياً الشهر الحالي)
+    حتى months_ahead شهراً بعد الشهر الحالي. يرجع عدد الأجزاء الجديدة.
+    """
+    if months_ahead is None:
+        months_ahead = PG_PARTITION_MONTHS_AHEAD
+
+    # قفل استشاري حتى لا تتسابق عدة عمليات على إنشاء نفس الجزء
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('gf_lines_partitions'))"))
+
+    today = _month_start(datetime.utcnow().date())
+    month = _month_start(first_month or today)
+    last  = _add_months(today, months_ahead)
+
+    created = 0
+    while month <= last:
+        name = _partition_name(month)
+        exists = conn.execute(text("SELECT to_regclass(:n) IS NOT NULL"), {"n": name}).scalar()
+        if not exists:
+            bounds = (f"FOR VALUES FROM ('{month.isoformat()}') "
+                      f"TO ('{_add_months(month, 1).isoformat()}')")
+            if PG_HASH_PARTITIONS > 0:
+                conn.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF {parent} {bounds} "
+                    f"PARTITION BY HASH (client_id)"
+                ))
+                for i in range(PG_HASH_PARTITIONS):
+                    conn.execute(text(
+                        f"CREATE TABLE {name}_h{i} PARTITION OF {name} "
+                        f"FOR VALUES WITH (MODULUS {PG_HASH_PARTITIONS}, REMAINDER {i})"
+                    ))
+            else:
+                conn.execute(text(f"CREATE TABLE {name} PARTITION OF {parent} {bounds}"))
+            created += 1
+        month = _add_months(month, 1)
+
+    return created
+
+
+_partitions_checked_month = None
+
+
+def maybe_extend_line_partitions():
+    """فحص رخيص مرة واحدة في الشهر لكل عملية: ننشئ أجزاء الأشهر القادمة إن لزم."""
+    global _partitions_checked_month
+    if not LINES_PARTITIONED:
+        return
+
+    month = _month_start(datetime.utcnow().date())
+    if _partitions_checked_month == month:
+        return
+
+    with engine.begin() as conn:
+        if lines_is_partitioned(conn):
+            ensure_line_partitions(conn)
+    _partitions_checked_month = month
+
+
+def drop_line_partitions_before(before: date, log=print) -> list:
+    """
+    حذف الأشهر الأقدم من before: DETACH ثم DROP، بدون DELETE ولا VACUUM.
+    كل جزء في معاملته: عدّاداته تُطرح من client_stats/supplier_stats بمسح الجزء وحده،
+    قبل DETACH، فلا يُمسك قفل ACCESS EXCLUSIVE على lines أثناء أي مسح.
+    """
+    with engine.connect() as conn:
+        names = conn.execute(text("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = 'lines'
+        """)).scalars().all()
+
+    dropped = []
+    for name in sorted(names):
+        m = PARTITION_NAME_RE.fullmatch(name)
+        if not m or date(int(m.group(1)), int(m.group(2)), 1) >= _month_start(before):
+            continue
+        with engine.begin() as conn:
+            counts = conn.execute(text(f"""
+                SELECT client_id, supplier_id, COUNT(*) FROM {name} GROUP BY client_id, supplier_id
+            """)).all()
+            subtract_client_stats(conn, counts)
+            conn.execute(text(f"ALTER TABLE lines DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+        log(f"supprimée : {name} ({sum(n for _, _, n in counts)} lignes)")
+        dropped.append(name)
+    return dropped
+
+
+def _table_columns(conn, table: str) -> list:
+    return conn.execute(text("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name = :t AND table_schema = current_schema()
+        ORDER BY ordinal_position
+    """), {"t": table}).scalars().all()
+
+
+def wait_for_open_transactions(log=print, poll: float = 0.5):
+    """
+    ينتظر انتهاء كل معاملة كانت مفتوحة لحظة الاستدعاء (xid < xmax اللقطة الحالية).
+    معاملة طويلة (idle in transaction) تؤخر الترحيل: نسجّلها بدل الانتظار بصمت.
+    """
+    with engine.connect() as conn:
+        horizon = conn.execute(text("SELECT txid_snapshot_xmax(txid_current_snapshot())")).scalar()
+    started = time.monotonic()
+    next_log = started + 10
+    while True:
+        with engine.connect() as conn:
+            oldest = conn.execute(text("SELECT txid_snapshot_xmin(txid_current_snapshot())")).scalar()
+        if oldest >= horizon:
+            return
+        if time.monotonic() >= next_log:
+            log(f"attente des transactions ouvertes (xid {oldest} < {horizon}), "
+                f"{int(time.monotonic() - started)} s")
+            next_log += 10
+        time.sleep(poll)
+
+
+def migrate_lines_to_partitioned(batch_size: int = 50000, drop_legacy: bool = False,
+                                 log=print) -> int:
+    """
+    تحويل lines العادي إلى جدول مقسّم:
+    1) إنشاء lines_new المقسّم وأجزائه
+    2) نسخ السطور على دفعات حسب id (الجدول القديم يبقى قابلاً للكتابة)
+    3) بعد انتهاء المعاملات المفتوحة: نسخ السطور المتأخرة على دفعات (بدون قفل)
+    4) قفل قصير: نسخ ما أُضيف بعد آخر فحص ثم تبديل الأسماء
+    يرجع عدد السطور المنسوخة.
+    """
+    with engine.begin() as conn:
+        if lines_is_partitioned(conn):
+            log("lines est déjà partitionnée.")
+            return 0
+        create_partitioned_lines(conn, "lines_new")
+        # الأسماء النهائية ما زالت لفهارس lines القديم حتى التبديل
+        create_lines_indexes(conn, "lines_new", suffix="_new")
+        first = conn.execute(text("SELECT MIN(created_at) FROM lines")).scalar()
+        ensure_line_partitions(conn, "lines_new", first_month=first.date() if first else None)
+
+        new_cols = set(_table_columns(conn, "lines_new"))
+        cols = [c for c in _table_columns(conn, "lines") if c in new_cols]
+
+    col_list = ", ".join(cols)
+    select_list = ", ".join(
+        "COALESCE(created_at, CURRENT_TIMESTAMP)" if c == "created_at" else c for c in cols
+    )
+    copy_sql = text(f"""
+        INSERT INTO lines_new ({col_list})
+        SELECT {select_list} FROM lines
+        WHERE id > :last AND id <= :upper
+    """)
+    # نفس النسخ لكن يتخطى ما نُسخ سابقاً: للسطور التي commit بعد نسخ مجالها
+    late_sql = text(f"""
+        INSERT INTO lines_new ({col_list})
+        SELECT {select_list} FROM lines l
+        WHERE l.id > :last AND l.id <= :upper
+          AND NOT EXISTS (SELECT 1 FROM lines_new n WHERE n.id = l.id)
+    """)
+
+    def copy_batches(sql, last_id: int, until: int = None) -> tuple:
+        """نسخ id > last_id (حتى until إن وُجد) على دفعات، كل دفعة في معاملتها."""
+        n_rows = 0
+        while True:
+            with engine.begin() as conn:
+                upper = conn.execute(text("""
+                    SELECT MAX(id) FROM (
+                        SELECT id FROM lines WHERE id > :last AND id <= :until ORDER BY id LIMIT :n
+                    ) t
+                """), {"last": last_id, "until": 2 ** 62 if until is None else until,
+                      "n": batch_size}).scalar()
+                if upper is None:
+                    return last_id, n_rows
+                n_rows += conn.execute(sql, {"last": last_id, "upper": upper}).rowcount
+            last_id = upper
+            log(f"{copied + n_rows} lignes copiées (id <= {last_id})")
+
+    copied = 0
+    last_id, copied = copy_batches(copy_sql, 0)
+
+    # معاملة أخذت id قبل نسخ مجاله لكنها commit بعده لم تُنسخ في أي دفعة. كل id <= last_id
+    # حُجز قبل هذه اللحظة: بعد انتهاء كل المعاملات المفتوحة الآن، الفرق حتى last_id نهائي
+    # ويُنسخ على دفعات بدون قفل
+    wait_for_open_transactions(log)
+    checked, late = copy_batches(late_sql, 0, until=last_id)
+    if late:
+        log(f"{late} lignes validées en retard copiées")
+    copied += late
+    # ما وصل أثناء الانتظار: يبقى للقفل مجال صغير فقط
+    last_id, n = copy_batches(copy_sql, last_id)
+    copied += n
+
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE lines IN ACCESS EXCLUSIVE MODE"))
+        # تحت القفل لا كتابة مفتوحة: نكمل فقط ما بعد آخر فحص (id > checked)، عبر الفهرس
+        upper = conn.execute(text("SELECT MAX(id) FROM lines")).scalar()
+        if upper is not None and upper > checked:
+            copied += conn.execute(late_sql, {"last": checked, "upper": upper}).rowcount
+
+        conn.execute(text("ALTER TABLE lines RENAME TO lines_legacy"))
+        conn.execute(text("ALTER TABLE lines_new RENAME TO lines"))
+        # الأسماء النهائية للفهارس تنتقل من الجدول القديم إلى الجديد
+        rename_legacy_line_indexes(conn)
+        for name in (*LINES_INDEXES, LINES_TRGM_INDEX, LINES_REF_TRGM_INDEX):
+            conn.execute(text(f"ALTER INDEX IF EXISTS {name}_new RENAME TO {name}"))
+        conn.execute(text("ALTER INDEX IF EXISTS lines_new_pkey RENAME TO lines_pkey"))
+        # التسلسل ينتقل للجدول الجديد حتى لا يُحذف مع lines_legacy
+        conn.execute(text("ALTER SEQUENCE lines_id_seq OWNED BY lines.id"))
+        if drop_legacy:
+            conn.execute(text("DROP TABLE lines_legacy"))
+
+    log(f"Migration terminée : {copied} lignes.")
+    return copied
+
 
 def upsert_supplier(conn, client_id: str, supplier: dict) -> int:
     """
@@ -107,14 +1018,18 @@ def upsert_supplier(conn, client_id: str, supplier: dict) -> int:
 
     if row is None:
         # 2) غير موجود → ندخله
-        new_id = conn.execute(text("""
-            INSERT INTO suppliers (client_id, supplier_code, name, phone, email, address, notes)
-            VALUES (:cid, :code, :name, :phone, :email, :addr, :notes)
+        new_id = conn.execute(text(f"""
+            INSERT INTO suppliers (client_id, supplier_code, name, phone, email, address, notes,
+                                   search_name, change_seq)
+            VALUES (:cid, :code, :name, :phone, :email, :addr, :notes,
+                    :search_name, {next_change_seq_sql()})
             RETURNING id
         """), {
+            "seq": reserve_change_seqs(conn, client_id, 1) if IS_SQLITE else None,
             "cid": client_id,
             "code": code,
             "name": name,
+            "search_name": normalize_search(name),
             "phone": phone,
             "email": email,
             "addr": address,
@@ -138,11 +1053,14 @@ def upsert_supplier(conn, client_id: str, supplier: dict) -> int:
         new_email != cur_email or
         new_address != cur_address or
         new_notes != cur_notes):
-        conn.execute(text("""
+        conn.execute(text(f"""
             UPDATE suppliers
-            SET phone = :phone, email = :email, address = :addr, notes = :notes
+            SET phone = :phone, email = :email, address = :addr, notes = :notes,
+                change_seq = {next_change_seq_sql()}
             WHERE id = :id
         """), {
+            "seq": reserve_change_seqs(conn, client_id, 1) if IS_SQLITE else None,
+            "cid": client_id,
             "phone": new_phone,
             "email": new_email,
             "addr": new_address,
@@ -153,490 +1071,2001 @@ def upsert_supplier(conn, client_id: str, supplier: dict) -> int:
     return supplier_id
 
 
-# ============= API: استقبال السطور من GF =============
+# ============= ملخص الأسعار (price_stats) =============
+
+def _price_upsert_sql(table: str, key_columns: str, key_params: str) -> str:
+    keep_old = f"""(
+        (excluded.last_date IS NULL AND {table}.last_date IS NOT NULL)
+        OR excluded.last_date < {table}.last_date
+    )"""
+    return f"""
+    INSERT INTO {table} ({key_columns}, last_price, last_date,
+                         min_price, max_price, sum_price, price_count)
+    VALUES ({key_params}, :last_price, :last_date, :min_price, :max_price, :sum_price, :cnt)
+    ON CONFLICT ({key_columns}) DO UPDATE SET
+        min_price = CASE WHEN excluded.min_price < {table}.min_price
+                         THEN excluded.min_price ELSE {table}.min_price END,
+        max_price = CASE WHEN excluded.max_price > {table}.max_price
+                         THEN excluded.max_price ELSE {table}.max_price END,
+        sum_price   = {table}.sum_price + excluded.sum_price,
+        price_count = {table}.price_count + excluded.price_count,
+        last_price = CASE WHEN {keep_old} THEN {table}.last_price ELSE excluded.last_price END,
+        last_date  = CASE WHEN {keep_old} THEN {table}.last_date  ELSE excluded.last_date  END
+"""
 
-@app.post("/api/upload_lines")
-def upload_lines():
-    """
-    GF يرسل:
-    {
-      "client_id": "LOCAL-TEST",
-      "api_key": "TESTKEY123",
-      "lines": [...]
-    }
-    """
-    data = request.get_json(force=True)
 
-    client_id = data.get("client_id")
-    api_key   = data.get("api_key")
-    lines     = data.get("lines", [])
+PRICE_STATS_UPSERT_SQL = _price_upsert_sql(
+    "price_stats", "client_id, reference, supplier_id", ":cid, :ref, :sid")
 
-    # تحقق بسيط من العميل
-    if client_id != TEST_CLIENT_ID or api_key != TEST_API_KEY:
-        return jsonify({"ok": False, "error": "auth_failed"}), 401
+PRICE_HISTORY_UPSERT_SQL = _price_upsert_sql(
+    "price_history", "client_id, reference, supplier_id, month", ":cid, :ref, :sid, :month")
 
-    if not isinstance(lines, list) or not lines:
-        return jsonify({"ok": False, "error": "no_lines"}), 400
 
-    saved = 0
+def _to_price(value):
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
 
-    # نستخدم Transaction واحدة لكل الطلب
-    with engine.begin() as conn:
-        for line in lines:
-            ref  = (line.get("reference") or "").strip()
-            des  = (line.get("designation") or "").strip()
-            marq = (line.get("marque") or "").strip()
-            prix = line.get("prix")
-            four = (line.get("fournisseur") or "").strip()
-            date_val = (line.get("date") or "").strip()
-
-            # نحاول تحويل التاريخ للشكل YYYY-MM-DD
-            if date_val:
-                try:
-                    dt = datetime.fromisoformat(date_val)
-                    date_val = dt.date().isoformat()
-                except Exception:
-                    # نتركها كما هي إن فشل التحويل
-                    pass
-
-            supplier_obj = line.get("supplier") or {}
-            if not supplier_obj:
-                supplier_obj = {
-                    "code": four or None,
-                    "name": four or "المورد غير معروف"
-                }
 
-            supplier_id = upsert_supplier(conn, client_id, supplier_obj)
+ISO_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
 
-            conn.execute(text("""
-                INSERT INTO lines (client_id, supplier_id, reference, designation, marque, prix, date)
-                VALUES (:cid, :sid, :ref, :des, :marq, :prix, :date)
-            """), {
-                "cid": client_id,
-                "sid": supplier_id,
-                "ref": ref,
-                "des": des,
-                "marq": marq,
-                "prix": prix,
-                "date": date_val,
-            })
-            saved += 1
 
-    return jsonify({"ok": True, "saved": saved})
+def iso_date_text(value, dates: DateParser):
+    """
+    last_date يُخزَّن نصاً ويُقارن نصياً (هنا وفي upsert): لا يصح ذلك إلا بين تواريخ ISO.
+    تاريخ لا يفهمه DateParser يصبح NULL بدل أن يُقارن "31/12/2023" بـ "2024-01-05".
+    """
+    if isinstance(value, date):
+        return value.isoformat()
+    parsed = dates.parse(value) if value else None
+    return parsed.isoformat() if parsed else None
 
-LOGIN_TEMPLATE = """
-<!doctype html>
-<html lang="fr">
-<head>
-    <meta charset="utf-8">
-    <title>Connexion client - GF</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
 
-    <style>
-        :root {
-            --bg: #020617;
-            --bg-card: #020617;
-            --border: #1f2937;
-            --accent: #0ea5e9;
-            --accent-soft: #38bdf8;
-            --text-main: #e5e7eb;
-            --text-muted: #9ca3af;
-            --error: #f97373;
-        }
+def normalize_price_dates(conn):
+    """ترحيل: last_date القديمة غير ISO (نص الملف كما هو) → ISO أو NULL."""
+    dates = DateParser()
+    for table in ("price_stats", "price_history"):
+        values = conn.execute(text(f"SELECT DISTINCT last_date FROM {table} "
+                                   "WHERE last_date IS NOT NULL")).scalars().all()
+        for value in values:
+            if not ISO_DATE_RE.fullmatch(value):
+                conn.execute(text(f"UPDATE {table} SET last_date = :new WHERE last_date = :old"),
+                             {"new": iso_date_text(value, dates), "old": value})
 
-        * {
-            box-sizing: border-box;
-        }
 
-        body {
-            font-family: system-ui, -apple-system, "Segoe UI", sans-serif;
-            margin: 0;
-            padding: 0;
-            background: radial-gradient(circle at top, #0f172a, #020617);
-            color: var(--text-main);
-            min-height: 100vh;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-        }
+class PriceStatsBatch:
+    """
+    تجميع أسعار دفعة واحدة في الذاكرة ثم كتابتها بطلب upsert واحد لكل مفتاح.
+    "آخر سعر" = سعر السطر ذي التاريخ الأحدث، وعند التساوي (أو غياب التاريخ) آخر سطر وصل.
+    التواريخ تُوحَّد إلى ISO (iso_date_text) قبل أي مقارنة.
+    الحقول الإضافية (extra، مثل month) تدخل في المفتاح وفي الصف المكتوب.
+    """
+    upsert_sql = PRICE_STATS_UPSERT_SQL
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.items = {}
+        self.dates = DateParser()
+
+    def add(self, reference: str, supplier_id: int, prix, date_val, **extra):
+        price = _to_price(prix)
+        if not reference or supplier_id is None or price is None:
+            return
+        date_val = iso_date_text(date_val, self.dates)
+
+        key = (reference, supplier_id, *extra.values())
+        item = self.items.get(key)
+        if item is None:
+            self.items[key] = {
+                "cid": self.client_id, "ref": reference, "sid": supplier_id,
+                "last_price": price, "last_date": date_val,
+                "min_price": price, "max_price": price,
+                "sum_price": price, "cnt": 1,
+                **extra,
+            }
+            return
 
-        .card {
-            width: 100%;
-            max-width: 420px;
-            padding: 20px 18px 22px 18px;
-            border-radius: 18px;
-            background: var(--bg-card);
-            border: 1px solid var(--border);
-            box-shadow: 0 18px 40px rgba(15,23,42,0.8);
-        }
+        item["min_price"] = min(item["min_price"], price)
+        item["max_price"] = max(item["max_price"], price)
+        item["sum_price"] += price
+        item["cnt"] += 1
+        old_date = item["last_date"]
+        if not ((date_val is None and old_date is not None) or
+                (date_val is not None and old_date is not None and date_val < old_date)):
+            item["last_price"] = price
+            item["last_date"] = date_val
 
-        h1 {
-            margin: 0 0 4px 0;
-            font-size: 20px;
-            text-align: center;
-        }
+    def flush(self, conn):
+        if self.items:
+            conn.execute(text(self.upsert_sql), list(self.items.values()))
+        self.items = {}
 
-        .subtitle {
-            font-size: 12px;
-            color: var(--text-muted);
-            text-align: center;
-            margin-bottom: 16px;
-        }
 
-        form {
-            display: flex;
-            flex-direction: column;
-            gap: 10px;
-        }
+class PriceHistoryBatch(PriceStatsBatch):
+    """نفس التجميع لكن لكل (مرجع، مورد، شهر) في price_history."""
+    upsert_sql = PRICE_HISTORY_UPSERT_SQL
 
-        label {
-            font-size: 12px;
-            color: var(--text-muted);
-            margin-bottom: 2px;
-        }
 
-        input[type="text"],
-        input[type="password"] {
-            width: 100%;
-            padding: 9px 11px;
-            border-radius: 999px;
-            border: 1px solid #1e293b;
-            background: #020617;
-            color: var(--text-main);
-            font-size: 14px;
-            outline: none;
-        }
+def rebuild_price_stats(conn, client_id: str = None) -> int:
+    """
+    إعادة حساب price_stats من جدول lines (للتعبئة الأولى أو بعد تصحيح البيانات)،
+    مع إضافة ملخصات price_history للسطور التي ضُغطت.
+    """
+    where = "WHERE prix IS NOT NULL AND supplier_id IS NOT NULL AND reference <> ''"
+    params = {}
+    if client_id:
+        where += " AND client_id = :cid"
+        params["cid"] = client_id
+
+    conn.execute(text("DELETE FROM price_stats" + (" WHERE client_id = :cid" if client_id else "")),
+                 params)
+    # date_d هو التاريخ المحلَّل: على PostgreSQL نص DATE يتبع DateStyle، فنثبّت ISO
+    max_iso_date = "MAX(date_d)" if IS_SQLITE else "to_char(MAX(date_d), 'YYYY-MM-DD')"
+    conn.execute(text(f"""
+        INSERT INTO price_stats (client_id, reference, supplier_id, last_date,
+                                 min_price, max_price, sum_price, price_count)
+        SELECT client_id, reference, supplier_id, {max_iso_date},
+               MIN(prix), MAX(prix), SUM(prix), COUNT(*)
+        FROM lines
+        {where}
+        GROUP BY client_id, reference, supplier_id
+    """), params)
+    # نفس قاعدة "آخر سعر" المستعملة في PriceStatsBatch
+    conn.execute(text(f"""
+        UPDATE price_stats SET last_price = (
+            SELECT l.prix FROM lines l
+            WHERE l.client_id = price_stats.client_id
+              AND l.reference = price_stats.reference
+              AND l.supplier_id = price_stats.supplier_id
+              AND l.prix IS NOT NULL
+            ORDER BY (l.date_d IS NULL), l.date_d DESC, l.id DESC
+            LIMIT 1
+        )
+        {"WHERE client_id = :cid" if client_id else ""}
+    """), params)
+    history = conn.execute(text(f"""
+        SELECT client_id AS cid, reference AS ref, supplier_id AS sid, last_price, last_date,
+               min_price, max_price, sum_price, price_count AS cnt
+        FROM price_history
+        {"WHERE client_id = :cid" if client_id else ""}
+    """), params).mappings().all()
+    if history:
+        conn.execute(text(PRICE_STATS_UPSERT_SQL), [dict(h) for h in history])
+    return conn.execute(text("SELECT COUNT(*) FROM price_stats" +
+                             (" WHERE client_id = :cid" if client_id else "")), params).scalar()
+
+
+# ============= إحصائيات العميل (client_stats / supplier_stats) =============
+
+CLIENT_STATS_UPSERT_SQL = """
+    INSERT INTO client_stats (client_id, total_lines, last_upload_at)
+    VALUES (:cid, :cnt, CURRENT_TIMESTAMP)
+    ON CONFLICT (client_id) DO UPDATE SET
+        total_lines = client_stats.total_lines + excluded.total_lines,
+        last_upload_at = excluded.last_upload_at
+"""
 
-        input::placeholder {
-            color: var(--text-muted);
-        }
+SUPPLIER_STATS_UPSERT_SQL = """
+    INSERT INTO supplier_stats (client_id, supplier_id, line_count)
+    VALUES (:cid, :sid, :cnt)
+    ON CONFLICT (client_id, supplier_id) DO UPDATE SET
+        line_count = supplier_stats.line_count + excluded.line_count
+"""
 
-        button {
-            margin-top: 6px;
-            border: none;
-            border-radius: 999px;
-            padding: 9px 12px;
-            background: linear-gradient(135deg, #38bdf8, #0ea5e9);
-            color: #fff;
-            font-size: 14px;
-            font-weight: 600;
-        }
 
-        .error {
-            margin-top: 8px;
-            font-size: 12px;
-            color: var(--error);
-            text-align: center;
-        }
+def add_client_stats(conn, client_id: str, rows: list):
+    """زيادة العدّادات بسطور الدفعة (نفس المعاملة التي تُدخل السطور)."""
+    per_supplier = {}
+    for row in rows:
+        per_supplier[row["sid"]] = per_supplier.get(row["sid"], 0) + 1
 
-        .footer {
-            margin-top: 14px;
-            font-size: 11px;
-            color: var(--text-muted);
-            text-align: center;
-        }
-    </style>
-</head>
-<body>
-<div class="card">
-    <h1>Connexion client</h1>
-    <div class="subtitle">
-        AminosTech© Gestion Fournisseur — Vue mobile
-    </div>
+    conn.execute(text(CLIENT_STATS_UPSERT_SQL), {"cid": client_id, "cnt": len(rows)})
+    conn.execute(text(SUPPLIER_STATS_UPSERT_SQL), [
+        {"cid": client_id, "sid": sid, "cnt": cnt} for sid, cnt in per_supplier.items()
+    ])
 
-    <form method="post">
-        <div>
-            <label for="client_id">Client ID</label>
-            <input type="text" id="client_id" name="client_id"
-                   value="{{ client_id or '' }}"
-                   placeholder="Ex: LOCAL-TEST" autocomplete="off">
-        </div>
 
-        <div>
-            <label for="api_key">API Key</label>
-            <input type="password" id="api_key" name="api_key"
-                   placeholder="Clé API fournie par AminosTech">
-        </div>
+def subtract_client_stats(conn, counts: list):
+    """طرح سطور محذوفة (compact, drop-months) من العدّادات: counts = [(client_id, supplier_id, n)]."""
+    per_client = Counter()
+    for cid, _, n in counts:
+        per_client[cid] += n
+    if per_client:
+        conn.execute(text("""
+            UPDATE client_stats SET total_lines = total_lines - :n WHERE client_id = :cid
+        """), [{"cid": cid, "n": n} for cid, n in per_client.items()])
+    per_supplier = [{"cid": cid, "sid": sid, "n": n} for cid, sid, n in counts if sid is not None]
+    if per_supplier:
+        conn.execute(text("""
+            UPDATE supplier_stats SET line_count = line_count - :n
+            WHERE client_id = :cid AND supplier_id = :sid
+        """), per_supplier)
+
+
+def rebuild_client_stats(conn, client_id: str = None) -> int:
+    """إعادة حساب العدّادات من جدول lines (التعبئة الأولى، أو الأمر rebuild-stats)."""
+    # WHERE دائماً: SQLite يشترطه في INSERT ... SELECT ... ON CONFLICT
+    where = "WHERE client_id = :cid" if client_id else "WHERE 1 = 1"
+    params = {"cid": client_id} if client_id else {}
+
+    conn.execute(text(f"DELETE FROM supplier_stats {where}"), params)
+    conn.execute(text(f"""
+        INSERT INTO supplier_stats (client_id, supplier_id, line_count)
+        SELECT client_id, supplier_id, COUNT(*)
+        FROM lines
+        {where} AND supplier_id IS NOT NULL
+        GROUP BY client_id, supplier_id
+    """), params)
+
+    # last_upload_at يبقى كما هو؛ العملاء بلا سطور يصبح عددهم 0
+    conn.execute(text(f"UPDATE client_stats SET total_lines = 0 {where}"), params)
+    conn.execute(text(f"""
+        INSERT INTO client_stats (client_id, total_lines, last_upload_at)
+        SELECT client_id, COUNT(*), MAX(created_at)
+        FROM lines
+        {where}
+        GROUP BY client_id
+        ON CONFLICT (client_id) DO UPDATE SET total_lines = excluded.total_lines
+    """), params)
+    return conn.execute(text(f"SELECT COUNT(*) FROM client_stats {where}"), params).scalar()
+
+
+# ============= الضغط والاحتفاظ (compact) =============
+
+# السطور الأقدم من GF_COMPACT_AFTER_DAYS (حسب created_at) تُطوى في price_history
+COMPACT_AFTER_DAYS = int(os.environ.get("GF_COMPACT_AFTER_DAYS") or 365)
+COMPACT_BATCH      = int(os.environ.get("GF_COMPACT_BATCH") or 2000)
+# استراحة بين الدفعات حتى تمر عمليات الرفع (طابور الكاتب في SQLite، الأقفال في PostgreSQL)
+COMPACT_PAUSE      = float(os.environ.get("GF_COMPACT_PAUSE") or 0.05)
+
+LINES_ARCHIVE_COLUMNS = "id, client_id, supplier_id, reference, designation, marque, prix, date, created_at"
+
+
+def _ids_statement(sql: str):
+    # نفس أسلوب ids_filter: ANY(:ids) في PostgreSQL، IN موسّع في SQLite
+    stmt = text(sql.format(ids="= ANY(:ids)" if IS_POSTGRES else "IN :ids"))
+    if not IS_POSTGRES:
+        stmt = stmt.bindparams(bindparam("ids", expanding=True))
+    return stmt
+
+
+def _history_month(date_d, created_at) -> str:
+    # شهر السطر حسب تاريخه التجاري، وإلا تاريخ الإدخال
+    return str(date_d or created_at)[:7]
+
+
+def compact_batch(conn, cutoff, batch_size: int, client_id: str = None,
+                  archive: bool = False) -> int:
+    """دفعة واحدة: تجميع في price_history، أرشفة اختيارية، حذف، وتحديث العدّادات."""
+    params = {"cutoff": cutoff if IS_POSTGRES else cutoff.strftime("%Y-%m-%d %H:%M:%S"),
+              "limit": batch_size}
+    where = "created_at < :cutoff"
+    if client_id:
+        where += " AND client_id = :cid"
+        params["cid"] = client_id
+
+    rows = conn.execute(text(f"""
+        SELECT id, client_id, supplier_id, reference, prix, date, date_d, created_at
+        FROM lines
+        WHERE {where}
+        ORDER BY id
+        LIMIT :limit
+    """), params).mappings().all()
+    if not rows:
+        return 0
+
+    batches = {}
+    counts = Counter()
+    for r in rows:
+        cid = r["client_id"]
+        if cid not in batches:
+            batches[cid] = PriceHistoryBatch(cid)
+        batches[cid].add(r["reference"], r["supplier_id"], r["prix"], r["date_d"],
+                         month=_history_month(r["date_d"], r["created_at"]))
+        counts[(cid, r["supplier_id"])] += 1
+
+    for batch in batches.values():
+        batch.flush(conn)
+
+    ids = [r["id"] for r in rows]
+    if archive:
+        conn.execute(_ids_statement(f"""
+            INSERT INTO lines_archive ({LINES_ARCHIVE_COLUMNS})
+            SELECT {LINES_ARCHIVE_COLUMNS} FROM lines WHERE id {{ids}} AND created_at < :cutoff
+        """), {"ids": ids, "cutoff": params["cutoff"]})
+    # created_at يحدّ الأجزاء الممسوحة عندما يكون lines مقسّماً
+    conn.execute(_ids_statement("DELETE FROM lines WHERE id {ids} AND created_at < :cutoff"),
+                 {"ids": ids, "cutoff": params["cutoff"]})
+
+    subtract_client_stats(conn, [(cid, sid, n) for (cid, sid), n in counts.items()])
+    return len(rows)
+
+
+def vacuum_analyze():
+    """استرجاع المساحة وتحديث إحصائيات المخطِّط (خارج أي معاملة)."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if IS_POSTGRES:
+            for table in ("lines", "price_history", "lines_archive"):
+                conn.execute(text(f"VACUUM (ANALYZE) {table}"))
+        else:
+            conn.execute(text("VACUUM"))
+            conn.execute(text("ANALYZE"))
 
-        <button type="submit">Se connecter</button>
-    </form>
 
-    {% if error %}
-        <div class="error">
-            {{ error }}
-        </div>
-    {% endif %}
+def compact_lines(older_than_days: int = None, batch_size: int = None, client_id: str = None,
+                  archive: bool = False, vacuum: bool = True) -> int:
+    """
+    طيّ السطور القديمة في price_history (min/max/آخر سعر/العدد لكل شهر) ثم حذفها،
+    دفعة صغيرة في كل معاملة حتى لا يُحجب الرفع. price_stats لا يتغير (يبقى شاملاً).
+    """
+    days = COMPACT_AFTER_DAYS if older_than_days is None else older_than_days
+    # created_at يُكتب بـ CURRENT_TIMESTAMP (UTC)، فالحد بنفس التوقيت
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    batch_size = batch_size or COMPACT_BATCH
 
-    <div class="footer">
-        Utilisez les mêmes identifiants configurés dans l'application GF.
-    </div>
-</div>
-</body>
-</html>
-"""
+    total = 0
+    while True:
+        with write_transaction() as conn:
+            n = compact_batch(conn, cutoff, batch_size, client_id, archive)
+        if not n:
+            break
+        total += n
+        metric_inc("gf_compacted_lines_total", n)
+        time.sleep(COMPACT_PAUSE)
 
-# ============= واجهة الويب (صفحة الهاتف) =============
+    if total and vacuum:
+        vacuum_analyze()
+    return total
 
-LINES_TEMPLATE = """
-<!doctype html>
-<html lang="fr">
-<head>
-    <meta charset="utf-8">
-    <title>GF - Lignes du client {{ client_id }}</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1">
 
-    <style>
-        :root {
-            --bg: #020617;
-            --bg-card: #020617;
-            --bg-card-soft: #020617;
-            --border: #1f2937;
-            --accent: #0ea5e9;
-            --accent-soft: #38bdf8;
-            --text-main: #e5e7eb;
-            --text-muted: #9ca3af;
-        }
+# ============= إدخال السطور (مشترك بين upload_lines والاستيراد) =============
 
-        * {
-            box-sizing: border-box;
-        }
+def ingest_lines(conn, client_id: str, lines: list, supplier_cache: dict = None) -> int:
+    """
+    حفظ قائمة سطور بشكل GF داخل المعاملة conn: تحديد المورد، إدخال السطور
+    دفعة واحدة (executemany) وتحديث price_stats وclient_stats. يرجع عدد السطور المحفوظة.
+    supplier_cache يحفظ supplier_id لكل مورد سبق حله (يمكن تمريره بين الدفعات).
+    """
+    if supplier_cache is None:
+        supplier_cache = {}
+
+    lock_tenant_changes(conn, client_id)
+    stats = PriceStatsBatch(client_id)
+    dates = DateParser()
+    rows = []
+
+    for line in lines:
+        ref  = (line.get("reference") or "").strip()
+        des  = (line.get("designation") or "").strip()
+        marq = (line.get("marque") or "").strip()
+        # نفس القيمة في كل المسارات (Flask، ASGI، الاستيراد): asyncpg/psycopg2 يرفضان نصاً
+        # في عمود DOUBLE PRECISION، و SQLite كان يخزنه نصاً كما هو
+        prix = _to_price(line.get("prix"))
+        four = (line.get("fournisseur") or "").strip()
+        date_val = (line.get("date") or "").strip()
+
+        # نحاول تحويل التاريخ للشكل YYYY-MM-DD (ونتركه كما هو إن فشل التحويل)
+        date_obj = dates.parse(date_val)
+        if date_obj is not None:
+            date_val = date_obj.isoformat()
+
+        supplier_obj = line.get("supplier") or {}
+        if not supplier_obj:
+            supplier_obj = {
+                "code": four or None,
+                "name": four or "المورد غير معروف"
+            }
 
-        body {
-            font-family: system-ui, -apple-system, "Segoe UI", sans-serif;
-            margin: 0;
-            padding: 0;
-            background: var(--bg);
-            color: var(--text-main);
-        }
+        # نفس المورد بنفس البيانات → upsert_supplier لن يغيّر شيئاً، نستعمل النتيجة المحفوظة
+        cache_key = tuple(sorted((k, str(v)) for k, v in supplier_obj.items()))
+        supplier_id = supplier_cache.get(cache_key)
+        if supplier_id is None:
+            supplier_id = upsert_supplier(conn, client_id, supplier_obj)
+            supplier_cache[cache_key] = supplier_id
 
-        header {
-            padding: 12px 16px;
-            background: linear-gradient(135deg, #38bdf8, #0ea5e9);
-            color: white;
-            text-align: center;
-            font-weight: 600;
-            font-size: 18px;
-        }
+        rows.append({
+            "cid": client_id,
+            "sid": supplier_id,
+            "ref": ref,
+            "des": des,
+            "marq": marq,
+            "prix": prix,
+            "date": date_val,
+            "date_d": date_param(date_obj),
+            "search_key": line_search_key(ref, des, marq),
+        })
+        stats.add(ref, supplier_id, prix, date_obj)
 
-        .container {
-            max-width: 520px;
-            margin: 0 auto;
-            padding: 10px 10px 16px 10px;
-        }
+    if rows and IS_SQLITE:
+        first = reserve_change_seqs(conn, client_id, len(rows))
+        for i, row in enumerate(rows):
+            row["seq"] = first + i
 
-        .filters {
-            margin-bottom: 10px;
-        }
+    if rows:
+        conn.execute(text(f"""
+            INSERT INTO lines (client_id, supplier_id, reference, designation, marque, prix, date,
+                               date_d, search_key, change_seq)
+            VALUES (:cid, :sid, :ref, :des, :marq, :prix, :date,
+                    :date_d, :search_key, {next_change_seq_sql()})
+        """), rows)
+    stats.flush(conn)
+    if rows:
+        add_client_stats(conn, client_id, rows)
+        notify_lines_in_tx(conn, client_id)
 
-        .filters form {
-            display: flex;
-            flex-direction: row;
-            gap: 6px;
-        }
+    return len(rows)
 
-        .filters input[type="text"] {
-            flex: 1;
-            padding: 9px 11px;
-            border-radius: 999px;
-            border: 1px solid #1e293b;
-            background: #020617;
-            color: var(--text-main);
-            font-size: 14px;
-            outline: none;
-        }
 
-        .filters input[type="text"]::placeholder {
-            color: var(--text-muted);
-        }
+# ============= المقاييس (metrics) =============
 
-        .filters button {
-            border: none;
-            border-radius: 999px;
-            padding: 8px 12px;
-            background: var(--accent);
-            color: #fff;
-            font-size: 13px;
-            font-weight: 600;
-            white-space: nowrap;
-        }
+# عدّادات بسيطة داخل العملية، تُعرض بصيغة Prometheus على /metrics
+METRICS = {}
+_metrics_lock = threading.Lock()
+METRICS_TOKEN = os.environ.get("GF_METRICS_TOKEN")
 
-        .summary {
-            font-size: 12px;
-            color: var(--text-muted);
-            margin: 4px 2px 10px 2px;
-        }
 
-        .card {
-            display: block;
-            background: var(--bg-card);
-            border-radius: 16px;
-            border: 1px solid var(--border);
-            box-shadow: 0 10px 30px rgba(15,23,42,0.6);
-            padding: 10px 11px;
-            margin-bottom: 8px;
-            text-decoration: none;
-            color: inherit;
-        }
+def metric_inc(name: str, value: float = 1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        METRICS[key] = METRICS.get(key, 0) + value
 
-        .card-top {
-            display: flex;
-            justify-content: space-between;
-            align-items: baseline;
-            margin-bottom: 4px;
-        }
 
-        .ref {
-            font-size: 16px;
-            font-weight: 700;
-            letter-spacing: 0.04em;
-        }
+@app.get("/metrics")
+def metrics():
+    if METRICS_TOKEN and request.args.get("token") != METRICS_TOKEN:
+        return "Forbidden", 403
+    with _metrics_lock:
+        items = sorted(METRICS.items())
+    out = []
+    for (name, labels), value in items:
+        label_txt = ",".join(f'{k}="{v}"' for k, v in labels)
+        out.append(f"{name}{{{label_txt}}} {value}" if label_txt else f"{name} {value}")
+    return Response("\n".join(out) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+# ============= حدود الإدخال لكل عميل (admission control) =============
+
+# GF_UPLOAD_LINES_PER_SEC=0 يلغي حد المعدّل
+UPLOAD_LINES_PER_SEC  = float(os.environ.get("GF_UPLOAD_LINES_PER_SEC") or 2000)
+UPLOAD_BURST_LINES    = float(os.environ.get("GF_UPLOAD_BURST_LINES") or 20000)
+UPLOAD_MAX_CONCURRENT = int(os.environ.get("GF_UPLOAD_MAX_CONCURRENT") or 2)
+# ميزانية عامة: مجموع السطور قيد الكتابة لكل العملاء في نفس الوقت
+WRITE_BUDGET_LINES    = int(os.environ.get("GF_WRITE_BUDGET_LINES") or 100000)
+# memory (افتراضي، لكل عملية) أو sqlite (ملف محلي مشترك بين workers)
+LIMITER_BACKEND       = os.environ.get("GF_LIMITER_BACKEND") or "memory"
+LIMITER_PATH          = os.environ.get("GF_LIMITER_PATH") or os.path.join(BASE_DIR, "gf_limiter.db")
+# حجز لم يُحرَّر (worker توقف فجأة) يسقط بعد هذه المدة
+LIMITER_SLOT_TTL      = 600
+
+
+class MemoryUploadLimiter:
+    """Token bucket (سطور/ثانية) + عدد الرفع المتزامن لكل عميل + ميزانية عامة، داخل العملية."""
+
+    def __init__(self, rate, burst, max_concurrent, budget):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.buckets = {}      # client_id → (tokens, timestamp)
+        self.active = {}       # client_id → عدد الرفع الجاري
+        self.in_flight = 0     # مجموع السطور قيد الكتابة
+
+    def admit(self, client_id: str, n_lines: int):
+        """يرجع (ticket, retry_after, reason). ticket=None يعني الرفض."""
+        now = time.monotonic()
+        with self.lock:
+            if self.active.get(client_id, 0) >= self.max_concurrent:
+                return None, 1.0, "tenant_concurrency"
+            if self.in_flight > 0 and self.in_flight + n_lines > self.budget:
+                return None, 1.0, "write_budget"
+
+            if self.rate > 0:
+                tokens, ts = self.buckets.get(client_id, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - ts) * self.rate)
+                # دفعة أكبر من السعة تمر إذا كان الدلو ممتلئاً (ويصبح مديناً)
+                needed = min(n_lines, self.burst)
+                if tokens < needed:
+                    self.buckets[client_id] = (tokens, now)
+                    return None, (needed - tokens) / self.rate, "rate"
+                self.buckets[client_id] = (tokens - n_lines, now)
+
+            self.active[client_id] = self.active.get(client_id, 0) + 1
+            self.in_flight += n_lines
+        return (client_id, n_lines), 0.0, None
+
+    def release(self, ticket):
+        client_id, n_lines = ticket
+        with self.lock:
+            self.active[client_id] = max(0, self.active.get(client_id, 0) - 1)
+            self.in_flight = max(0, self.in_flight - n_lines)
+
+
+class SqliteUploadLimiter(MemoryUploadLimiter):
+    """
+    نفس القواعد لكن الحالة في ملف SQLite محلي (BEGIN IMMEDIATE)،
+    فتشترك فيها كل workers على نفس الجهاز.
+    """
 
-        .prix {
-            font-size: 15px;
-            font-weight: 600;
-            color: var(--accent-soft);
-        }
+    def __init__(self, path, *args):
+        super().__init__(*args)
+        self.path = path
+        with self._connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    client_id TEXT PRIMARY KEY, tokens REAL NOT NULL, ts REAL NOT NULL
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS slots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    client_id TEXT NOT NULL, lines INTEGER NOT NULL, expires REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def admit(self, client_id: str, n_lines: int):
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM slots WHERE expires < ?", (now,))
+            active = db.execute("SELECT COUNT(*) FROM slots WHERE client_id = ?",
+                                (client_id,)).fetchone()[0]
+            if active >= self.max_concurrent:
+                db.execute("COMMIT")
+                return None, 1.0, "tenant_concurrency"
+            in_flight = db.execute("SELECT COALESCE(SUM(lines), 0) FROM slots").fetchone()[0]
+            if in_flight > 0 and in_flight + n_lines > self.budget:
+                db.execute("COMMIT")
+                return None, 1.0, "write_budget"
+
+            if self.rate > 0:
+                row = db.execute("SELECT tokens, ts FROM buckets WHERE client_id = ?",
+                                 (client_id,)).fetchone()
+                tokens, ts = row if row else (self.burst, now)
+                tokens = min(self.burst, tokens + (now - ts) * self.rate)
+                needed = min(n_lines, self.burst)
+                if tokens < needed:
+                    db.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                               (client_id, tokens, now))
+                    db.execute("COMMIT")
+                    return None, (needed - tokens) / self.rate, "rate"
+                db.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)",
+                           (client_id, tokens - n_lines, now))
+
+            slot_id = db.execute(
+                "INSERT INTO slots (client_id, lines, expires) VALUES (?, ?, ?)",
+                (client_id, n_lines, now + LIMITER_SLOT_TTL),
+            ).lastrowid
+            db.execute("COMMIT")
+            return slot_id, 0.0, None
+        finally:
+            db.close()
+
+    def release(self, ticket):
+        db = self._connect()
+        try:
+            db.execute("DELETE FROM slots WHERE id = ?", (ticket,))
+        finally:
+            db.close()
+
+
+def make_upload_limiter():
+    args = (UPLOAD_LINES_PER_SEC, UPLOAD_BURST_LINES, UPLOAD_MAX_CONCURRENT, WRITE_BUDGET_LINES)
+    if LIMITER_BACKEND == "sqlite":
+        return SqliteUploadLimiter(LIMITER_PATH, *args)
+    return MemoryUploadLimiter(*args)
+
+
+upload_limiter = make_upload_limiter()
+
+
+def admit_upload(client_id: str, n_lines: int):
+    """يرجع (ticket, None) عند القبول، أو (None, (payload, retry_after)) عند الرفض."""
+    ticket, retry_after, reason = upload_limiter.admit(client_id, n_lines)
+    if ticket is not None:
+        return ticket, None
+    metric_inc("gf_upload_rejected_total", reason=reason)
+    retry_after = max(1, math.ceil(retry_after))
+    return None, ({"ok": False, "error": "rate_limited", "reason": reason,
+                   "retry_after": retry_after}, retry_after)
+
+
+# ============= الرفع على دفعات (commit لكل دفعة) =============
+
+# 0 = معاملة واحدة لكل الطلب (السلوك القديم، الافتراضي): التقسيم يغيّر الذرّية
+# فلا يُفعَّل إلا إذا أرسل العميل chunk_size (أو ضبطه المشغّل صراحة)
+UPLOAD_CHUNK_SIZE     = int(os.environ.get("GF_UPLOAD_CHUNK_SIZE") or 0)
+UPLOAD_CHUNK_SIZE_MAX = 20000
+
+
+def plan_upload_chunks(data: dict, lines: list):
+    """
+    تقسيم السطور إلى دفعات مرقّمة. العميل يمكنه إرسال:
+      chunk_size  (اختياري) حجم الدفعة، 0 = معاملة واحدة مهما كان عدد السطور
+      resume_from رقم أول دفعة نبدأ منها (استئناف بعد انقطاع)
+      chunks      قائمة أرقام دفعات محددة (إعادة الدفعات الفاشلة فقط)
+    يرجع (chunk_size, [(index, lines), ...]).
+    """
+    try:
+        chunk_size = data.get("chunk_size")
+        chunk_size = UPLOAD_CHUNK_SIZE if chunk_size is None else int(chunk_size)
+        resume_from = int(data.get("resume_from") or 0)
+        only = {int(i) for i in (data.get("chunks") or [])}
+    except (TypeError, ValueError):
+        raise ValueError("bad_chunk_params")
+
+    if chunk_size <= 0:
+        # الحد الأقصى لا ينطبق هنا: العميل طلب الذرّية صراحة
+        chunk_size = len(lines)
+    else:
+        chunk_size = min(chunk_size, UPLOAD_CHUNK_SIZE_MAX)
+
+    plan = []
+    for index, start in enumerate(range(0, len(lines), chunk_size)):
+        if index < resume_from or (only and index not in only):
+            continue
+        plan.append((index, lines[start:start + chunk_size]))
+    return chunk_size, plan
+
+
+def chunked_upload_result(chunk_size: int, total_chunks: int, saved: int, failed: list):
+    """
+    الرد: ok=True إن نجحت كل الدفعات. عند الفشل failed_chunks يحدد الدفعات غير المحفوظة
+    (الفاشلة و"not_attempted" بعدها) والباقي محفوظ نهائياً: الإعادة بـ chunks=[...] آمنة دائماً.
+    resume_from لا يُرسل إلا إذا كانت كل الدفعات بعده غير محفوظة (إعادتها لا تكرر سطوراً).
+    """
+    payload = {
+        "ok": not failed,
+        "saved": saved,
+        "chunk_size": chunk_size,
+        "chunks": total_chunks,
+    }
+    if failed:
+        payload["failed_chunks"] = failed
+        first = min(f["index"] for f in failed)
+        if {f["index"] for f in failed} == set(range(first, total_chunks)):
+            payload["resume_from"] = first
+        return payload, (207 if saved else 500)
+    return payload, 200
 
-        .designation {
-            font-size: 14px;
-            margin-bottom: 6px;
-        }
 
-        .meta-row {
-            display: flex;
-            flex-wrap: wrap;
-            gap: 4px;
-            align-items: center;
-            margin-bottom: 4px;
-        }
+def ingest_chunked(client_id: str, plan: list) -> tuple:
+    """
+    كل دفعة في معاملة مستقلة، بالترتيب. نتوقف عند أول دفعة فاشلة: ما قبلها محفوظ
+    نهائياً وما بعدها لم يُكتب، فتبقى resume_from علامة صادقة للاستئناف.
+    """
+    saved = 0
+    failed = []
+    supplier_cache = {}
+    for pos, (index, chunk) in enumerate(plan):
+        try:
+            with write_transaction() as conn:
+                saved += ingest_lines(conn, client_id, chunk, supplier_cache)
+            lines_committed(client_id)
+        except Exception as e:
+            app.logger.exception("upload chunk %s failed for %s", index, client_id)
+            failed.append({"index": index, "error": type(e).__name__})
+            failed.extend({"index": i, "error": "not_attempted"} for i, _ in plan[pos + 1:])
+            metric_inc("gf_upload_chunk_failed_total")
+            break
+    return saved, failed
+
+
+# ============= Group commit (رفع صغير من عدة عملاء في معاملة واحدة) =============
+
+# GF_GROUP_COMMIT=1 → الرفع الصغير (دفعة واحدة ≤ GF_GROUP_COMMIT_MAX_LINES) ينتظر بضع
+# ميلي ثوانٍ حتى تتجمع طلبات أخرى، ثم تُكتب كلها في معاملة واحدة (fsync واحد).
+# كل طلب لا يتلقى الرد إلا بعد commit المعاملة التي تحمل سطوره.
+GROUP_COMMIT           = os.environ.get("GF_GROUP_COMMIT") == "1"
+GROUP_COMMIT_WAIT_MS   = float(os.environ.get("GF_GROUP_COMMIT_WAIT_MS") or 5)
+GROUP_COMMIT_MAX_LINES = int(os.environ.get("GF_GROUP_COMMIT_MAX_LINES") or 200)
+GROUP_COMMIT_MAX_GROUP = int(os.environ.get("GF_GROUP_COMMIT_MAX_GROUP") or 5000)
+# أقصى انتظار لطلب في الطابور: بعده يُلغى (إن لم يبدأ) ويُرجع خطأ بدل تعليق خيط الطلب
+GROUP_COMMIT_TIMEOUT   = float(os.environ.get("GF_GROUP_COMMIT_TIMEOUT") or 30)
+
+
+class GroupCommitWriter:
+    """خيط كاتب واحد لكل عملية: يجمع الطلبات من الطابور ويكتبها معاً."""
+
+    def __init__(self, wait_ms: float, max_group_lines: int, timeout: float):
+        self.wait = wait_ms / 1000.0
+        self.timeout = timeout
+        self.max_group_lines = max_group_lines
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def _ensure_thread(self):
+        # الخيوط لا تنتقل عبر fork: كل worker يبدأ خيطه عند أول طلب
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid != os.getpid() or not self.thread.is_alive():
+                if self.pid != os.getpid():
+                    # طابور العملية الأم ليس لنا؛ أما بعد موت الخيط فالخيط الجديد يكمل طابوره
+                    self.queue = queue.Queue()
+                else:
+                    app.logger.error("group commit writer died, restarting")
+                    metric_inc("gf_group_commit_restarts_total")
+                self.thread = threading.Thread(target=self._run, name="gf-group-commit",
+                                               daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+
+    def ingest(self, client_id: str, lines: list) -> int:
+        """يرجع عدد السطور المحفوظة بعد commit، أو يرفع استثناء الكتابة."""
+        self._ensure_thread()
+        future = Future()
+        self.queue.put((client_id, lines, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            metric_inc("gf_group_commit_timeouts_total")
+            # لم يبدأ بعد → أُلغي ولن يُكتب أبداً، فالخطأ صادق
+            if future.cancel():
+                app.logger.error("group commit timed out after %ss for %s (not started)",
+                                 self.timeout, client_id)
+                raise
+            # بدأت كتابته: نتيجته غير معروفة بعد، فالرد بخطأ قد يكذب (سطور محفوظة يعيدها GF).
+            # ننتظر بلا مهلة؛ الخيط يحسم كل Future حتى عند توقفه (_run/finally)
+            app.logger.warning("group commit for %s still running after %ss, waiting",
+                               client_id, self.timeout)
+            return future.result()
+
+    @staticmethod
+    def _fail(group: list, error: BaseException):
+        for _, _, future in group:
+            if not future.done():
+                future.set_exception(error)
+
+    def _run(self):
+        group = []
+        try:
+            while True:
+                group = self._collect()
+                try:
+                    self._commit(group)
+                except Exception as e:
+                    # خطأ خارج معاملة الكتابة (lines_committed...): الخيط يبقى حياً
+                    app.logger.exception("group commit writer error")
+                    self._fail(group, e)
+        finally:
+            # خروج غير متوقع: لا نترك أي طلب ينتظر Future لن يُحسم
+            stopped = RuntimeError("group_commit_stopped")
+            self._fail(group, stopped)
+            while True:
+                try:
+                    self._fail([self.queue.get_nowait()], stopped)
+                except queue.Empty:
+                    break
+
+    def _collect(self) -> list:
+        while True:
+            group = [self.queue.get()]
+            # طلب أُلغي بعد انتهاء مهلته لا يُكتب
+            if group[0][2].set_running_or_notify_cancel():
+                break
+        n_lines = len(group[0][1])
+        deadline = time.monotonic() + self.wait
+        while n_lines < self.max_group_lines:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item[2].set_running_or_notify_cancel():
+                group.append(item)
+                n_lines += len(item[1])
+        return group
+
+    def _commit(self, group: list):
+        # نفس ترتيب العملاء في كل العمليات → أقفال lock_tenant_changes لا تتشابك
+        group.sort(key=lambda item: item[0])
+        try:
+            with write_transaction() as conn:
+                saved = [ingest_lines(conn, client_id, lines) for client_id, lines, _ in group]
+        except Exception:
+            app.logger.exception("group commit of %d uploads failed, retrying one by one", len(group))
+            metric_inc("gf_group_commit_fallback_total")
+            # طلب واحد سيئ لا يُسقط الآخرين: كل طلب في معاملته الخاصة
+            for client_id, lines, future in group:
+                try:
+                    with write_transaction() as conn:
+                        n = ingest_lines(conn, client_id, lines)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                lines_committed(client_id)
+                future.set_result(n)
+            return
 
-        .badge {
-            display: inline-flex;
-            align-items: center;
-            padding: 3px 8px;
-            border-radius: 999px;
-            font-size: 11px;
-            border: 1px solid #1f2937;
-            background: #020617;
-            color: var(--text-main);
-            text-decoration: none;
-        }
+        metric_inc("gf_group_commit_transactions_total")
+        metric_inc("gf_group_commit_requests_total", len(group))
+        for client_id in {item[0] for item in group}:
+            lines_committed(client_id)
+        for (_, _, future), n in zip(group, saved):
+            future.set_result(n)
 
-        .badge-marque {
-            border-color: #111827;
-        }
 
-        .badge-fournisseur {
-            border-color: var(--accent);
-        }
+group_writer = GroupCommitWriter(GROUP_COMMIT_WAIT_MS, GROUP_COMMIT_MAX_GROUP, GROUP_COMMIT_TIMEOUT)
 
-        .badge-fournisseur span.icon {
-            font-size: 13px;
-            margin-right: 4px;
-        }
 
-        .date {
-            font-size: 11px;
-            color: var(--text-muted);
-            margin-top: 2px;
-        }
+def group_commit_eligible(plan: list) -> bool:
+    return GROUP_COMMIT and len(plan) == 1 and len(plan[0][1]) <= GROUP_COMMIT_MAX_LINES
 
-        .no-data {
-            text-align: center;
-            color: var(--text-muted);
-            font-size: 14px;
-            margin-top: 30px;
-        }
 
-        footer {
-            text-align: center;
-            font-size: 11px;
-            padding-top: 10px;
-            color: var(--text-muted);
-        }
-    </style>
-</head>
+def ingest_grouped(client_id: str, plan: list) -> tuple:
+    """نفس نتيجة ingest_chunked (saved, failed) لكن عبر group_writer."""
+    index, chunk = plan[0]
+    try:
+        return group_writer.ingest(client_id, chunk), []
+    except Exception as e:
+        app.logger.exception("upload chunk %s failed for %s", index, client_id)
+        metric_inc("gf_upload_chunk_failed_total")
+        return 0, [{"index": index, "error": type(e).__name__}]
 
-<body>
-<header>
-    AminosTech© GF — Lignes du client {{ client_id }}
-</header>
 
-<div class="container">
+# ============= الأحداث الحية (Server-Sent Events) =============
 
-    <div class="filters">
-        <form method="get" id="searchForm">
-            <input type="text"
-                   id="searchInput"
-                   name="q"
-                   value="{{ q }}"
-                   autocomplete="off"
-                   placeholder="Recherche : référence, désignation, marque ou fournisseur">
-            <button type="submit">OK</button>
-        </form>
-    </div>
+SSE_MAX_CLIENTS  = int(os.environ.get("GF_SSE_MAX_CLIENTS") or 50)
+# تحت waitress كل اتصال SSE يحجز خيطاً: نترك دائماً هذا العدد للرفع والصفحات
+SSE_FREE_THREADS = int(os.environ.get("GF_SSE_FREE_THREADS") or 2)
+SSE_MAX_SECONDS  = int(os.environ.get("GF_SSE_MAX_SECONDS") or 300)
+SSE_HEARTBEAT    = 15
+SSE_BATCH        = 200
+# GF_SSE_PG_NOTIFY=1 → الإشعار عبر LISTEN/NOTIFY ليصل لكل workers (PostgreSQL فقط)
+SSE_PG_NOTIFY    = IS_POSTGRES and os.environ.get("GF_SSE_PG_NOTIFY") == "1"
+SSE_PG_CHANNEL   = "gf_lines"
 
-    <div class="summary" id="summary">
-        {{ rows|length }} lignes trouvées
-        {% if q %}
-            • filtre : « {{ q }} »
-        {% endif %}
-    </div>
 
-    <div id="linesList">
-    {% if rows|length == 0 %}
-        <div class="no-data">
-            Aucune ligne à afficher pour le moment.
-        </div>
-    {% else %}
-        {% for r in rows %}
-            <a class="card"
-               href="{{ url_for('line_detail', client_id=client_id, line_id=r['id']) }}">
-
-                <div class="card-top">
-                    <div class="ref">{{ r["reference"] or "—" }}</div>
-                    <div class="prix">
-                        {% if r["prix"] is not none %}
-                            {{ r["prix"] }}
-                        {% else %}
-                            —
-                        {% endif %}
-                    </div>
-                </div>
+class LineEventHub:
+    """
+    pub/sub داخل العملية: كل مشترك Event خاص به، والنشر يوقظ مشتركي العميل فقط.
+    الحدث لا يحمل بيانات: المشترك يقرأ السطور بعد آخر change_seq رآه.
+    """
 
-                <div class="designation">
-                    {{ r["designation"] or "" }}
-                </div>
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}   # client_id → set(threading.Event)
+        self.limit = SSE_MAX_CLIENTS
+
+    def limit_to_threads(self, threads: int):
+        """سقف الاتصالات أقل من عدد خيوط waitress (serve)، حتى لا تحجزها كلها."""
+        self.limit = max(0, min(SSE_MAX_CLIENTS, threads - SSE_FREE_THREADS))
+
+    def count(self) -> int:
+        with self.lock:
+            return sum(len(subs) for subs in self.subscribers.values())
+
+    def subscribe(self, client_id: str) -> threading.Event:
+        """Event جديد، أو None إن بلغ عدد الاتصالات السقف (الفحص والإضافة معاً)."""
+        event = threading.Event()
+        with self.lock:
+            if sum(len(subs) for subs in self.subscribers.values()) >= self.limit:
+                return None
+            self.subscribers.setdefault(client_id, set()).add(event)
+        return event
+
+    def unsubscribe(self, client_id: str, event: threading.Event):
+        with self.lock:
+            subs = self.subscribers.get(client_id)
+            if subs:
+                subs.discard(event)
+                if not subs:
+                    del self.subscribers[client_id]
+
+    def publish(self, client_id: str):
+        with self.lock:
+            subs = list(self.subscribers.get(client_id, ()))
+        for event in subs:
+            event.set()
+
+
+line_events = LineEventHub()
+_pg_listener_started = False
+_pg_listener_lock = threading.Lock()
+
+
+def notify_lines_in_tx(conn, client_id: str):
+    """PostgreSQL يسلّم NOTIFY عند الـ commit فقط، فلا يُقرأ سطر لم يُحفظ بعد."""
+    if SSE_PG_NOTIFY:
+        conn.execute(text("SELECT pg_notify(:ch, :cid)"), {"ch": SSE_PG_CHANNEL, "cid": client_id})
+
+
+def lines_committed(client_id: str):
+    """يُستدعى بعد commit سطور جديدة (في وضع NOTIFY يصل الإشعار عبر المستمع)."""
+    if HOT_PAGE:
+        hot_pages.on_commit(client_id)
+    if not SSE_PG_NOTIFY:
+        line_events.publish(client_id)
+
+
+def _pg_listen_loop():
+    import select
+
+    while True:
+        try:
+            raw = engine.raw_connection()
+            try:
+                dbapi_conn = raw.driver_connection
+                dbapi_conn.autocommit = True
+                dbapi_conn.cursor().execute(f"LISTEN {SSE_PG_CHANNEL}")
+                while True:
+                    if select.select([dbapi_conn], [], [], 60) == ([], [], []):
+                        continue
+                    dbapi_conn.poll()
+                    while dbapi_conn.notifies:
+                        line_events.publish(dbapi_conn.notifies.pop(0).payload)
+            finally:
+                raw.invalidate()
+        except Exception:
+            app.logger.exception("LISTEN %s interrompu, reconnexion", SSE_PG_CHANNEL)
+            time.sleep(5)
+
+
+def ensure_pg_listener():
+    """خيط LISTEN واحد لكل عملية، يبدأ مع أول مشترك (بعد fork)."""
+    global _pg_listener_started
+    if not SSE_PG_NOTIFY or _pg_listener_started:
+        return
+    with _pg_listener_lock:
+        if not _pg_listener_started:
+            threading.Thread(target=_pg_listen_loop, name="gf-pg-listen", daemon=True).start()
+            _pg_listener_started = True
+
+
+def fetch_new_cards(client_id: str, after_seq: int) -> list:
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT l.id, l.reference, l.designation, l.marque, l.prix, l.date, l.created_at,
+                   l.change_seq, s.name AS supplier_name
+            FROM lines l
+            LEFT JOIN suppliers s ON l.supplier_id = s.id
+            WHERE l.client_id = :cid AND l.change_seq > :after
+            ORDER BY l.change_seq
+            LIMIT :n
+        """), {"cid": client_id, "after": after_seq, "n": SSE_BATCH}).mappings().all()
+    return rows
 
-                <div class="meta-row">
-                    <div class="badge badge-marque">
-                        {{ r["marque"] or "Sans marque" }}
-                    </div>
 
-                    <div class="badge badge-fournisseur">
-                        <span class="icon">👤</span>
-                        {{ r["supplier_name"] or "Fournisseur inconnu" }}
-                    </div>
-                </div>
+def current_line_seq(client_id: str) -> int:
+    with engine.connect() as conn:
+        return conn.execute(text("""
+            SELECT COALESCE(MAX(change_seq), 0) FROM lines WHERE client_id = :cid
+        """), {"cid": client_id}).scalar()
 
-                <div class="date">
-                    Date : {{ r["date"] or "—" }} • ID: {{ r["id"] }}
-                </div>
-            </a>
-        {% endfor %}
-    {% endif %}
-    </div>
-<footer>
-    AminosTech© Gestion Fournisseur — Vue mobile (lecture seule)
-    <br>
-    <a href="{{ url_for('logout') }}"
-       style="color:#38bdf8; text-decoration:none; font-size:11px;">
-        Se déconnecter
-    </a>
-</footer>
-</div>  <!-- إغلاق container -->
 
-<script>
+@app.get("/client/<client_id>/events")
+def client_events(client_id):
+    """
+    SSE: كل سطر جديد يُرسل كحدث "line" (id = change_seq، فيستأنف المتصفح
+    تلقائياً عبر Last-Event-ID). الاتصال يُغلق بعد SSE_MAX_SECONDS ليحرر الخيط.
+    """
+    # 🔒 تحقّق من session
+    sess_id = session.get("client_id")
+    if not sess_id:
+        return redirect(url_for("login"))
+    if sess_id != client_id:
+        return "Forbidden", 403
+
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("since")
+    try:
+        resume_seq = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return "Last-Event-ID invalide", 400
+
+    ensure_pg_listener()
+    # كل اتصال SSE يحجز خيط waitress: فوق السقف نرفض، والصفحة تعيد المحاولة لاحقاً
+    event = line_events.subscribe(client_id)
+    if event is None:
+        metric_inc("gf_sse_rejected_total")
+        return Response("retry: 30000\n\n", status=503, mimetype="text/event-stream",
+                        headers={"Retry-After": "30", "Cache-Control": "no-cache"})
+    try:
+        # بعد الاشتراك: ما يُحفظ بعد هذه اللحظة سيوقظنا
+        last_seq = resume_seq if resume_seq is not None else current_line_seq(client_id)
+    except Exception:
+        line_events.unsubscribe(client_id, event)
+        raise
+
+    def generate():
+        nonlocal last_seq
+        try:
+            yield "retry: 5000\n\n"
+            deadline = time.monotonic() + SSE_MAX_SECONDS
+            catch_up = resume_seq is not None
+            while time.monotonic() < deadline:
+                if not catch_up and not event.wait(SSE_HEARTBEAT):
+                    yield ": ping\n\n"
+                    continue
+                event.clear()
+                catch_up = False
+                while True:
+                    rows = fetch_new_cards(client_id, last_seq)
+                    for r in rows:
+                        last_seq = r["change_seq"]
+                        data = json.dumps(line_json(r), default=str, ensure_ascii=False)
+                        yield f"id: {last_seq}\nevent: line\ndata: {data}\n\n"
+                    if len(rows) < SSE_BATCH:
+                        break
+        finally:
+            line_events.unsubscribe(client_id, event)
+
+    response = Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    # اتصال أُغلق قبل بدء generate(): finally لن يُنفَّذ، فنحرر المكان هنا أيضاً
+    response.call_on_close(lambda: line_events.unsubscribe(client_id, event))
+    return response
+
+
+# ============= API: استقبال السطور من GF =============
+
+@app.post("/api/upload_lines")
+def upload_lines():
+    """
+    GF يرسل:
+    {
+      "client_id": "LOCAL-TEST",
+      "api_key": "TESTKEY123",
+      "lines": [...],
+      "chunk_size": 1000,      (اختياري، الافتراضي 0 = معاملة واحدة)
+      "resume_from": 0,        (اختياري)
+      "chunks": [3, 7]         (اختياري)
+    }
+    مع chunk_size > 0 كل دفعة تُحفظ في معاملة مستقلة (انظر plan_upload_chunks).
+    """
+    data = request.get_json(force=True)
+
+    client_id = data.get("client_id")
+    api_key   = data.get("api_key")
+    lines     = data.get("lines", [])
+
+    # تحقق بسيط من العميل
+    if client_id != TEST_CLIENT_ID or api_key != TEST_API_KEY:
+        return jsonify({"ok": False, "error": "auth_failed"}), 401
+
+    if not isinstance(lines, list) or not lines:
+        return jsonify({"ok": False, "error": "no_lines"}), 400
+
+    try:
+        chunk_size, plan = plan_upload_chunks(data, lines)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    # 429 + Retry-After: عميل GF ينتظر ثم يعيد الإرسال
+    ticket, rejected = admit_upload(client_id, sum(len(chunk) for _, chunk in plan))
+    if rejected:
+        payload, retry_after = rejected
+        return jsonify(payload), 429, {"Retry-After": str(retry_after)}
+
+    try:
+        maybe_extend_line_partitions()
+        if group_commit_eligible(plan):
+            saved, failed = ingest_grouped(client_id, plan)
+        else:
+            saved, failed = ingest_chunked(client_id, plan)
+    finally:
+        upload_limiter.release(ticket)
+
+    metric_inc("gf_upload_lines_total", saved)
+    payload, status = chunked_upload_result(chunk_size, -(-len(lines) // chunk_size), saved, failed)
+    return jsonify(payload), status
+
+# ============= API: المزامنة التفاضلية (desktop / mobile) =============
+
+SYNC_BATCH_DEFAULT = int(os.environ.get("GF_SYNC_BATCH_DEFAULT") or 1000)
+SYNC_BATCH_MAX     = int(os.environ.get("GF_SYNC_BATCH_MAX") or 10000)
+
+LINES_CHANGES_COLUMNS = [
+    "change_seq", "id", "supplier_id", "reference", "designation",
+    "marque", "prix", "date", "created_at",
+]
+SUPPLIERS_CHANGES_COLUMNS = [
+    "change_seq", "id", "supplier_code", "name", "phone", "email", "address", "notes",
+]
+
+
+def check_api_key(client_id: str, api_key: str) -> bool:
+    if not client_id or not api_key:
+        return False
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            SELECT 1 FROM clients WHERE id = :cid AND api_key = :key
+        """), {"cid": client_id, "key": api_key}).fetchone()
+    return row is not None
+
+
+def api_credentials():
+    """client_id / api_key من الترويسات X-Client-Id / X-Api-Key أو من معاملات الرابط."""
+    client_id = request.headers.get("X-Client-Id") or request.args.get("client_id")
+    api_key   = request.headers.get("X-Api-Key") or request.args.get("api_key")
+    return client_id, api_key
+
+
+def stream_changes(table: str, columns: list):
+    """
+    يرجع التغييرات بعد المؤشر since بشكل مضغوط:
+    {"ok": true, "columns": [...], "rows": [[...], ...], "next": "<cursor>", "more": bool}
+    النتيجة تُقرأ عبر server-side cursor وتُرسل تدريجياً (بدون تحميلها كلها في الذاكرة).
+    """
+    client_id, api_key = api_credentials()
+    if not check_api_key(client_id, api_key):
+        return jsonify({"ok": False, "error": "auth_failed"}), 401
+
+    try:
+        since = int(request.args.get("since") or 0)
+        limit = int(request.args.get("limit") or SYNC_BATCH_DEFAULT)
+    except ValueError:
+        return jsonify({"ok": False, "error": "bad_cursor"}), 400
+    limit = max(1, min(limit, SYNC_BATCH_MAX))
+
+    sql = text(f"""
+        SELECT {", ".join(columns)}
+        FROM {table}
+        WHERE client_id = :cid AND change_seq > :since
+        ORDER BY change_seq
+        LIMIT :limit
+    """)
+    params = {"cid": client_id, "since": since, "limit": limit}
+
+    def generate():
+        last = since
+        count = 0
+        yield '{"ok":true,"columns":' + json.dumps(columns) + ',"rows":['
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=500).execute(sql, params)
+            for row in result:
+                yield ("," if count else "") + json.dumps(list(row), default=str)
+                last = row[0]
+                count += 1
+        yield '],"next":"%d","more":%s}' % (last, "true" if count >= limit else "false")
+
+    return Response(generate(), mimetype="application/json")
+
+
+@app.get("/api/lines/changes")
+def lines_changes():
+    return stream_changes("lines", LINES_CHANGES_COLUMNS)
+
+
+@app.get("/api/suppliers/changes")
+def suppliers_changes():
+    return stream_changes("suppliers", SUPPLIERS_CHANGES_COLUMNS)
+
+
+# ============= API: جلب عدة سطور / موردين بالمعرّف في طلب واحد =============
+
+API_BATCH_MAX = int(os.environ.get("GF_API_BATCH_MAX") or 500)
+
+LINES_BATCH_COLUMNS = [
+    "id", "supplier_id", "reference", "designation", "marque", "prix", "date",
+    "supplier_name", "supplier_phone", "supplier_email",
+]
+SUPPLIERS_BATCH_COLUMNS = [
+    "id", "supplier_code", "name", "phone", "email", "address", "notes", "line_count",
+]
+
+
+def api_client_allowed(client_id: str) -> bool:
+    """جلسة الويب لنفس العميل، أو X-Client-Id / X-Api-Key (تطبيق الهاتف)."""
+    if session.get("client_id") == client_id:
+        return True
+    cred_id, api_key = api_credentials()
+    return cred_id == client_id and check_api_key(cred_id, api_key)
+
+
+def parse_ids_param(value: str) -> list:
+    """"1,2,3" → [1, 2, 3] (بدون تكرار، بنفس الترتيب). ValueError إن كانت القيمة غير صالحة."""
+    ids = []
+    seen = set()
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        n = int(part)
+        if n not in seen:
+            seen.add(n)
+            ids.append(n)
+    return ids
+
+
+def ids_filter(column: str) -> str:
+    # PostgreSQL: مصفوفة واحدة (نفس نص الاستعلام مهما كان عدد المعرّفات)
+    return f"{column} = ANY(:ids)" if IS_POSTGRES else f"{column} IN :ids"
+
+
+def fetch_by_ids(client_id: str, sql: str, columns: list):
+    """
+    رد مضغوط بنفس شكل /api/*/changes:
+    {"ok": true, "columns": [...], "rows": [[...], ...], "missing": [ids]}
+    """
+    if not api_client_allowed(client_id):
+        return jsonify({"ok": False, "error": "auth_failed"}), 401
+
+    try:
+        ids = parse_ids_param(request.args.get("ids"))
+    except ValueError:
+        return jsonify({"ok": False, "error": "bad_ids"}), 400
+    if not ids:
+        return jsonify({"ok": False, "error": "no_ids"}), 400
+    if len(ids) > API_BATCH_MAX:
+        return jsonify({"ok": False, "error": "too_many_ids", "max": API_BATCH_MAX}), 400
+
+    stmt = text(sql)
+    if not IS_POSTGRES:
+        stmt = stmt.bindparams(bindparam("ids", expanding=True))
+    with engine.connect() as conn, query_deadline(conn, "api_by_ids"):
+        rows = conn.execute(stmt, {"cid": client_id, "ids": ids}).all()
+
+    found = {row[0] for row in rows}
+    return jsonify({
+        "ok": True,
+        "columns": columns,
+        "rows": [list(row) for row in rows],
+        "missing": [i for i in ids if i not in found],
+    })
+
+
+@app.get("/api/client/<client_id>/lines")
+def api_lines_by_ids(client_id):
+    return fetch_by_ids(client_id, f"""
+        SELECT l.id, l.supplier_id, l.reference, l.designation, l.marque, l.prix, l.date,
+               s.name, s.phone, s.email
+        FROM lines l
+        LEFT JOIN suppliers s ON l.supplier_id = s.id
+        WHERE l.client_id = :cid AND {ids_filter("l.id")}
+        ORDER BY l.id
+    """, LINES_BATCH_COLUMNS)
+
+
+@app.get("/api/client/<client_id>/suppliers")
+def api_suppliers_by_ids(client_id):
+    return fetch_by_ids(client_id, f"""
+        SELECT s.id, s.supplier_code, s.name, s.phone, s.email, s.address, s.notes,
+               COALESCE(st.line_count, 0)
+        FROM suppliers s
+        LEFT JOIN supplier_stats st
+               ON st.client_id = s.client_id AND st.supplier_id = s.id
+        WHERE s.client_id = :cid AND {ids_filter("s.id")}
+        ORDER BY s.id
+    """, SUPPLIERS_BATCH_COLUMNS)
+
+
+# ============= API: استيراد ملف CSV / XLSX =============
+
+IMPORT_CHUNK_SIZE = int(os.environ.get("GF_IMPORT_CHUNK_SIZE") or 2000)
+IMPORT_MAX_ERRORS = 1000
+# أثناء الاستيراد: أقصى انتظار لقبول دفعة (admit_upload) قبل التوقف بـ 429
+IMPORT_ADMIT_WAIT = float(os.environ.get("GF_IMPORT_ADMIT_WAIT") or 60)
+
+# أسماء الأعمدة المقبولة لكل حقل (بعد lower/strip)
+IMPORT_COLUMN_ALIASES = {
+    "reference":   ["reference", "référence", "ref", "réf", "code article", "code"],
+    "designation": ["designation", "désignation", "libelle", "libellé", "description"],
+    "marque":      ["marque", "brand", "fabricant"],
+    "prix":        ["prix", "price", "prix unitaire", "pu"],
+    "fournisseur": ["fournisseur", "supplier", "vendeur"],
+    "date":        ["date", "date achat", "date d'achat"],
+}
+
+
+def _map_import_header(header: list, overrides: dict) -> dict:
+    """يرجع {اسم_الحقل: رقم_العمود} حسب رأس الملف (وتعيين اختياري من الطلب)."""
+    names = [str(h or "").strip().lower() for h in header]
+    mapping = {}
+    for field, aliases in IMPORT_COLUMN_ALIASES.items():
+        wanted = [overrides[field].strip().lower()] if overrides.get(field) else aliases
+        for alias in wanted:
+            if alias in names:
+                mapping[field] = names.index(alias)
+                break
+    return mapping
+
+
+PRICE_GROUPS_RE = {sep: re.compile(r"\d{1,3}(?:%s\d{3})+" % re.escape(sep)) for sep in ",."}
+
+
+def _parse_import_price(value):
+    """
+    يقبل 12.5 و "12,50" و "1 234,50" و "1.234,50" و "1,234.50" و "1,234,567".
+    عند وجود الفاصلتين: الأخيرة عشرية والأولى للآلاف.
+    فاصل واحد يتبعه 3 أرقام ("1,234") غامض (1.234 أم 1234؟): ValueError بدل التخمين.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = str(value).strip().replace("\u00a0", "").replace("\u202f", "").replace(" ", "")
+    sign = ""
+    if cleaned.startswith(("+", "-")):
+        sign, cleaned = cleaned[0], cleaned[1:]
+    kinds = {c for c in cleaned if c in ",."}
+    if not kinds:
+        return float(sign + cleaned)
+
+    if len(kinds) == 2:
+        decimal_sep = max(kinds, key=cleaned.rfind)
+        whole, _, fraction = cleaned.rpartition(decimal_sep)
+        thousands_sep = "." if decimal_sep == "," else ","
+        if decimal_sep in whole:
+            raise ValueError(value)
+    else:
+        sep = kinds.pop()
+        if cleaned.count(sep) > 1:
+            # "1,234,567": الفاصل نفسه مكرر = فاصل آلاف دون جزء عشري
+            whole, fraction, thousands_sep = cleaned, "", sep
+        else:
+            whole, _, fraction = cleaned.partition(sep)
+            thousands_sep = None
+            if len(fraction) == 3 and whole.lstrip("0"):
+                raise ValueError(value)
+
+    if thousands_sep:
+        if not PRICE_GROUPS_RE[thousands_sep].fullmatch(whole):
+            raise ValueError(value)
+        whole = whole.replace(thousands_sep, "")
+    # ",5" مقبول، "," وحدها لا
+    if not (whole.isdigit() or (whole == "" and fraction)) or not (fraction.isdigit() or fraction == ""):
+        raise ValueError(value)
+    return float(f"{sign}{whole}.{fraction or 0}")
+
+
+def _csv_encoding(stream) -> str:
+    """
+    utf-8 (مع BOM أو بدونه) إن كان الملف كله صالحاً، وإلا cp1252:
+    Excel الفرنسي يصدّر CSV بـ cp1252 و errors="replace" كان يحوّل "Référence" إلى "R�f�rence".
+    يقرأ الملف كله مرة أولى ثم يعود إلى بدايته.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for block in iter(lambda: stream.read(1 << 16), b""):
+            decoder.decode(block)
+        decoder.decode(b"", final=True)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp1252"
+    finally:
+        stream.seek(0)
+
+
+def _iter_csv_rows(stream):
+    if not stream.seekable():
+        spooled = tempfile.SpooledTemporaryFile(max_size=8 << 20)
+        shutil.copyfileobj(stream, spooled)
+        spooled.seek(0)
+        stream = spooled
+    encoding = _csv_encoding(stream)
+    # cp1252 لا يعرّف 5 بايتات (0x81، 0x8D...): replace يبقى لها فقط
+    text_stream = io.TextIOWrapper(stream, encoding=encoding, errors="replace", newline="")
+    first = text_stream.readline()
+    # ملفات Excel الفرنسية تستعمل ; غالباً
+    delimiter = max([";", ",", "\t"], key=first.count)
+    yield next(csv.reader([first], delimiter=delimiter), [])
+    for row in csv.reader(text_stream, delimiter=delimiter):
+        yield row
+
+
+def _iter_xlsx_rows(stream):
+    wb = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        wb.close()
+
+
+def admit_import_chunk(client_id: str, n_lines: int, first: bool):
+    """
+    admission control لدفعة استيراد (نفس حدود upload_lines). قبل أول دفعة يرجع الرفض فوراً
+    (لا شيء محفوظ، العميل يعيد الملف كله)؛ بعدها ننتظر retry_after حتى IMPORT_ADMIT_WAIT
+    ثانية بدل ترك ملف نصف مستورد عند أول ازدحام.
+    """
+    waited = 0.0
+    while True:
+        ticket, rejected = admit_upload(client_id, n_lines)
+        if ticket is not None or first or waited >= IMPORT_ADMIT_WAIT:
+            return ticket, rejected
+        pause = min(rejected[1], IMPORT_ADMIT_WAIT - waited)
+        time.sleep(pause)
+        waited += pause
+
+
+def import_rows(client_id: str, rows, overrides: dict = None, chunk_size: int = None) -> dict:
+    """
+    تحويل صفوف الملف إلى سطور GF وحفظها على دفعات (commit لكل دفعة)،
+    مع تقرير أخطاء لكل صف. الذاكرة محدودة بحجم الدفعة.
+    كل دفعة تمر بـ admit_upload؛ عند الرفض: error=rate_limited مع saved و next_row
+    (أول صف لم يُحفظ).
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return {"ok": False, "error": "empty_file"}
+
+    mapping = _map_import_header(header, overrides or {})
+    if "reference" not in mapping:
+        return {"ok": False, "error": "missing_reference_column", "header": header}
+
+    saved = 0
+    errors = []
+    error_count = 0
+    supplier_cache = {}
+    chunk = []
+    chunk_rows = []
+
+    def report(row_no, error):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({"row": row_no, "error": error})
+
+    def cell(row, field):
+        idx = mapping.get(field)
+        if idx is None or idx >= len(row) or row[idx] is None:
+            return ""
+        value = row[idx]
+        if isinstance(value, datetime):
+            return value.date().isoformat()
+        if isinstance(value, date):
+            return value.isoformat()
+        return str(value).strip()
+
+    flushed = False
+
+    def flush():
+        """يرجع رد الرفض (payload, retry_after) إن لم تُقبل الدفعة، وإلا None."""
+        # مثل ingest_chunked: فشل دفعة لا يوقف الاستيراد، بل يُبلَّغ عن صفوفها
+        nonlocal saved, flushed
+        ticket, rejected = admit_import_chunk(client_id, len(chunk), first=not flushed)
+        if rejected:
+            return rejected
+        flushed = True
+        try:
+            maybe_extend_line_partitions()
+            with write_transaction() as conn:
+                saved += ingest_lines(conn, client_id, chunk, supplier_cache)
+            lines_committed(client_id)
+        except Exception as e:
+            app.logger.exception("import chunk (rows %s-%s) failed for %s",
+                                 chunk_rows[0], chunk_rows[-1], client_id)
+            # معرّفات الموردين المحفوظة قد تعود لمعاملة أُلغيت
+            supplier_cache.clear()
+            metric_inc("gf_upload_chunk_failed_total")
+            for row_no in chunk_rows:
+                report(row_no, "db_error:" + type(e).__name__)
+        finally:
+            upload_limiter.release(ticket)
+        chunk.clear()
+        chunk_rows.clear()
+        return None
+
+    def rate_limited(rejected):
+        payload, retry_after = rejected
+        return dict(payload, saved=saved, next_row=chunk_rows[0], error_count=error_count,
+                    errors=errors, retry_after=retry_after)
+
+    # الصف 1 هو الرأس
+    for row_no, row in enumerate(rows, start=2):
+        if not any(v not in (None, "") for v in row):
+            continue
+        try:
+            ref = cell(row, "reference")
+            if not ref:
+                raise ValueError("reference_missing")
+            idx = mapping.get("prix")
+            try:
+                prix = _parse_import_price(row[idx] if idx is not None and idx < len(row) else None)
+            except ValueError:
+                raise ValueError("bad_price")
+            chunk.append({
+                "reference":   ref,
+                "designation": cell(row, "designation"),
+                "marque":      cell(row, "marque"),
+                "prix":        prix,
+                "fournisseur": cell(row, "fournisseur"),
+                "date":        cell(row, "date"),
+            })
+            chunk_rows.append(row_no)
+        except ValueError as e:
+            report(row_no, str(e))
+            continue
+
+        if len(chunk) >= chunk_size:
+            rejected = flush()
+            if rejected:
+                return rate_limited(rejected)
+
+    if chunk:
+        rejected = flush()
+        if rejected:
+            return rate_limited(rejected)
+
+    return {"ok": True, "saved": saved, "error_count": error_count, "errors": errors}
+
+
+@app.post("/api/import_lines")
+def import_lines():
+    """
+    استيراد ملف (multipart: file=...) بصيغة CSV أو XLSX.
+    الاعتماد: client_id / api_key في الترويسات أو حقول النموذج.
+    mapping (JSON اختياري): {"reference": "Code article", ...}
+    """
+    client_id, api_key = api_credentials()
+    client_id = client_id or request.form.get("client_id")
+    api_key   = api_key or request.form.get("api_key")
+    if not check_api_key(client_id, api_key):
+        return jsonify({"ok": False, "error": "auth_failed"}), 401
+
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        return jsonify({"ok": False, "error": "no_file"}), 400
+
+    try:
+        overrides = json.loads(request.form.get("mapping") or "{}")
+    except ValueError:
+        return jsonify({"ok": False, "error": "bad_mapping"}), 400
+    # JSON صالح لكن ليس {حقل: اسم_عمود} (قائمة، أرقام...) → نفس الخطأ بدل 500
+    if not isinstance(overrides, dict) or not all(isinstance(v, str) for v in overrides.values()):
+        return jsonify({"ok": False, "error": "bad_mapping"}), 400
+
+    filename = upload.filename.lower()
+    if filename.endswith(".xlsx"):
+        if openpyxl is None:
+            return jsonify({"ok": False, "error": "xlsx_unsupported"}), 415
+        rows = _iter_xlsx_rows(upload.stream)
+    elif filename.endswith((".csv", ".txt")):
+        rows = _iter_csv_rows(upload.stream)
+    else:
+        return jsonify({"ok": False, "error": "unsupported_format"}), 415
+
+    report = import_rows(client_id, rows, overrides)
+    if report.get("error") == "rate_limited":
+        # نفس رد upload_lines: 429 + Retry-After (مع ما حُفظ قبل الرفض)
+        return jsonify(report), 429, {"Retry-After": str(report["retry_after"])}
+    return jsonify(report), (200 if report["ok"] else 400)
+
+
+# ============= الملفات الثابتة (CSS/JS) =============
+
+GF_CSS = r"""
+:root {
+    --bg: #020617;
+    --bg-card: #020617;
+    --bg-card-soft: #020617;
+    --border: #1f2937;
+    --accent: #0ea5e9;
+    --accent-soft: #38bdf8;
+    --text-main: #e5e7eb;
+    --text-muted: #9ca3af;
+    --error: #f97373;
+}
+
+* {
+    box-sizing: border-box;
+}
+
+body {
+    font-family: system-ui, -apple-system, "Segoe UI", sans-serif;
+    margin: 0;
+    padding: 0;
+    background: var(--bg);
+    color: var(--text-main);
+}
+
+/* ---- Connexion ---- */
+
+body.page-login {
+    background: radial-gradient(circle at top, #0f172a, #020617);
+    min-height: 100vh;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+}
+
+.page-login .card {
+    width: 100%;
+    max-width: 420px;
+    padding: 20px 18px 22px 18px;
+    border-radius: 18px;
+    background: var(--bg-card);
+    border: 1px solid var(--border);
+    box-shadow: 0 18px 40px rgba(15,23,42,0.8);
+}
+
+.page-login h1 {
+    margin: 0 0 4px 0;
+    font-size: 20px;
+    text-align: center;
+}
+
+.page-login .subtitle {
+    font-size: 12px;
+    color: var(--text-muted);
+    text-align: center;
+    margin-bottom: 16px;
+}
+
+.page-login form {
+    display: flex;
+    flex-direction: column;
+    gap: 10px;
+}
+
+.page-login label {
+    font-size: 12px;
+    color: var(--text-muted);
+    margin-bottom: 2px;
+}
+
+.page-login input[type="text"],
+.page-login input[type="password"],
+.filters input[type="text"] {
+    width: 100%;
+    padding: 9px 11px;
+    border-radius: 999px;
+    border: 1px solid #1e293b;
+    background: #020617;
+    color: var(--text-main);
+    font-size: 14px;
+    outline: none;
+}
+
+input::placeholder {
+    color: var(--text-muted);
+}
+
+.page-login button {
+    margin-top: 6px;
+    border: none;
+    border-radius: 999px;
+    padding: 9px 12px;
+    background: linear-gradient(135deg, #38bdf8, #0ea5e9);
+    color: #fff;
+    font-size: 14px;
+    font-weight: 600;
+}
+
+.page-login .error {
+    margin-top: 8px;
+    font-size: 12px;
+    color: var(--error);
+    text-align: center;
+}
+
+.page-login .footer {
+    margin-top: 14px;
+    font-size: 11px;
+    color: var(--text-muted);
+    text-align: center;
+}
+
+/* ---- Liste des lignes ---- */
+
+header {
+    padding: 12px 16px;
+    background: linear-gradient(135deg, #38bdf8, #0ea5e9);
+    color: white;
+    text-align: center;
+    font-weight: 600;
+    font-size: 18px;
+}
+
+.container {
+    max-width: 520px;
+    margin: 0 auto;
+    padding: 10px 10px 16px 10px;
+}
+
+.filters {
+    margin-bottom: 10px;
+}
+
+.filters form {
+    display: flex;
+    flex-direction: row;
+    gap: 6px;
+}
+
+.filters input[type="text"] {
+    flex: 1;
+}
+
+.filters button {
+    border: none;
+    border-radius: 999px;
+    padding: 8px 12px;
+    background: var(--accent);
+    color: #fff;
+    font-size: 13px;
+    font-weight: 600;
+    white-space: nowrap;
+}
+
+.summary {
+    font-size: 12px;
+    color: var(--text-muted);
+    margin: 4px 2px 10px 2px;
+}
+
+.hint {
+    margin-top: 4px;
+    color: #fbbf24;
+}
+
+.page-lines .card {
+    display: block;
+    background: var(--bg-card);
+    border-radius: 16px;
+    border: 1px solid var(--border);
+    box-shadow: 0 10px 30px rgba(15,23,42,0.6);
+    padding: 10px 11px;
+    margin-bottom: 8px;
+    text-decoration: none;
+    color: inherit;
+}
+
+.card-top {
+    display: flex;
+    justify-content: space-between;
+    align-items: baseline;
+    margin-bottom: 4px;
+}
+
+.ref {
+    font-size: 16px;
+    font-weight: 700;
+    letter-spacing: 0.04em;
+}
+
+.prix {
+    font-size: 15px;
+    font-weight: 600;
+    color: var(--accent-soft);
+}
+
+.designation {
+    font-size: 14px;
+    margin-bottom: 6px;
+}
+
+.meta-row {
+    display: flex;
+    flex-wrap: wrap;
+    gap: 4px;
+    align-items: center;
+    margin-bottom: 4px;
+}
+
+.badge {
+    display: inline-flex;
+    align-items: center;
+    padding: 3px 8px;
+    border-radius: 999px;
+    font-size: 11px;
+    border: 1px solid #1f2937;
+    background: #020617;
+    color: var(--text-main);
+    text-decoration: none;
+}
+
+.badge-marque {
+    border-color: #111827;
+}
+
+.badge-fournisseur {
+    border-color: var(--accent);
+}
+
+.badge-fournisseur span.icon {
+    font-size: 13px;
+    margin-right: 4px;
+}
+
+.date {
+    font-size: 11px;
+    color: var(--text-muted);
+    margin-top: 2px;
+}
+
+.no-data {
+    text-align: center;
+    color: var(--text-muted);
+    font-size: 14px;
+    margin-top: 30px;
+}
+
+footer {
+    text-align: center;
+    font-size: 11px;
+    padding-top: 10px;
+    color: var(--text-muted);
+}
+
+footer a {
+    color: #38bdf8;
+    text-decoration: none;
+    font-size: 11px;
+}
+
+/* ---- Fiches (ligne, fournisseur, référence) ---- */
+
+.sheet .card {
+    max-width: 520px;
+    margin: 18px auto;
+    padding: 14px 14px 16px 14px;
+    border-radius: 18px;
+    background: var(--bg-card);
+    box-shadow: 0 12px 32px rgba(15,23,42,0.7);
+    border: 1px solid var(--border);
+}
+
+.sheet h1 {
+    margin: 0 0 8px 0;
+    font-size: 20px;
+    color: #f9fafb;
+}
+
+.sheet .line {
+    margin-bottom: 8px;
+}
+
+.page-line .card {
+    padding-bottom: 18px;
+}
+
+.page-line h1 {
+    margin-bottom: 10px;
+}
+
+.page-line .line {
+    margin-bottom: 9px;
+}
+
+.label {
+    font-size: 11px;
+    color: var(--text-muted);
+    text-transform: uppercase;
+    letter-spacing: 0.06em;
+    margin-bottom: 2px;
+}
+
+.value {
+    font-size: 14px;
+}
+
+.value-strong {
+    font-size: 15px;
+    font-weight: 500;
+}
+
+.pill {
+    display: inline-block;
+    padding: 3px 9px;
+    border-radius: 999px;
+    background: var(--accent);
+    color: #fff;
+    font-size: 11px;
+}
+
+.pill-ref {
+    display: inline-block;
+    padding: 4px 10px;
+    border-radius: 999px;
+    background: #0ea5e9;
+    color: #fff;
+    font-weight: 600;
+    font-size: 13px;
+    letter-spacing: 0.05em;
+    text-decoration: none;
+}
+
+.pill-marque {
+    display: inline-block;
+    padding: 3px 9px;
+    border-radius: 999px;
+    border: 1px solid #1f2937;
+    font-size: 12px;
+}
+
+.pill-prix {
+    display: inline-block;
+    padding: 4px 10px;
+    border-radius: 999px;
+    background: #22c55e22;
+    border: 1px solid #22c55e55;
+    font-size: 13px;
+}
+
+.supplier-name {
+    font-weight: 600;
+    font-size: 14px;
+    color: inherit;
+    text-decoration: none;
+}
+
+.back {
+    display: inline-block;
+    margin-top: 12px;
+    font-size: 13px;
+    color: var(--accent);
+    text-decoration: none;
+}
+
+.page-line .back {
+    margin-top: 14px;
+}
+
+/* ---- Prix par référence ---- */
+
+.page-reference h1 {
+    margin-bottom: 4px;
+    letter-spacing: 0.04em;
+}
+
+.page-reference .subtitle {
+    font-size: 12px;
+    color: var(--text-muted);
+    margin-bottom: 12px;
+}
+
+.supplier {
+    border-top: 1px solid var(--border);
+    padding: 9px 0;
+}
+
+.supplier-top {
+    display: flex;
+    justify-content: space-between;
+    align-items: baseline;
+}
+
+.last-price {
+    font-size: 15px;
+    font-weight: 600;
+    color: var(--accent-soft);
+}
+
+.best {
+    display: inline-block;
+    margin-left: 6px;
+    padding: 1px 7px;
+    border-radius: 999px;
+    background: #22c55e22;
+    border: 1px solid #22c55e55;
+    font-size: 10px;
+}
+
+.stats {
+    font-size: 11px;
+    color: var(--text-muted);
+    margin-top: 3px;
+}
+
+.page-reference .no-data {
+    margin: 20px 0;
+}
+
+.page-reference .history-title {
+    margin: 16px 0 4px 0;
+}
+"""
+
+GF_LINES_JS = r"""
 (function () {
     const input   = document.getElementById('searchInput');
     const form    = document.getElementById('searchForm');
@@ -645,6 +3074,9 @@ LINES_TEMPLATE = """
 
     if (!input || !form || !listDiv || !summary) return;
 
+    // معرّف العميل يأتي من الصفحة (الملف نفسه مشترك ومخزّن في الكاش)
+    const base = "/client/" + encodeURIComponent(document.body.dataset.clientId);
+
     // نمنع إرسال الفورم بالطريقة التقليدية (منع reload)
     form.addEventListener('submit', function (e) {
         e.preventDefault();
@@ -659,6 +3091,45 @@ LINES_TEMPLATE = """
         } catch (e) {}
     });
 
+    // تهريب النص قبل إدراجه في HTML
+    function esc(v) {
+        return String(v).replace(/[&<>"']/g, function (c) {
+            return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"}[c];
+        });
+    }
+
+    function cardHtml(r) {
+        const ref  = r.reference || "—";
+        const prix = (r.prix !== null && r.prix !== undefined) ? r.prix : "—";
+        const des  = r.designation || "";
+        const marque = r.marque || "Sans marque";
+        const fournisseur = r.supplier_name || "Fournisseur inconnu";
+        const date = r.date || "—";
+
+        const href = `${base}/line/${r.id}` + (r.month ? `?m=${r.month}` : "");
+
+        return `
+<a class="card" data-id="${r.id}" href="${href}">
+    <div class="card-top">
+        <div class="ref">${esc(ref)}</div>
+        <div class="prix">${esc(prix)}</div>
+    </div>
+    <div class="designation">${esc(des)}</div>
+    <div class="meta-row">
+        <div class="badge badge-marque">${esc(marque)}</div>
+        <div class="badge badge-fournisseur">
+            <span class="icon">👤</span>${esc(fournisseur)}
+        </div>
+    </div>
+    <div class="date">Date : ${esc(date)} • ID: ${r.id}</div>
+</a>`;
+    }
+
+    // نفس count_label في الخادم: "10 000+"
+    function countLabel(n, capped) {
+        return String(n).replace(/\B(?=(\d{3})+(?!\d))/g, " ") + (capped ? "+" : "");
+    }
+
     let timer = null;
 
     input.addEventListener('input', function () {
@@ -671,75 +3142,344 @@ LINES_TEMPLATE = """
         }, 400); // تأخير بسيط
     });
 
-    function doSearch(query) {
-        const params = new URLSearchParams();
-        if (query.trim() !== "") {
-            params.set("q", query.trim());
-        }
-        params.set("ajax", "1");
+    function doSearch(query) {
+        const params = new URLSearchParams();
+        if (query.trim() !== "") {
+            params.set("q", query.trim());
+        }
+        params.set("ajax", "1");
+
+        // نحافظ على فلاتر الفترة والترتيب الموجودة في الرابط
+        const current = new URLSearchParams(window.location.search);
+        ["from", "to", "sort"].forEach(function (k) {
+            if (current.get(k)) params.set(k, current.get(k));
+        });
+
+        fetch(`${base}/lines?` + params.toString())
+            .then(resp => resp.json().then(rows => [rows, resp.headers]))
+            .then(([rows, headers]) => {
+                // تحديث الملخص (العدد الكلي من الترويسات، محسوب مع الصفحة)
+                const total  = parseInt(headers.get("X-Total-Count") || rows.length, 10);
+                const capped = headers.get("X-Total-Capped") === "1";
+                let txt = `<span id="matchCount" data-count="${total}" data-capped="${capped ? 1 : 0}">`
+                        + countLabel(total, capped) + "</span> lignes trouvées";
+                if (total > rows.length) {
+                    txt += " • " + rows.length + " affichées";
+                }
+                if (query.trim() !== "") {
+                    txt += " • filtre : « " + esc(query.trim()) + " »";
+                }
+                if (headers.get("X-Search-Fuzzy") === "1") {
+                    txt += '<div class="hint">Aucune référence exacte : résultats approchés pour « '
+                         + esc(query.trim()) + ' ».</div>';
+                }
+                if (headers.get("X-Search-Partial") === "1") {
+                    txt += '<div class="hint">Recherche trop large : résultats partiels'
+                         + ' (lignes récentes). Précisez votre recherche.</div>';
+                }
+                summary.innerHTML = txt;
+
+                // بناء HTML جديد للقائمة
+                if (!rows.length) {
+                    listDiv.innerHTML = `
+                        <div class="no-data">
+                            Aucune ligne à afficher pour le moment.
+                        </div>
+                    `;
+                    return;
+                }
+
+                const parts = rows.map(cardHtml);
+
+                listDiv.innerHTML = parts.join("\n");
+            })
+            .catch(err => {
+                console.error("Search error:", err);
+            });
+    }
+
+    // ===== السطور الجديدة مباشرة (SSE) بدون إعادة تحميل القائمة =====
+    function norm(v) {
+        return String(v || "").normalize("NFKD").replace(/[\u0300-\u036f]/g, "")
+            .toLowerCase().replace(/[^\p{L}\p{N}]/gu, "");
+    }
+
+    function matchesFilter(r) {
+        const current = new URLSearchParams(window.location.search);
+        if (current.get("from") || current.get("to")) return false;
+        const q = norm(input.value);
+        if (!q) return true;
+        return [r.reference, r.designation, r.marque, r.supplier_name]
+            .some(function (v) { return norm(v).indexOf(q) !== -1; });
+    }
+
+    function openEvents() {
+        const events = new EventSource(`${base}/events`);
+        events.onerror = function () {
+            // 503 (trop de connexions) ferme le flux : on réessaie plus tard
+            if (events.readyState === EventSource.CLOSED) setTimeout(openEvents, 30000);
+        };
+        events.addEventListener('line', function (e) {
+            const r = JSON.parse(e.data);
+            if (!matchesFilter(r) || listDiv.querySelector(`[data-id="${r.id}"]`)) return;
+
+            const empty = listDiv.querySelector('.no-data');
+            if (empty) empty.remove();
+            listDiv.insertAdjacentHTML('afterbegin', cardHtml(r));
+
+            const count = document.getElementById('matchCount');
+            if (count && count.dataset.capped !== "1") {
+                const n = parseInt(count.dataset.count, 10) + 1;
+                count.dataset.count = n;
+                count.textContent = countLabel(n, false);
+            }
+        });
+    }
+
+    if (window.EventSource) openEvents();
+})();
+"""
+
+# -------- خط الملفات الثابتة --------
+# كل ملف يُخدم على رابط يحمل بصمة محتواه (gf.3f2a9c1d7e.css) → يمكن تخزينه
+# في المتصفح سنة كاملة (immutable)؛ أي تعديل يغيّر البصمة وبالتالي الرابط.
+# النسخ المضغوطة (gzip، وbrotli إن كانت المكتبة مثبتة) تُحضَّر مرة واحدة عند الاستيراد.
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+
+def _minify(source: str) -> str:
+    # حذف المسافات البادئة والأسطر الفارغة فقط (آمن لـ CSS وJS معاً)
+    return "\n".join(line.strip() for line in source.splitlines() if line.strip()) + "\n"
+
+
+class StaticAsset:
+    def __init__(self, name: str, source: str, content_type: str):
+        stem, ext = os.path.splitext(name)
+        self.name = name
+        self.body = _minify(source).encode("utf-8")
+        self.digest = hashlib.sha256(self.body).hexdigest()[:12]
+        self.filename = f"{stem}.{self.digest}{ext}"
+        self.content_type = content_type
+        # ترتيب التفضيل: br ثم gzip ثم بدون ضغط
+        self.encoded = {}
+        if brotli is not None:
+            self.encoded["br"] = brotli.compress(self.body, quality=11)
+        self.encoded["gzip"] = gzip.compress(self.body, 9, mtime=0)
+
+    def pick(self, accept_encoding: str):
+        accepted = {part.split(";")[0].strip() for part in (accept_encoding or "").split(",")}
+        for encoding, data in self.encoded.items():
+            if encoding in accepted and len(data) < len(self.body):
+                return encoding, data
+        return None, self.body
+
+
+STATIC_ASSETS = {
+    asset.filename: asset
+    for asset in (
+        StaticAsset("gf.css", GF_CSS, "text/css; charset=utf-8"),
+        StaticAsset("gf-lines.js", GF_LINES_JS, "application/javascript; charset=utf-8"),
+    )
+}
+_ASSET_URLS = {asset.name: asset.filename for asset in STATIC_ASSETS.values()}
+
+
+def asset_url(name: str) -> str:
+    return url_for("static_asset", filename=_ASSET_URLS[name])
+
+
+app.jinja_env.globals["asset_url"] = asset_url
+
+
+@app.get("/assets/<filename>")
+def static_asset(filename):
+    asset = STATIC_ASSETS.get(filename)
+    if asset is None:
+        # بصمة قديمة (بعد نشر جديد) أو اسم خاطئ
+        return "Not found", 404
+
+    headers = {
+        "Cache-Control": f"public, max-age={ASSET_MAX_AGE}, immutable",
+        "ETag": f'"{asset.digest}"',
+        "Vary": "Accept-Encoding",
+    }
+    if asset.digest in (request.headers.get("If-None-Match") or ""):
+        return Response(status=304, headers=headers)
+
+    encoding, body = asset.pick(request.headers.get("Accept-Encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, content_type=asset.content_type, headers=headers)
+
+LOGIN_TEMPLATE = """
+<!doctype html>
+<html lang="fr">
+<head>
+    <meta charset="utf-8">
+    <title>Connexion client - GF</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+
+    <link rel="stylesheet" href="{{ asset_url('gf.css') }}">
+</head>
+<body class="page-login">
+<div class="card">
+    <h1>Connexion client</h1>
+    <div class="subtitle">
+        AminosTech© Gestion Fournisseur — Vue mobile
+    </div>
+
+    <form method="post">
+        <div>
+            <label for="client_id">Client ID</label>
+            <input type="text" id="client_id" name="client_id"
+                   value="{{ client_id or '' }}"
+                   placeholder="Ex: LOCAL-TEST" autocomplete="off">
+        </div>
+
+        <div>
+            <label for="api_key">API Key</label>
+            <input type="password" id="api_key" name="api_key"
+                   placeholder="Clé API fournie par AminosTech">
+        </div>
+
+        <button type="submit">Se connecter</button>
+    </form>
+
+    {% if error %}
+        <div class="error">
+            {{ error }}
+        </div>
+    {% endif %}
+
+    <div class="footer">
+        Utilisez les mêmes identifiants configurés dans l'application GF.
+    </div>
+</div>
+</body>
+</html>
+"""
+
+# ============= واجهة الويب (صفحة الهاتف) =============
+
+LINES_TEMPLATE = """
+<!doctype html>
+<html lang="fr">
+<head>
+    <meta charset="utf-8">
+    <title>GF - Lignes du client {{ client_id }}</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+
+    <link rel="stylesheet" href="{{ asset_url('gf.css') }}">
+</head>
+
+<body class="page-lines" data-client-id="{{ client_id }}">
+<header>
+    AminosTech© GF — Lignes du client {{ client_id }}
+</header>
+
+<div class="container">
+
+    <div class="filters">
+        <form method="get" id="searchForm">
+            <input type="text"
+                   id="searchInput"
+                   name="q"
+                   value="{{ q }}"
+                   autocomplete="off"
+                   placeholder="Recherche : référence, désignation, marque ou fournisseur">
+            <button type="submit">OK</button>
+        </form>
+    </div>
+
+    <div class="summary" id="summary">
+        <span id="matchCount" data-count="{{ total }}" data-capped="{{ 1 if total_capped else 0 }}">{{ total_label }}</span>
+        lignes trouvées
+        {% if total > rows|length %}
+            • {{ rows|length }} affichées
+        {% endif %}
+        {% if q %}
+            • filtre : « {{ q }} »
+        {% endif %}
+        {% if date_from or date_to %}
+            • période : {{ date_from or "…" }} → {{ date_to or "…" }}
+        {% endif %}
+        {% if fuzzy %}
+            <div class="hint">
+                Aucune référence exacte : résultats approchés pour « {{ q }} ».
+            </div>
+        {% endif %}
+        {% if partial %}
+            <div class="hint">
+                Recherche trop large : résultats partiels (lignes récentes).
+                Précisez votre recherche.
+            </div>
+        {% endif %}
+    </div>
+
+    <div id="linesList">
+    {% if rows|length == 0 %}
+        <div class="no-data">
+            Aucune ligne à afficher pour le moment.
+        </div>
+    {% else %}
+        {{ cards }}
+    {% endif %}
+    </div>
+<footer>
+    AminosTech© Gestion Fournisseur — Vue mobile (lecture seule)
+    <br>
+    <a href="{{ url_for('logout') }}">
+        Se déconnecter
+    </a>
+</footer>
+</div>  <!-- إغلاق container -->
+
+<script src="{{ asset_url('gf-lines.js') }}" defer></script>
 
-        fetch(`/client/{{ client_id }}/lines?` + params.toString())
-            .then(resp => resp.json())
-            .then(rows => {
-                // تحديث الملخص
-                let txt = rows.length + " lignes trouvées";
-                if (query.trim() !== "") {
-                    txt += " • filtre : « " + query.trim() + " »";
-                }
-                summary.textContent = txt;
+</body>
+</html>
+"""
 
-                // بناء HTML جديد للقائمة
-                if (!rows.length) {
-                    listDiv.innerHTML = `
-                        <div class="no-data">
-                            Aucune ligne à afficher pour le moment.
-                        </div>
-                    `;
-                    return;
-                }
 
-                const parts = rows.map(r => {
-                    const ref  = r.reference || "—";
-                    const prix = (r.prix !== null && r.prix !== undefined) ? r.prix : "—";
-                    const des  = r.designation || "";
-                    const marque = r.marque || "Sans marque";
-                    const fournisseur = r.supplier_name || "Fournisseur inconnu";
-                    const date = r.date || "—";
 
-                    const href = `/client/{{ client_id }}/line/${r.id}`;
+# بطاقة سطر واحدة (تُخزَّن مُصيَّرة في card_cache، انظر render_cards)
+CARD_TEMPLATE = """
+<a class="card" data-id="{{ r['id'] }}"
+   href="{{ url_for('line_detail', client_id=client_id, line_id=r['id'], m=line_month(r) or None) }}">
 
-                    return `
-<a class="card" href="${href}">
     <div class="card-top">
-        <div class="ref">${ref}</div>
-        <div class="prix">${prix}</div>
+        <div class="ref">{{ r["reference"] or "—" }}</div>
+        <div class="prix">
+            {% if r["prix"] is not none %}
+                {{ r["prix"] }}
+            {% else %}
+                —
+            {% endif %}
+        </div>
+    </div>
+
+    <div class="designation">
+        {{ r["designation"] or "" }}
     </div>
-    <div class="designation">${des}</div>
+
     <div class="meta-row">
-        <div class="badge badge-marque">${marque}</div>
+        <div class="badge badge-marque">
+            {{ r["marque"] or "Sans marque" }}
+        </div>
+
         <div class="badge badge-fournisseur">
-            <span class="icon">👤</span>${fournisseur}
+            <span class="icon">👤</span>
+            {{ r["supplier_name"] or "Fournisseur inconnu" }}
         </div>
     </div>
-    <div class="date">Date : ${date} • ID: ${r.id}</div>
-</a>`;
-                });
-
-                listDiv.innerHTML = parts.join("\\n");
-            })
-            .catch(err => {
-                console.error("Search error:", err);
-            });
-    }
-})();
-</script>
 
-</body>
-</html>
+    <div class="date">
+        Date : {{ r["date"] or "—" }} • ID: {{ r["id"] }}
+    </div>
+</a>
 """
 
 
-
 LINE_DETAIL_TEMPLATE = """
 <!doctype html>
 <html lang="fr">
@@ -748,115 +3488,23 @@ LINE_DETAIL_TEMPLATE = """
     <title>Détail de la ligne</title>
     <meta name="viewport" content="width=device-width, initial-scale=1">
 
-    <style>
-        :root {
-            --bg: #020617;
-            --bg-card: #020617;
-            --border: #1f2937;
-            --accent: #0ea5e9;
-            --text-main: #e5e7eb;
-            --text-muted: #9ca3af;
-        }
-
-        * {
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: system-ui, -apple-system, "Segoe UI", sans-serif;
-            margin: 0;
-            padding: 0;
-            background: var(--bg);
-            color: var(--text-main);
-        }
-
-        .card {
-            max-width: 520px;
-            margin: 18px auto;
-            padding: 14px 14px 18px 14px;
-            border-radius: 18px;
-            background: var(--bg-card);
-            box-shadow: 0 12px 32px rgba(15,23,42,0.7);
-            border: 1px solid var(--border);
-        }
-
-        h1 {
-            margin: 0 0 10px 0;
-            font-size: 20px;
-            color: #f9fafb;
-        }
-
-        .line {
-            margin-bottom: 9px;
-        }
-
-        .label {
-            font-size: 11px;
-            color: var(--text-muted);
-            text-transform: uppercase;
-            letter-spacing: 0.06em;
-            margin-bottom: 2px;
-        }
-
-        .value {
-            font-size: 14px;
-        }
-
-        .pill-ref {
-            display: inline-block;
-            padding: 4px 10px;
-            border-radius: 999px;
-            background: #0ea5e9;
-            color: #fff;
-            font-weight: 600;
-            font-size: 13px;
-            letter-spacing: 0.05em;
-        }
-
-        .pill-marque {
-            display: inline-block;
-            padding: 3px 9px;
-            border-radius: 999px;
-            border: 1px solid #1f2937;
-            font-size: 12px;
-        }
-
-        .pill-prix {
-            display: inline-block;
-            padding: 4px 10px;
-            border-radius: 999px;
-            background: #22c55e22;
-            border: 1px solid #22c55e55;
-            font-size: 13px;
-        }
-
-        .value-strong {
-            font-size: 15px;
-            font-weight: 500;
-        }
-
-        .back {
-            display: inline-block;
-            margin-top: 14px;
-            font-size: 13px;
-            color: var(--accent);
-            text-decoration: none;
-        }
-
-        .supplier-name {
-            font-weight: 600;
-            font-size: 14px;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('gf.css') }}">
 </head>
-<body>
+<body class="sheet page-line">
 <div class="card">
     <h1>Détail de la ligne</h1>
 
     <div class="line">
         <div class="label">Référence</div>
         <div class="value">
-            <span class="pill-ref">{{ line["reference"] or "—" }}</span>
+            {% if line["reference"] %}
+                <a class="pill-ref"
+                   href="{{ url_for('reference_prices', client_id=client_id, reference=line['reference']) }}">
+                    {{ line["reference"] }}
+                </a>
+            {% else %}
+                <span class="pill-ref">—</span>
+            {% endif %}
         </div>
     </div>
 
@@ -923,79 +3571,9 @@ SUPPLIER_TEMPLATE = """
     <title>Fiche fournisseur</title>
     <meta name="viewport" content="width=device-width, initial-scale=1">
 
-    <style>
-        :root {
-            --bg: #020617;
-            --bg-card: #020617;
-            --border: #1f2937;
-            --accent: #0ea5e9;
-            --text-main: #e5e7eb;
-            --text-muted: #9ca3af;
-        }
-
-        * {
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: system-ui, -apple-system, "Segoe UI", sans-serif;
-            margin: 0;
-            padding: 0;
-            background: var(--bg);
-            color: var(--text-main);
-        }
-
-        .card {
-            max-width: 520px;
-            margin: 18px auto;
-            padding: 14px 14px 16px 14px;
-            border-radius: 18px;
-            background: var(--bg-card);
-            box-shadow: 0 12px 32px rgba(15,23,42,0.7);
-            border: 1px solid var(--border);
-        }
-
-        h1 {
-            margin: 0 0 8px 0;
-            font-size: 20px;
-            color: #f9fafb;
-        }
-
-        .line {
-            margin-bottom: 8px;
-        }
-
-        .label {
-            font-size: 11px;
-            color: var(--text-muted);
-            text-transform: uppercase;
-            letter-spacing: 0.06em;
-            margin-bottom: 2px;
-        }
-
-        .value {
-            font-size: 14px;
-        }
-
-        .pill {
-            display: inline-block;
-            padding: 3px 9px;
-            border-radius: 999px;
-            background: var(--accent);
-            color: #fff;
-            font-size: 11px;
-        }
-
-        a.back {
-            display: inline-block;
-            margin-top: 12px;
-            font-size: 13px;
-            color: var(--accent);
-            text-decoration: none;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('gf.css') }}">
 </head>
-<body>
+<body class="sheet page-supplier">
 <div class="card">
     <h1>{{ supplier["name"] }}</h1>
 
@@ -1021,6 +3599,73 @@ SUPPLIER_TEMPLATE = """
         <div class="value">{{ supplier["notes"] or "Aucune note" }}</div>
     </div>
 
+    <div class="line">
+        <div class="label">Lignes</div>
+        <div class="value">{{ supplier["line_count"] or 0 }}</div>
+    </div>
+
+    <a class="back" href="{{ url_for('client_lines', client_id=client_id) }}">
+        ⬅ Retour aux lignes
+    </a>
+</div>
+</body>
+</html>
+"""
+
+REFERENCE_TEMPLATE = """
+<!doctype html>
+<html lang="fr">
+<head>
+    <meta charset="utf-8">
+    <title>Prix — {{ reference }}</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+
+    <link rel="stylesheet" href="{{ asset_url('gf.css') }}">
+</head>
+<body class="sheet page-reference">
+<div class="card">
+    <h1>{{ reference }}</h1>
+    <div class="subtitle">Historique des prix par fournisseur</div>
+
+    {% if not rows %}
+        <div class="no-data">Aucun prix connu pour cette référence.</div>
+    {% endif %}
+
+    {% for r in rows %}
+        <div class="supplier">
+            <div class="supplier-top">
+                <a class="supplier-name"
+                   href="{{ url_for('supplier_page', client_id=client_id, supplier_id=r['supplier_id']) }}">
+                    {{ r["supplier_name"] or "Fournisseur inconnu" }}
+                    {% if loop.first %}<span class="best">le moins cher</span>{% endif %}
+                </a>
+                <div class="last-price">{{ r["last_price"] }}</div>
+            </div>
+            <div class="stats">
+                Dernier achat : {{ r["last_date"] or "—" }}
+                • min {{ r["min_price"] }} • max {{ r["max_price"] }}
+                • moy. {{ r["avg_price"] }} • {{ r["count"] }} achat(s)
+            </div>
+        </div>
+    {% endfor %}
+
+    {% if history %}
+        <div class="subtitle history-title">Historique mensuel (lignes archivées)</div>
+        {% for h in history %}
+            <div class="supplier">
+                <div class="supplier-top">
+                    <span class="supplier-name">
+                        {{ h["month"] }} — {{ h["supplier_name"] or "Fournisseur inconnu" }}
+                    </span>
+                    <div class="last-price">{{ h["last_price"] }}</div>
+                </div>
+                <div class="stats">
+                    min {{ h["min_price"] }} • max {{ h["max_price"] }} • {{ h["count"] }} achat(s)
+                </div>
+            </div>
+        {% endfor %}
+    {% endif %}
+
     <a class="back" href="{{ url_for('client_lines', client_id=client_id) }}">
         ⬅ Retour aux lignes
     </a>
@@ -1082,6 +3727,664 @@ def logout():
 
 from flask import Flask, request, jsonify, render_template_string, redirect, url_for, session
 
+# ============= مهلة الاستعلامات لكل مسار (deadlines) =============
+
+# بالميلي ثانية؛ 0 = بدون مهلة
+ROUTE_DEADLINES_MS = {
+    "client_lines":     int(os.environ.get("GF_DEADLINE_LINES_MS") or 1500),
+    "reference_prices": int(os.environ.get("GF_DEADLINE_REFERENCE_MS") or 2000),
+    "api_by_ids":       int(os.environ.get("GF_DEADLINE_API_MS") or 5000),
+}
+# عند تجاوز المهلة في البحث: إعادة المحاولة على آخر N سطر فقط (نتائج جزئية)
+PARTIAL_SEARCH_WINDOW = int(os.environ.get("GF_PARTIAL_SEARCH_WINDOW") or 20000)
+# SQLite: فحص الوقت كل N تعليمة من آلة SQLite الافتراضية
+SQLITE_PROGRESS_STEPS = 10000
+
+
+class QueryDeadlineExceeded(Exception):
+    """استعلام أُلغي لأنه تجاوز مهلة المسار."""
+
+
+@contextmanager
+def query_deadline(conn, route: str):
+    """
+    مهلة لكل استعلامات conn داخل الكتلة:
+    PostgreSQL: set_config('statement_timeout', ..., true) = SET LOCAL (ينتهي مع المعاملة)،
+    SQLite: progress handler يقطع التنفيذ بعد الموعد.
+    الإلغاء يُعدّ في gf_query_cancelled_total ويتحول إلى QueryDeadlineExceeded.
+    """
+    ms = ROUTE_DEADLINES_MS.get(route) or 0
+    if not ms or not (IS_POSTGRES or IS_SQLITE):
+        yield
+        return
+
+    dbapi_conn = None
+    if IS_POSTGRES:
+        conn.execute(text("SELECT set_config('statement_timeout', :ms, true)"), {"ms": str(ms)})
+    else:
+        dbapi_conn = conn.connection.driver_connection
+        deadline = time.monotonic() + ms / 1000.0
+        dbapi_conn.set_progress_handler(lambda: time.monotonic() > deadline, SQLITE_PROGRESS_STEPS)
+    try:
+        yield
+    except DBAPIError as e:
+        cancelled = (getattr(e.orig, "pgcode", None) == "57014" if IS_POSTGRES
+                     else "interrupted" in str(e.orig))
+        if not cancelled:
+            raise
+        metric_inc("gf_query_cancelled_total", route=route)
+        raise QueryDeadlineExceeded(route) from e
+    finally:
+        if dbapi_conn is not None:
+            dbapi_conn.set_progress_handler(None, 0)
+
+
+@app.errorhandler(QueryDeadlineExceeded)
+def query_deadline_exceeded(e):
+    # المسارات التي لا تملك بديلاً جزئياً: 503 سريع بدل خيط محجوز
+    if request.path.startswith("/api/") or request.args.get("ajax") == "1":
+        return jsonify({"ok": False, "error": "query_timeout"}), 503, {"Retry-After": "5"}
+    return "Délai dépassé, veuillez réessayer ou préciser la recherche.", 503, {"Retry-After": "5"}
+
+
+# عدد النتائج مع البحث: نعدّ حتى GF_COUNT_CAP ثم نعرض "10 000+"
+COUNT_CAP = int(os.environ.get("GF_COUNT_CAP") or 10000)
+PAGE_SIZE = 500
+
+
+def build_lines_query(client_id: str, args, recent_window: int = None,
+                      references: list = None) -> tuple:
+    """
+    استعلام صفحة السطور (مشترك بين Flask ونسخة ASGI).
+    args: معاملات الرابط (q, from, to, sort). يرجع (sql, params, date_from, date_to).
+    كل صف يحمل match_count (عدد النتائج الكلي، محسوب في نفس الاستعلام) وcount_cap.
+    recent_window: البحث في آخر N سطر للعميل فقط وبدون عدّ (النتائج الجزئية بعد المهلة).
+    references: مراجع البحث التقريبي بدل q، والسطور بترتيبها (الأقرب أولاً).
+    """
+    q = (args.get("q") or "").strip()
+    dates = DateParser()
+    date_from = dates.parse(args.get("from"))
+    date_to   = dates.parse(args.get("to"))
+    sort      = args.get("sort") or ""
+
+    where = "l.client_id = :cid"
+    params = {"cid": client_id}
+
+    # البحث على الأعمدة المُطبَّعة (محسوبة عند الكتابة)، المورد عبر IN ليستفيد من الفهارس
+    nq = normalize_search(q)
+    if references:
+        names = [f":ref{i}" for i in range(len(references))]
+        where += f" AND l.reference IN ({', '.join(names)})"
+        params.update({f"ref{i}": ref for i, ref in enumerate(references)})
+    elif nq:
+        where += """
+            AND (
+                l.search_key LIKE :like
+                OR l.supplier_id IN (
+                    SELECT id FROM suppliers
+                    WHERE client_id = :cid AND search_name LIKE :like
+                )
+            )
+        """
+        params["like"] = f"%{nq}%"
+
+    # فلترة الفترة عبر الفهرس (client_id, date_d)
+    if date_from:
+        where += " AND l.date_d >= :dfrom"
+        params["dfrom"] = date_param(date_from)
+    if date_to:
+        where += " AND l.date_d <= :dto"
+        params["dto"] = date_param(date_to)
+
+    from_sql = "lines l"
+    if recent_window:
+        # آخر recent_window سطر عبر الفهرس (client_id, change_seq) هي نقطة البداية،
+        # فلا يُمسح إلا هذا الجزء من سطور العميل
+        from_sql = f"""(
+            SELECT id FROM lines
+            WHERE client_id = :cid
+            ORDER BY change_seq DESC
+            LIMIT {int(recent_window)}
+        ) recent
+        JOIN lines l ON l.id = recent.id"""
+        count_sql = "NULL"
+        count_cap = "NULL"
+    elif nq or references or date_from or date_to:
+        # عدّ محدود: يتوقف المسح عند COUNT_CAP + 1 بدل عدّ كل النتائج
+        count_sql = f"""(
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM lines l WHERE {where} LIMIT {COUNT_CAP + 1}
+            ) m
+        )"""
+        count_cap = str(COUNT_CAP)
+    else:
+        # بدون فلتر: العدد الدقيق من client_stats (بدون مسح)
+        count_sql = "(SELECT MAX(total_lines) FROM client_stats WHERE client_id = :cid)"
+        count_cap = "NULL"
+
+    base_sql = f"""
+        SELECT l.id, l.reference, l.designation, l.marque, l.prix, l.date, l.created_at,
+               l.supplier_id,
+               s.name as supplier_name,
+               s.change_seq AS supplier_seq,
+               {count_sql} AS match_count,
+               {count_cap} AS count_cap
+        FROM {from_sql}
+        LEFT JOIN suppliers s ON l.supplier_id = s.id
+        WHERE {where}
+    """
+
+    if sort == "date":
+        base_sql += f" ORDER BY l.date_d DESC NULLS LAST, l.id DESC LIMIT {PAGE_SIZE}"
+    elif references:
+        rank = " ".join(f"WHEN :ref{i} THEN {i}" for i in range(len(references)))
+        base_sql += f" ORDER BY CASE l.reference {rank} END, l.id DESC LIMIT {PAGE_SIZE}"
+    elif LINES_PARTITIONED:
+        # الترتيب حسب مفتاح التقسيم: PostgreSQL يمسح الأشهر الأحدث أولاً ويتوقف عند LIMIT
+        base_sql += f" ORDER BY l.created_at DESC, l.id DESC LIMIT {PAGE_SIZE}"
+    else:
+        base_sql += f" ORDER BY l.id DESC LIMIT {PAGE_SIZE}"
+
+    return base_sql, params, date_from, date_to
+
+
+def match_count(rows) -> tuple:
+    """(العدد، هل هو محدود بـ COUNT_CAP) من أعمدة الصف الأول."""
+    if not rows:
+        return 0, False
+    n, cap = rows[0]["match_count"] or 0, rows[0]["count_cap"]
+    # client_stats قد يتأخر عن السطور المعروضة (مثلاً قبل rebuild-stats)
+    n = max(n, len(rows))
+    if cap is not None and n > cap:
+        return cap, True
+    return n, False
+
+
+def count_label(n: int, capped: bool) -> str:
+    # فاصل الآلاف بالفرنسية: 10 000
+    return f"{n:,}".replace(",", " ") + ("+" if capped else "")
+
+
+def count_headers(n: int, capped: bool) -> dict:
+    """ترويسات العدد لرد AJAX (الجسم يبقى قائمة السطور)."""
+    return {"X-Total-Count": str(n), "X-Total-Capped": "1" if capped else "0"}
+
+
+def line_month(r) -> str:
+    """شهر created_at ("2024-05"): تلميح مفتاح التقسيم في رابط صفحة السطر."""
+    created_at = r["created_at"]
+    return str(created_at)[:7] if created_at is not None else ""
+
+
+app.jinja_env.globals["line_month"] = line_month
+
+
+def line_json(r) -> dict:
+    """شكل السطر في JSON (عقد AJAX لصفحة السطور)."""
+    return {
+        "id": r["id"],
+        "month": line_month(r),
+        "reference": r["reference"],
+        "designation": r["designation"],
+        "marque": r["marque"],
+        "prix": r["prix"],
+        "date": r["date"],
+        "supplier_name": r["supplier_name"],
+    }
+
+
+# -------- مطابقة تقريبية للمراجع (أخطاء الكتابة على الهاتف) --------
+# "R5B021" بدل "RB5021": LIKE لا يجد شيئاً. المرشحون من فهرس trigram على مراجع العميل
+# (pg_trgm على PostgreSQL، فهرس مقلوب في الذاكرة على SQLite)، ثم الترتيب بمسافة التحرير.
+FUZZY_SEARCH       = os.environ.get("GF_FUZZY_SEARCH", "1") != "0"
+FUZZY_MAX_EDITS    = int(os.environ.get("GF_FUZZY_MAX_EDITS") or 2)
+FUZZY_CANDIDATES   = int(os.environ.get("GF_FUZZY_CANDIDATES") or 200)
+FUZZY_REFERENCES   = int(os.environ.get("GF_FUZZY_REFERENCES") or 20)
+FUZZY_PG_THRESHOLD = float(os.environ.get("GF_FUZZY_PG_THRESHOLD") or 0.2)
+FUZZY_TENANTS      = int(os.environ.get("GF_FUZZY_TENANTS") or 8)
+FUZZY_MIN_LENGTH   = 4
+# trigram موجود في أكثر من هذه النسبة من المراجع لا يميّز شيئاً: لا نمسح قائمته
+FUZZY_COMMON_GRAM  = 0.05
+
+
+def ref_grams(key: str) -> set:
+    """trigrams بنفس حشو pg_trgm: "  rb5021 "."""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Damerau-Levenshtein (OSA): تبديل حرفين متجاورين = خطأ واحد ("rb5" ↔ "r5b").
+    يتوقف مبكراً ويرجع limit + 1 عند تجاوز الحد.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d = min(d, before[j - 2] + 1)
+            cur[j] = d
+        if min(cur) > limit:
+            return limit + 1
+        before, prev = prev, cur
+    return prev[-1]
+
+
+def rank_references(key: str, candidates) -> list:
+    """المرشحون ضمن حد الأخطاء، الأقرب أولاً (مسافة التحرير ثم فرق الطول)."""
+    limit = 1 if len(key) < 6 else FUZZY_MAX_EDITS
+    ranked = []
+    for ref in candidates:
+        ref_key = normalize_search(ref)
+        d = edit_distance(ref_key, key, limit)
+        if d <= limit:
+            ranked.append((d, abs(len(ref_key) - len(key)), ref))
+    ranked.sort()
+    return [ref for _, _, ref in ranked[:FUZZY_REFERENCES]]
+
+
+class RefNgramIndex:
+    """فهرس trigram مقلوب لمراجع عميل واحد: trigram → أرقام المفاتيح المُطبَّعة."""
+
+    def __init__(self):
+        self.keys = []        # رقم → مفتاح مُطبَّع
+        self.refs = []        # رقم → المرجع كما كُتب أول مرة
+        self.variants = {}    # رقم → كتابات أخرى لنفس المفتاح ("RB-5021" و"rb5021")
+        self.positions = {}   # مفتاح → رقم
+        self.postings = {}    # trigram → array('I')
+        self.version = 0      # MAX(lines.change_seq) عند آخر تحديث
+        self.lock = threading.Lock()
+
+    def add(self, reference):
+        key = normalize_search(reference)
+        if not key:
+            return
+        pos = self.positions.get(key)
+        if pos is not None:
+            if reference != self.refs[pos] and reference not in self.variants.get(pos, ()):
+                self.variants.setdefault(pos, []).append(reference)
+            return
+        pos = len(self.keys)
+        self.keys.append(key)
+        self.refs.append(reference)
+        self.positions[key] = pos
+        for gram in ref_grams(key):
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array("I")
+            postings.append(pos)
+
+    def candidates(self, key: str, n: int) -> list:
+        """أكثر n مفتاحاً مشاركةً في trigrams مع key (مع كل كتاباتها)."""
+        common = max(1000, int(len(self.keys) * FUZZY_COMMON_GRAM))
+        shared = Counter()
+        for gram in ref_grams(key):
+            postings = self.postings.get(gram)
+            if postings is not None and len(postings) <= common:
+                shared.update(postings)
+        out = []
+        for pos, _ in shared.most_common(n):
+            out.append(self.refs[pos])
+            out.extend(self.variants.get(pos, ()))
+        return out
+
+
+# مصدر واحد للبناء الأول (after = 0) وللتحديث: السطور التي يمكن أن يعرضها fuzzy_lines
+REF_INDEX_SQL = """
+    SELECT DISTINCT reference FROM lines
+    WHERE client_id = :cid AND change_seq > :after AND reference IS NOT NULL
+"""
+
+
+class RefIndexCache:
+    """
+    RefNgramIndex لكل عميل (LRU على عدد العملاء): كل مراجع lines عند البناء الأول،
+    ثم المراجع الجديدة فقط عبر الفهرس (client_id, change_seq).
+    البناء الأول (ثوانٍ لملايين المراجع) في خيط خلفي؛ حتى ينتهي يبقى البحث مطابقاً فقط.
+    self.lock يحمي القاموسين فقط، وكل فهرس له قفله للتحديث والقراءة.
+    """
+
+    def __init__(self, max_tenants: int):
+        self.max_tenants = max_tenants
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # client_id → RefNgramIndex
+        self.building = set()          # client_id يُبنى فهرسه الآن
+
+    def candidates(self, client_id: str, key: str, n: int) -> list:
+        """مرشحو key من فهرس العميل بعد تحديثه، أو None إن كان الفهرس قيد البناء."""
+        with self.lock:
+            index = self.entries.get(client_id)
+            if index is not None:
+                self.entries.move_to_end(client_id)
+        if index is None:
+            self.start_build(client_id)
+            metric_inc("gf_ref_index_pending_total")
+            return None
+
+        with index.lock:
+            with engine.connect() as conn, query_deadline(conn, "client_lines"):
+                seq = conn.execute(text("SELECT MAX(change_seq) FROM lines WHERE client_id = :cid"),
+                                   {"cid": client_id}).scalar() or 0
+                if seq > index.version:
+                    for (ref,) in conn.execute(text(REF_INDEX_SQL),
+                                               {"cid": client_id, "after": index.version}):
+                        index.add(ref)
+                    index.version = seq
+            if seq < index.version:
+                # سطور حُذفت (compact, drop-months): مراجعها القديمة لا تضر، نعيد البناء في الخلفية
+                self.start_build(client_id)
+            return index.candidates(key, n)
+
+    def start_build(self, client_id: str):
+        with self.lock:
+            if client_id in self.building:
+                return
+            self.building.add(client_id)
+        threading.Thread(target=self._build, args=(client_id,),
+                         name="gf-ref-index", daemon=True).start()
+
+    def _build(self, client_id: str):
+        try:
+            index = RefNgramIndex()
+            with engine.connect() as conn:
+                # النسخة أولاً: سطر يُحفظ أثناء البناء يُلتقط في التحديث التالي
+                index.version = conn.execute(text(
+                    "SELECT MAX(change_seq) FROM lines WHERE client_id = :cid"
+                ), {"cid": client_id}).scalar() or 0
+                result = conn.execution_options(stream_results=True, yield_per=10000).execute(
+                    text(REF_INDEX_SQL), {"cid": client_id, "after": 0})
+                for (ref,) in result:
+                    index.add(ref)
+            metric_inc("gf_ref_index_builds_total")
+            with self.lock:
+                self.entries[client_id] = index
+                self.entries.move_to_end(client_id)
+                while len(self.entries) > self.max_tenants:
+                    self.entries.popitem(last=False)
+        except Exception:
+            app.logger.exception("construction de l'index des références échouée pour %s", client_id)
+        finally:
+            with self.lock:
+                self.building.discard(client_id)
+
+
+ref_indexes = RefIndexCache(FUZZY_TENANTS)
+
+
+def fuzzy_references(client_id: str, q: str) -> list:
+    """المراجع القريبة من q، الأقرب أولاً ([] إن كان q قصيراً أو لا يوجد مرشح)."""
+    key = normalize_search(q)
+    if len(key) < FUZZY_MIN_LENGTH:
+        return []
+
+    if IS_POSTGRES:
+        try:
+            with engine.connect() as conn, query_deadline(conn, "client_lines"):
+                conn.execute(text("SELECT set_config('pg_trgm.similarity_threshold', :t, true)"),
+                             {"t": str(FUZZY_PG_THRESHOLD)})
+                # نفس مصدر SQLite (REF_INDEX_SQL): مراجع lines، عبر lines_ref_key_trgm_idx
+                candidates = conn.execute(text(f"""
+                    SELECT reference FROM lines
+                    WHERE client_id = :cid AND {PG_REF_KEY_SQL} % :key
+                    GROUP BY reference
+                    ORDER BY MAX(similarity({PG_REF_KEY_SQL}, :key)) DESC
+                    LIMIT :n
+                """), {"cid": client_id, "key": key, "n": FUZZY_CANDIDATES}).scalars().all()
+        except DBAPIError as e:
+            # pg_trgm غير مثبت (انظر create_search_indexes)
+            app.logger.warning("recherche approchée indisponible : %s", e)
+            return []
+    else:
+        candidates = ref_indexes.candidates(client_id, key, FUZZY_CANDIDATES)
+        if candidates is None:
+            # الفهرس قيد البناء: نتائج البحث المطابق فقط في الأثناء
+            return []
+
+    metric_inc("gf_fuzzy_searches_total")
+    return rank_references(key, candidates)
+
+
+def fuzzy_lines(client_id: str, args) -> list:
+    """سطور المراجع القريبة من q (الأقرب أولاً)، أو [] إن لم يوجد مرجع قريب."""
+    refs = fuzzy_references(client_id, args.get("q") or "")
+    if not refs:
+        return []
+    sql, params, _, _ = build_lines_query(client_id, args, references=refs)
+    with engine.connect() as conn, query_deadline(conn, "client_lines"):
+        return conn.execute(text(sql), params).mappings().all()
+
+
+# -------- كاش الصفحة الأولى (بدون بحث) لكل عميل --------
+# أحدث PAGE_SIZE سطر جاهزة (مع اسم المورد) في الذاكرة: الصفحة الافتراضية وطلب AJAX
+# الفارغ لا يلمسان القاعدة. الرفع في نفس العملية يعلّم العنصر فقط، والقراءة التالية تضيف
+# السطور الجديدة في المقدمة؛ والتماسك بين workers عبر فحص نسخة رخيص (3 قراءات فهرس)
+# مرة كل GF_HOT_PAGE_CHECK_MS على الأكثر.
+HOT_PAGE          = os.environ.get("GF_HOT_PAGE", "1") != "0"
+HOT_PAGE_CHECK_MS = float(os.environ.get("GF_HOT_PAGE_CHECK_MS") or 1000)
+HOT_PAGE_TENANTS  = int(os.environ.get("GF_HOT_PAGE_TENANTS") or 200)
+
+HOT_PAGE_VERSION_SQL = """
+    SELECT (SELECT total_lines FROM client_stats WHERE client_id = :cid) AS total,
+           (SELECT MAX(change_seq) FROM lines WHERE client_id = :cid) AS line_seq,
+           (SELECT MAX(change_seq) FROM suppliers WHERE client_id = :cid) AS supplier_seq
+"""
+
+HOT_PAGE_NEW_ROWS_SQL = """
+    SELECT l.id, l.reference, l.designation, l.marque, l.prix, l.date, l.created_at,
+           l.supplier_id, s.name AS supplier_name, s.change_seq AS supplier_seq
+    FROM lines l
+    LEFT JOIN suppliers s ON l.supplier_id = s.id
+    WHERE l.client_id = :cid AND l.change_seq > :after
+    ORDER BY l.id DESC
+    LIMIT :n
+"""
+
+HOT_ROW_KEYS = ("id", "reference", "designation", "marque", "prix", "date", "created_at",
+                "supplier_id", "supplier_name", "supplier_seq")
+
+
+class HotPageCache:
+    """
+    ring buffer (deque بطول PAGE_SIZE) لكل عميل، مع LRU على عدد العملاء.
+    تحديث واحد فقط لكل عميل في نفس الوقت (single-flight): بقية القراء ينتظرون نتيجته.
+    """
+
+    def __init__(self, size: int, check_ms: float, max_tenants: int):
+        self.size = size
+        self.check = check_ms / 1000.0
+        self.max_tenants = max_tenants
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # client_id → {"rows", "total", "version", "checked"}
+        self.loading = {}              # client_id → {"done": Event, "dirty", "ok"} للتحديث الجاري
+
+    def get(self, client_id: str) -> tuple:
+        """(rows, total) للصفحة الأولى."""
+        with self.lock:
+            entry = self.entries.get(client_id)
+            if entry is not None:
+                self.entries.move_to_end(client_id)
+                if time.monotonic() - entry["checked"] < self.check:
+                    metric_inc("gf_hot_page_hits_total")
+                    return list(entry["rows"]), entry["total"]
+        entry = self.refresh(client_id)
+        with self.lock:
+            return list(entry["rows"]), entry["total"]
+
+    def on_commit(self, client_id: str):
+        """
+        بعد commit سطور جديدة: نعلّم العنصر فقط، بدون أي استعلام. يُستدعى من خيط
+        group commit ومن حلقة asyncio، فلا يجوز أن ينتظر القاعدة؛ القراءة التالية
+        تفحص النسخة وتضيف السطور الجديدة في المقدمة.
+        """
+        with self.lock:
+            entry = self.entries.get(client_id)
+            if entry is not None:
+                entry["checked"] = 0.0
+            # تحديث جارٍ قد قرأ النسخة قبل هذا الـ commit: لا يعلّم نتيجته كمفحوصة
+            flight = self.loading.get(client_id)
+            if flight is not None:
+                flight["dirty"] = True
+
+    @staticmethod
+    def _checked(flight: dict) -> float:
+        """وقت الفحص للعنصر الناتج؛ 0 إن وصل on_commit أثناء التحديث (يُفحص من جديد)."""
+        return 0.0 if flight["dirty"] else time.monotonic()
+
+    def refresh(self, client_id: str) -> dict:
+        while True:
+            with self.lock:
+                flight = self.loading.get(client_id)
+                if flight is None:
+                    flight = {"done": threading.Event(), "dirty": False, "ok": False}
+                    self.loading[client_id] = flight
+                    entry = self.entries.get(client_id)
+                    break
+            # قارئ آخر يحدّث نفس العميل: ننتظره بدل استعلام ثانٍ؛ إن فشل نحاول بأنفسنا
+            flight["done"].wait()
+            with self.lock:
+                entry = self.entries.get(client_id)
+                if flight["ok"] and entry is not None:
+                    return entry
+
+        try:
+            entry = self._load(client_id, entry, flight)
+            flight["ok"] = True
+            return entry
+        finally:
+            with self.lock:
+                del self.loading[client_id]
+            flight["done"].set()
+
+    def _load(self, client_id: str, entry: dict, flight: dict) -> dict:
+        with self.lock:
+            old = entry["version"] if entry is not None else None
+
+        with engine.connect() as conn:
+            v = conn.execute(text(HOT_PAGE_VERSION_SQL), {"cid": client_id}).mappings().one()
+            version = (v["total"], v["line_seq"], v["supplier_seq"])
+
+            if entry is not None and old == version:
+                with self.lock:
+                    # المقارنة والتحديث معاً تحت القفل؛ checked=0 من on_commit لا يُمحى
+                    if entry["version"] == version:
+                        entry["checked"] = self._checked(flight)
+                        metric_inc("gf_hot_page_hits_total")
+                        return entry
+
+            # سطور جديدة فقط (لا حذف ولا تغيير مورد) → نضيفها في المقدمة
+            if (old is not None and old[2] == version[2] and old[1] is not None
+                    and (version[1] or 0) > old[1]):
+                new_rows = conn.execute(text(HOT_PAGE_NEW_ROWS_SQL), {
+                    "cid": client_id, "after": old[1], "n": self.size + 1,
+                }).mappings().all()
+                if len(new_rows) <= self.size and (version[0] or 0) == (old[0] or 0) + len(new_rows):
+                    with self.lock:
+                        if entry["version"] == old:
+                            known = {r["id"] for r in entry["rows"]}
+                            entry["rows"].extendleft(reversed([
+                                {k: r[k] for k in HOT_ROW_KEYS}
+                                for r in new_rows if r["id"] not in known
+                            ]))
+                            entry["total"] = max(version[0] or 0, len(entry["rows"]))
+                            entry["version"] = version
+                            entry["checked"] = self._checked(flight)
+                            metric_inc("gf_hot_page_updates_total")
+                            return entry
+
+            sql, params, _, _ = build_lines_query(client_id, {})
+            rows = conn.execute(text(sql), params).mappings().all()
+
+        metric_inc("gf_hot_page_loads_total")
+        entry = {
+            "rows": deque(({k: r[k] for k in HOT_ROW_KEYS} for r in rows), maxlen=self.size),
+            "total": max(version[0] or 0, len(rows)),
+            "version": version,
+        }
+        with self.lock:
+            entry["checked"] = self._checked(flight)
+            self.entries[client_id] = entry
+            self.entries.move_to_end(client_id)
+            while len(self.entries) > self.max_tenants:
+                self.entries.popitem(last=False)
+        return entry
+
+
+hot_pages = HotPageCache(PAGE_SIZE, HOT_PAGE_CHECK_MS, HOT_PAGE_TENANTS)
+
+
+def hot_first_page(client_id: str, args):
+    """(rows, total) من الكاش إن كان الطلب هو الصفحة الافتراضية، وإلا None."""
+    if not HOT_PAGE or normalize_search(args.get("q") or ""):
+        return None
+    if args.get("from") or args.get("to") or args.get("sort"):
+        return None
+    return hot_pages.get(client_id)
+
+
+# -------- كاش HTML للبطاقات --------
+# السطر لا يتغير بعد إدخاله؛ المورد فقط قد يتغير (change_seq يتغير معه).
+# المفتاح (id السطر، id المورد، change_seq المورد)، والإخلاء LRU حسب ميزانية بالبايت.
+CARD_CACHE_MB = int(os.environ.get("GF_CARD_CACHE_MB") or 32)
+
+
+class FragmentCache:
+    def __init__(self, budget_bytes: int):
+        self.budget = budget_bytes
+        self.size = 0
+        self.lock = threading.Lock()
+        self.items = OrderedDict()   # key → html
+
+    def get_many(self, keys: list) -> list:
+        with self.lock:
+            found = []
+            for key in keys:
+                html = self.items.get(key)
+                if html is not None:
+                    self.items.move_to_end(key)
+                found.append(html)
+            return found
+
+    def put_many(self, pairs: list):
+        with self.lock:
+            for key, html in pairs:
+                old = self.items.pop(key, None)
+                if old is not None:
+                    self.size -= len(old)
+                self.items[key] = html
+                self.size += len(html)
+            while self.size > self.budget and self.items:
+                _, html = self.items.popitem(last=False)
+                self.size -= len(html)
+
+
+card_cache = FragmentCache(CARD_CACHE_MB * 1024 * 1024)
+
+# القوالب تُترجم مرة واحدة عند التحميل؛ render_template_string يعيد ترجمتها في كل طلب
+LINES_PAGE     = app.jinja_env.from_string(LINES_TEMPLATE)
+_card_template = app.jinja_env.from_string(CARD_TEMPLATE)
+
+
+def render_cards(client_id: str, rows) -> Markup:
+    """HTML كل البطاقات: المخزّن كما هو، والباقي يُصيَّر بـ CARD_TEMPLATE ثم يُخزَّن."""
+    keys = [(r["id"], r["supplier_id"], r["supplier_seq"]) for r in rows]
+    parts = card_cache.get_many(keys)
+    missing = []
+    for i, html in enumerate(parts):
+        if html is None:
+            parts[i] = _card_template.render(client_id=client_id, r=rows[i])
+            missing.append((keys[i], parts[i]))
+    if missing:
+        card_cache.put_many(missing)
+    metric_inc("gf_card_cache_hits_total", len(rows) - len(missing))
+    metric_inc("gf_card_cache_misses_total", len(missing))
+    return Markup("".join(parts))
+
+
 @app.get("/client/<client_id>/lines")
 def client_lines(client_id):
     # 🔒 التحقق من تسجيل الدخول
@@ -1094,50 +4397,52 @@ def client_lines(client_id):
 
     q = (request.args.get("q") or "").strip()
 
-    base_sql = """
-        SELECT l.id, l.reference, l.designation, l.marque, l.prix, l.date,
-               l.supplier_id,
-               s.name as supplier_name
-        FROM lines l
-        LEFT JOIN suppliers s ON l.supplier_id = s.id
-        WHERE l.client_id = :cid
-    """
-    params = {"cid": client_id}
-
-    if q:
-        base_sql += """
-            AND (
-                LOWER(l.reference)      LIKE :like
-                OR LOWER(l.designation) LIKE :like
-                OR LOWER(l.marque)      LIKE :like
-                OR LOWER(s.name)        LIKE :like
-            )
-        """
-        params["like"] = f"%{q.lower()}%"
-
-    base_sql += " ORDER BY l.id DESC LIMIT 500"
-
-    with engine.connect() as conn:
-        result = conn.execute(text(base_sql), params)
-        rows = result.mappings().all()
+    partial = fuzzy = False
+    hot = hot_first_page(client_id, request.args)
+    if hot is not None:
+        rows, total = hot
+        capped, date_from, date_to = False, None, None
+    else:
+        sql, params, date_from, date_to = build_lines_query(client_id, request.args)
+        try:
+            rows = []
+            # fuzzy=1: مباشرة للبحث التقريبي؛ وإلا فقط عند غياب نتيجة مطابقة
+            if request.args.get("fuzzy") != "1":
+                with engine.connect() as conn, query_deadline(conn, "client_lines"):
+                    result = conn.execute(text(sql), params)
+                    rows = result.mappings().all()
+            if not rows and FUZZY_SEARCH and q:
+                rows = fuzzy_lines(client_id, request.args)
+                fuzzy = bool(rows)
+            total, capped = match_count(rows)
+        except QueryDeadlineExceeded:
+            # بحث واسع جداً: نتائج جزئية من آخر السطور، وإلا قائمة فارغة + تلميح
+            partial = True
+            sql, params, _, _ = build_lines_query(client_id, request.args,
+                                                  recent_window=PARTIAL_SEARCH_WINDOW)
+            try:
+                with engine.connect() as conn, query_deadline(conn, "client_lines"):
+                    rows = conn.execute(text(sql), params).mappings().all()
+            except QueryDeadlineExceeded:
+                rows = []
+            total, capped = len(rows), bool(rows)
 
     # 🔹 في حالة AJAX نرجع JSON فقط
     if request.args.get("ajax") == "1":
-        return jsonify([
-            {
-                "id": r["id"],
-                "reference": r["reference"],
-                "designation": r["designation"],
-                "marque": r["marque"],
-                "prix": r["prix"],
-                "date": r["date"],
-                "supplier_name": r["supplier_name"],
-            }
-            for r in rows
-        ])
+        headers = count_headers(total, capped)
+        if partial:
+            headers["X-Search-Partial"] = "1"
+        if fuzzy:
+            headers["X-Search-Fuzzy"] = "1"
+        return jsonify([line_json(r) for r in rows]), 200, headers
 
     # 🔹 الحالة العادية ترجع HTML
-    return render_template_string(LINES_TEMPLATE, client_id=client_id, rows=rows, q=q)
+    return LINES_PAGE.render(client_id=client_id, rows=rows, q=q,
+                             cards=render_cards(client_id, rows),
+                             date_from=date_from, date_to=date_to,
+                             total=total, total_capped=capped,
+                             partial=partial, fuzzy=fuzzy,
+                             total_label=count_label(total, capped))
 
 
 @app.get("/client/<client_id>/supplier/<int:supplier_id>")
@@ -1151,8 +4456,11 @@ def supplier_page(client_id, supplier_id):
 
     with engine.connect() as conn:
         row = conn.execute(text("""
-            SELECT * FROM suppliers
-            WHERE id = :id AND client_id = :cid
+            SELECT s.*, st.line_count
+            FROM suppliers s
+            LEFT JOIN supplier_stats st
+                   ON st.client_id = s.client_id AND st.supplier_id = s.id
+            WHERE s.id = :id AND s.client_id = :cid
         """), {"id": supplier_id, "cid": client_id}).mappings().fetchone()
     ...
 
@@ -1172,22 +4480,37 @@ def line_detail(client_id, line_id):
     if sess_id != client_id:
         return "Forbidden", 403
 
+    sql = """
+        SELECT
+            l.id,
+            l.reference,
+            l.designation,
+            l.marque,
+            l.prix,
+            l.date,
+            s.name  AS supplier_name,
+            s.phone AS supplier_phone,
+            s.email AS supplier_email
+        FROM lines l
+        LEFT JOIN suppliers s ON l.supplier_id = s.id
+        WHERE l.id = :id AND l.client_id = :cid
+    """
+    params = {"id": line_id, "cid": client_id}
+
+    # lines مقسّم حسب created_at: id وحده يفحص كل الأجزاء، فالرابط يحمل الشهر (?m=2024-05)
+    month = request.args.get("m") or ""
+    hinted = LINES_PARTITIONED and re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", month)
+
     with engine.connect() as conn:
-        row = conn.execute(text("""
-            SELECT
-                l.id,
-                l.reference,
-                l.designation,
-                l.marque,
-                l.prix,
-                l.date,
-                s.name  AS supplier_name,
-                s.phone AS supplier_phone,
-                s.email AS supplier_email
-            FROM lines l
-            LEFT JOIN suppliers s ON l.supplier_id = s.id
-            WHERE l.id = :id AND l.client_id = :cid
-        """), {"id": line_id, "cid": client_id}).mappings().fetchone()
+        row = None
+        if hinted:
+            start = date(int(month[:4]), int(month[5:]), 1)
+            row = conn.execute(text(sql + """
+                AND l.created_at >= :m0 AND l.created_at < :m1
+            """), dict(params, m0=start, m1=_add_months(start, 1))).mappings().fetchone()
+        # تلميح قديم أو خاطئ: البحث بدون الشهر
+        if row is None:
+            row = conn.execute(text(sql), params).mappings().fetchone()
     ...
 
 
@@ -1197,10 +4520,372 @@ def line_detail(client_id, line_id):
     return render_template_string(LINE_DETAIL_TEMPLATE, client_id=client_id, line=row)
 
 
-# نستدعي init_db بمجرد استيراد الملف
-init_db()
+@app.get("/client/<client_id>/reference/<path:reference>")
+def reference_prices(client_id, reference):
+    """آخر سعر وأرخص مورد لمرجع معيّن، من price_stats مباشرة (بدون مسح lines)."""
+    # 🔒 تحقّق من session
+    sess_id = session.get("client_id")
+    if not sess_id:
+        return redirect(url_for("login"))
+    if sess_id != client_id:
+        return "Forbidden", 403
+
+    reference = reference.strip()
+
+    with engine.connect() as conn, query_deadline(conn, "reference_prices"):
+        result = conn.execute(text("""
+            SELECT ps.supplier_id, ps.last_price, ps.last_date,
+                   ps.min_price, ps.max_price, ps.sum_price, ps.price_count,
+                   s.name AS supplier_name
+            FROM price_stats ps
+            LEFT JOIN suppliers s ON ps.supplier_id = s.id
+            WHERE ps.client_id = :cid AND ps.reference = :ref
+            ORDER BY ps.last_price
+        """), {"cid": client_id, "ref": reference})
+        rows = [
+            {
+                "supplier_id": r["supplier_id"],
+                "supplier_name": r["supplier_name"],
+                "last_price": r["last_price"],
+                "last_date": r["last_date"],
+                "min_price": r["min_price"],
+                "max_price": r["max_price"],
+                "avg_price": round(r["sum_price"] / r["price_count"], 2) if r["price_count"] else None,
+                "count": r["price_count"],
+            }
+            for r in result.mappings()
+        ]
+
+        # الأسعار القديمة المضغوطة (compact): ملخص لكل شهر ومورد
+        history = [
+            dict(r) for r in conn.execute(text("""
+                SELECT h.month, h.supplier_id, s.name AS supplier_name,
+                       h.last_price, h.min_price, h.max_price, h.price_count AS count
+                FROM price_history h
+                LEFT JOIN suppliers s ON h.supplier_id = s.id
+                WHERE h.client_id = :cid AND h.reference = :ref
+                ORDER BY h.month DESC, h.last_price
+                LIMIT 240
+            """), {"cid": client_id, "ref": reference}).mappings()
+        ]
+
+    if request.args.get("ajax") == "1":
+        return jsonify({"reference": reference, "suppliers": rows, "history": history})
+
+    return render_template_string(REFERENCE_TEMPLATE, client_id=client_id,
+                                  reference=reference, rows=rows, history=history)
+
+
+# ============= التصدير الكامل (CSV / NDJSON) =============
+
+EXPORT_COLUMNS = [
+    "id", "date", "reference", "designation", "marque", "prix",
+    "supplier_id", "supplier_code", "supplier_name", "created_at",
+]
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def iter_export_rows(client_id: str, date_from: date = None, date_to: date = None,
+                     supplier_id: int = None):
+    """كل سطور العميل مع المورد، عبر server-side cursor (ذاكرة ثابتة مهما كان الحجم)."""
+    sql = """
+        SELECT l.id, l.date, l.reference, l.designation, l.marque, l.prix,
+               l.supplier_id, s.supplier_code, s.name AS supplier_name, l.created_at
+        FROM lines l
+        LEFT JOIN suppliers s ON l.supplier_id = s.id
+        WHERE l.client_id = :cid
+    """
+    params = {"cid": client_id}
+    if date_from:
+        sql += " AND l.date_d >= :dfrom"
+        params["dfrom"] = date_param(date_from)
+    if date_to:
+        sql += " AND l.date_d <= :dto"
+        params["dto"] = date_param(date_to)
+    if supplier_id is not None:
+        sql += " AND l.supplier_id = :sid"
+        params["sid"] = supplier_id
+    sql += " ORDER BY l.id"
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=2000).execute(text(sql), params)
+        for row in result:
+            yield row
+
+
+def _csv_chunks(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= EXPORT_CHUNK_BYTES:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def _ndjson_chunks(rows):
+    parts = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=str, ensure_ascii=False) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(parts)
+            parts = []
+            size = 0
+    yield "".join(parts)
+
+
+def _gzip_chunks(chunks):
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 → ترويسة gzip
+    for chunk in chunks:
+        data = comp.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield comp.flush()
+
+
+@app.get("/client/<client_id>/export.<fmt>")
+def export_lines(client_id, fmt):
+    # 🔒 تحقّق من session
+    sess_id = session.get("client_id")
+    if not sess_id:
+        return redirect(url_for("login"))
+    if sess_id != client_id:
+        return "Forbidden", 403
+
+    if fmt == "csv":
+        mimetype, to_chunks = "text/csv", _csv_chunks
+    elif fmt == "ndjson":
+        mimetype, to_chunks = "application/x-ndjson", _ndjson_chunks
+    else:
+        return "Format inconnu", 404
+
+    dates = DateParser()
+    rows = iter_export_rows(
+        client_id,
+        date_from=dates.parse(request.args.get("from")),
+        date_to=dates.parse(request.args.get("to")),
+        supplier_id=request.args.get("supplier_id", type=int),
+    )
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="gf-{client_id}-lines.{fmt}"',
+        "Vary": "Accept-Encoding",
+    }
+    chunks = to_chunks(rows)
+    use_gzip = (request.args.get("gzip") != "0" and
+                "gzip" in (request.headers.get("Accept-Encoding") or ""))
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        body = _gzip_chunks(chunks)
+    else:
+        body = (c.encode("utf-8") for c in chunks)
+
+    return Response(body, mimetype=mimetype, headers=headers)
+
+
+# ============= أوامر سطر الأوامر =============
+
+# ============= تشغيل الإنتاج (waitress) =============
+
+SERVE_DEFAULTS = {
+    "host":             os.environ.get("HOST") or "0.0.0.0",
+    "port":             int(os.environ.get("PORT") or 8000),
+    "workers":          int(os.environ.get("GF_WORKERS") or 1),
+    "threads":          int(os.environ.get("GF_THREADS") or 8),
+    "connection_limit": int(os.environ.get("GF_CONNECTION_LIMIT") or 1000),
+    "channel_timeout":  int(os.environ.get("GF_CHANNEL_TIMEOUT") or 60),
+    "backlog":          int(os.environ.get("GF_BACKLOG") or 1024),
+}
+
+
+def _serve_waitress(sock, threads, connection_limit, channel_timeout, backlog):
+    from waitress import serve as waitress_serve
+
+    line_events.limit_to_threads(threads)
+
+    waitress_serve(
+        app,
+        sockets=[sock],
+        threads=threads,
+        connection_limit=connection_limit,
+        channel_timeout=channel_timeout,
+        backlog=backlog,
+        ident="gf_server",
+    )
+
+
+def serve(host, port, workers, threads, connection_limit, channel_timeout, backlog):
+    """
+    workers=1: عملية waitress واحدة بعدة خيوط.
+    workers>1 (Linux/Unix): الأب يفتح المنفذ ثم ينشئ workers عمليات (pre-fork)،
+    كل واحدة waitress بخيوطها وبـ pool اتصالات خاص بها، ويعيد تشغيل من يتوقف.
+    """
+    # الترحيل مرة واحدة في الأب بدل أن يتسابق عليه كل worker
+    ensure_schema_for_cli()
+    engine.dispose()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+
+    if workers <= 1 or not hasattr(os, "fork"):
+        if workers > 1:
+            app.logger.warning("fork indisponible sur cette plateforme : un seul processus")
+        _serve_waitress(sock, threads, connection_limit, channel_timeout, backlog)
+        return
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                _serve_waitress(sock, threads, connection_limit, channel_timeout, backlog)
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+    print(f"gf_server : {workers} workers × {threads} threads sur {host}:{port}")
+
+    while children:
+        try:
+            pid, _status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            # worker توقف بشكل غير متوقع → نعيد تشغيله
+            spawn()
+
+
+def ensure_schema_for_cli():
+    """نفس منطق ensure_schema لكن خارج سياق الطلب."""
+    global _schema_ready
+    if current_schema_version() < SCHEMA_VERSION:
+        if not AUTO_MIGRATE:
+            return False
+        init_db()
+    _schema_ready = True
+    return True
+
+
+def _parse_month(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m").date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="gf_server.py")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("partition-lines",
+                       help="Convertir lines en table partitionnée (PostgreSQL)")
+    p.add_argument("--batch-size", type=int, default=50000)
+    p.add_argument("--drop-legacy", action="store_true")
+
+    p = sub.add_parser("partitions",
+                       help="Créer les partitions mensuelles à venir (cron)")
+    p.add_argument("--months-ahead", type=int, default=PG_PARTITION_MONTHS_AHEAD)
+
+    p = sub.add_parser("drop-months",
+                       help="Supprimer les partitions antérieures à un mois donné")
+    p.add_argument("--before", type=_parse_month, required=True, metavar="YYYY-MM")
+
+    p = sub.add_parser("rebuild-price-stats",
+                       help="Recalculer price_stats à partir de lines")
+    p.add_argument("--client-id")
+
+    p = sub.add_parser("compact",
+                       help="Replier les lignes anciennes dans price_history puis VACUUM/ANALYZE")
+    p.add_argument("--older-than-days", type=int, default=COMPACT_AFTER_DAYS)
+    p.add_argument("--batch-size", type=int, default=COMPACT_BATCH)
+    p.add_argument("--client-id")
+    p.add_argument("--archive", action="store_true",
+                   help="copier les lignes brutes dans lines_archive au lieu de les perdre")
+    p.add_argument("--no-vacuum", action="store_true")
+
+    p = sub.add_parser("rebuild-stats",
+                       help="Recalculer client_stats / supplier_stats à partir de lines")
+    p.add_argument("--client-id")
+
+    sub.add_parser("migrate", help="Créer / mettre à jour le schéma de la base")
+
+    p = sub.add_parser("serve", help="Serveur de production (waitress, multi-processus)")
+    p.add_argument("--host", default=SERVE_DEFAULTS["host"])
+    p.add_argument("--port", type=int, default=SERVE_DEFAULTS["port"])
+    p.add_argument("--workers", type=int, default=SERVE_DEFAULTS["workers"],
+                   help=f"processus (pre-fork, Linux) ; cœurs disponibles : {os.cpu_count()}")
+    p.add_argument("--threads", type=int, default=SERVE_DEFAULTS["threads"])
+    p.add_argument("--connection-limit", type=int, default=SERVE_DEFAULTS["connection_limit"])
+    p.add_argument("--channel-timeout", type=int, default=SERVE_DEFAULTS["channel_timeout"])
+    p.add_argument("--backlog", type=int, default=SERVE_DEFAULTS["backlog"])
+
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        init_db()
+        print(f"Schéma à jour (version {SCHEMA_VERSION})")
+        return
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, args.threads,
+              args.connection_limit, args.channel_timeout, args.backlog)
+        return
+    if args.command is not None:
+        if ensure_schema_for_cli() is False:
+            parser.error("schéma obsolète : lancer d'abord « python gf_server.py migrate »")
+
+    if args.command in ("partition-lines", "partitions", "drop-months") and not IS_POSTGRES:
+        parser.error("le partitionnement nécessite PostgreSQL (DATABASE_URL)")
+
+    if args.command == "partition-lines":
+        migrate_lines_to_partitioned(args.batch_size, args.drop_legacy)
+    elif args.command == "partitions":
+        with engine.begin() as conn:
+            if not lines_is_partitioned(conn):
+                parser.error("lines n'est pas partitionnée (lancer partition-lines)")
+            print(f"{ensure_line_partitions(conn, months_ahead=args.months_ahead)} partitions créées")
+    elif args.command == "drop-months":
+        print(f"{len(drop_line_partitions_before(args.before))} partitions supprimées")
+    elif args.command == "rebuild-price-stats":
+        with engine.begin() as conn:
+            print(f"{rebuild_price_stats(conn, args.client_id)} entrées price_stats")
+    elif args.command == "compact":
+        n = compact_lines(args.older_than_days, args.batch_size, args.client_id,
+                          archive=args.archive, vacuum=not args.no_vacuum)
+        print(f"{n} lignes compactées")
+    elif args.command == "rebuild-stats":
+        with engine.begin() as conn:
+            print(f"{rebuild_client_stats(conn, args.client_id)} entrées client_stats")
+    else:
+        # تشغيل محلي فقط (من دون waitress)
+        app.run(host="0.0.0.0", port=8000, debug=False)
+
 
 if __name__ == "__main__":
-    # تشغيل محلي فقط (من دون waitress)
-    app.run(host="0.0.0.0", port=8000, debug=False)
+    main()
 
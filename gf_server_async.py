@@ -0,0 +1,237 @@
+"""
+نسخة ASGI (asyncio) من نقطتي الرفع والبحث في gf_server:
+
+    POST /api/upload_lines                 → نفس JSON الطلب والرد
+    GET  /client/<client_id>/lines?ajax=1  → نفس قائمة JSON
+
+القراءة عبر SQLAlchemy asyncio (aiosqlite محلياً، asyncpg في الإنتاج)، فالطلب المنتظر
+للقاعدة أو لهاتف بطيء لا يحجز خيطاً. الكتابة تمر بنفس دوال gf_server (ingest_chunked،
+group commit) في خيط، فلا يتنافس كاتبان على القاعدة. باقي الصفحات تُمرَّر لتطبيق
+Flask نفسه (عبر asgiref إن كان مثبتاً).
+
+    pip install -r requirements-async.txt
+    uvicorn gf_server_async:app --host 0.0.0.0 --port 8000 --workers 4
+"""
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from itsdangerous import BadSignature
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import gf_server as gf
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+
+def async_database_url(url: str) -> str:
+    """تحويل DATABASE_URL إلى المشغّل غير المتزامن المقابل."""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    if url.startswith("sqlite:///"):
+        return "sqlite+aiosqlite:///" + url[len("sqlite:///"):]
+    return url
+
+
+async_engine = create_async_engine(
+    async_database_url(gf.DATABASE_URL),
+    pool_pre_ping=True,
+    pool_size=gf.DB_POOL_SIZE,
+    max_overflow=gf.DB_MAX_OVERFLOW,
+)
+
+if gf.SQLITE_TUNED:
+    # نفس PRAGMAs (WAL, busy_timeout...) لاتصالات aiosqlite
+    gf.tune_sqlite_engine(async_engine.sync_engine)
+
+_session_serializer = gf.app.session_interface.get_signing_serializer(gf.app)
+_flask_asgi = WsgiToAsgi(gf.app) if WsgiToAsgi is not None else None
+
+
+# ============= أدوات ASGI =============
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_response(send, status: int, body: bytes, content_type: str, headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, status: int, payload, headers=()):
+    body = json.dumps(payload, default=str).encode("utf-8")
+    await send_response(send, status, body, "application/json", headers)
+
+
+async def send_redirect(send, location: str):
+    await send_response(send, 302, b"", "text/html; charset=utf-8",
+                        [(b"location", location.encode())])
+
+
+def session_client_id(scope) -> str:
+    """قراءة client_id من كوكي جلسة Flask (نفس المفتاح ونفس التوقيع)."""
+    cookies = SimpleCookie()
+    for name, value in scope.get("headers", []):
+        if name == b"cookie":
+            cookies.load(value.decode("latin-1"))
+    morsel = cookies.get(gf.app.config["SESSION_COOKIE_NAME"])
+    if morsel is None:
+        return None
+    max_age = int(gf.app.permanent_session_lifetime.total_seconds())
+    try:
+        data = _session_serializer.loads(morsel.value, max_age=max_age)
+    except BadSignature:
+        return None
+    return data.get("client_id")
+
+
+# ============= نقاط النهاية =============
+
+async def upload_lines(scope, receive, send):
+    try:
+        data = json.loads(await read_body(receive) or b"{}")
+    except ValueError:
+        return await send_json(send, 400, {"ok": False, "error": "bad_json"})
+
+    client_id = data.get("client_id")
+    api_key   = data.get("api_key")
+    lines     = data.get("lines", [])
+
+    # تحقق بسيط من العميل (نفس upload_lines في gf_server)
+    if client_id != gf.TEST_CLIENT_ID or api_key != gf.TEST_API_KEY:
+        return await send_json(send, 401, {"ok": False, "error": "auth_failed"})
+
+    if not isinstance(lines, list) or not lines:
+        return await send_json(send, 400, {"ok": False, "error": "no_lines"})
+
+    try:
+        chunk_size, plan = gf.plan_upload_chunks(data, lines)
+    except ValueError as e:
+        return await send_json(send, 400, {"ok": False, "error": str(e)})
+
+    # backend sqlite للمحدِّد = معاملة على القاعدة: خارج حلقة الأحداث
+    ticket, rejected = await asyncio.to_thread(gf.admit_upload, client_id,
+                                               sum(len(chunk) for _, chunk in plan))
+    if rejected:
+        payload, retry_after = rejected
+        return await send_json(send, 429, payload,
+                               [(b"retry-after", str(retry_after).encode())])
+
+    try:
+        await asyncio.to_thread(gf.maybe_extend_line_partitions)
+        # الكتابة نفسها كما في gf_server (write_transaction، طابور الكاتب في SQLite، group commit):
+        # معاملة قصيرة في خيط، والانتظار الطويل (قراءة الجسم، الرد) يبقى على الحلقة
+        if gf.group_commit_eligible(plan):
+            saved, failed = await asyncio.to_thread(gf.ingest_grouped, client_id, plan)
+        else:
+            saved, failed = await asyncio.to_thread(gf.ingest_chunked, client_id, plan)
+    finally:
+        await asyncio.to_thread(gf.upload_limiter.release, ticket)
+
+    gf.metric_inc("gf_upload_lines_total", saved)
+    payload, status = gf.chunked_upload_result(chunk_size, -(-len(lines) // chunk_size),
+                                               saved, failed)
+    await send_json(send, status, payload)
+
+
+async def client_lines(scope, receive, send, client_id: str, args: dict):
+    sess_id = session_client_id(scope)
+    if not sess_id:
+        return await send_redirect(send, "/login")
+    if sess_id != client_id:
+        return await send_redirect(send, f"/client/{sess_id}/lines")
+
+    # نفس مهلة gf.query_deadline على PostgreSQL (aiosqlite لا يعرض progress handler)
+    deadline_ms = gf.ROUTE_DEADLINES_MS.get("client_lines") if gf.IS_POSTGRES else 0
+    partial = False
+    rows = []
+    for window in (None, gf.PARTIAL_SEARCH_WINDOW):
+        sql, params, _, _ = gf.build_lines_query(client_id, args, recent_window=window)
+        try:
+            async with async_engine.connect() as conn:
+                if deadline_ms:
+                    await conn.execute(text("SELECT set_config('statement_timeout', :ms, true)"),
+                                       {"ms": str(deadline_ms)})
+                result = await conn.execute(text(sql), params)
+                rows = result.mappings().all()
+            break
+        except DBAPIError as e:
+            if getattr(e.orig, "pgcode", None) != "57014":
+                raise
+            gf.metric_inc("gf_query_cancelled_total", route="client_lines")
+            partial = True
+
+    fuzzy = False
+    if not rows and not partial and gf.FUZZY_SEARCH and (args.get("q") or "").strip():
+        # البحث التقريبي في المراجع (نفس gf.fuzzy_lines) في خيط منفصل
+        rows = await asyncio.to_thread(gf.fuzzy_lines, client_id, args)
+        fuzzy = bool(rows)
+
+    if partial:
+        count = gf.count_headers(len(rows), bool(rows))
+        count["X-Search-Partial"] = "1"
+    else:
+        count = gf.count_headers(*gf.match_count(rows))
+    if fuzzy:
+        count["X-Search-Fuzzy"] = "1"
+    headers = [(k.lower().encode(), v.encode()) for k, v in count.items()]
+    await send_json(send, 200, [gf.line_json(r) for r in rows], headers)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # نفس فحص نسخة المخطط الذي يقوم به Flask عند أول طلب
+            await asyncio.to_thread(gf.ensure_schema_for_cli)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_engine.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(scope, receive, send)
+
+    if scope["type"] == "http":
+        method = scope["method"]
+        path   = scope["path"]
+        parts  = path.strip("/").split("/")
+        args   = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+
+        if method == "POST" and path == "/api/upload_lines":
+            return await upload_lines(scope, receive, send)
+
+        if (method == "GET" and len(parts) == 3 and parts[0] == "client"
+                and parts[2] == "lines" and args.get("ajax") == "1"):
+            return await client_lines(scope, receive, send, parts[1], args)
+
+    if _flask_asgi is not None:
+        return await _flask_asgi(scope, receive, send)
+
+    await send_response(send, 404, b"Not found", "text/plain")
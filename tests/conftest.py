@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# gf_server يقرأ DATABASE_URL عند الاستيراد: قاعدة SQLite مؤقتة قبل أي import
+_TMP = tempfile.mkdtemp(prefix="gf-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_TMP, "gf.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gf_server  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def gf():
+    gf_server.ensure_schema_for_cli()
+    gf_server.COMPACT_PAUSE = 0
+    return gf_server
+
+
+@pytest.fixture
+def tenant(gf):
+    """عميل جديد لكل اختبار: (client_id, api_key)، فلا تتداخل البيانات."""
+    client_id = "T-" + uuid.uuid4().hex[:8]
+    api_key = uuid.uuid4().hex
+    with gf.write_transaction() as conn:
+        conn.execute(gf.text("INSERT INTO clients (id, name, api_key) VALUES (:id, :id, :key)"),
+                     {"id": client_id, "key": api_key})
+    return client_id, api_key
+
+
+@pytest.fixture
+def ingest(gf):
+    def ingest(client_id, refs, **fields):
+        lines = [dict({"reference": ref, "prix": 1, "fournisseur": "F"}, **fields) for ref in refs]
+        with gf.write_transaction() as conn:
+            n = gf.ingest_lines(conn, client_id, lines)
+        gf.lines_committed(client_id)
+        return n
+    return ingest
+
+
+@pytest.fixture
+def web(gf, tenant):
+    """test client بجلسة العميل tenant (صفحات الويب)."""
+    client = gf.app.test_client()
+    with client.session_transaction() as sess:
+        sess["client_id"] = tenant[0]
+    return client
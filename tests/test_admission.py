@@ -0,0 +1,94 @@
+import io
+
+import pytest
+
+
+@pytest.fixture
+def limiter(gf, monkeypatch):
+    """limiter داخل العملية بحدود صغيرة، بدل limiter الخادم."""
+    def make(rate=0, burst=0, max_concurrent=4, budget=10 ** 6):
+        limiter = gf.MemoryUploadLimiter(rate, burst, max_concurrent, budget)
+        monkeypatch.setattr(gf, "upload_limiter", limiter)
+        return limiter
+    return make
+
+
+def test_limiter_concurrency_and_budget(gf):
+    limiter = gf.MemoryUploadLimiter(0, 0, 1, 10)
+    ticket, _, reason = limiter.admit("A", 8)
+    assert ticket is not None and reason is None
+    assert limiter.admit("A", 1)[2] == "tenant_concurrency"
+    assert limiter.admit("B", 5)[2] == "write_budget"
+    limiter.release(ticket)
+    assert limiter.admit("B", 5)[0] is not None
+
+
+def test_limiter_rate_bucket(gf):
+    limiter = gf.MemoryUploadLimiter(10, 20, 4, 10 ** 6)
+    ticket, _, _ = limiter.admit("A", 20)
+    limiter.release(ticket)
+    ticket, retry_after, reason = limiter.admit("A", 5)
+    assert ticket is None and reason == "rate"
+    assert 0 < retry_after <= 0.5
+
+
+def test_import_rejected_before_first_chunk(gf, tenant, limiter, monkeypatch):
+    limiter(max_concurrent=0)
+    monkeypatch.setattr(gf, "IMPORT_ADMIT_WAIT", 0)
+    rows = [["Ref"], ["A"], ["B"]]
+    report = gf.import_rows(tenant[0], rows)
+    assert report["error"] == "rate_limited" and report["reason"] == "tenant_concurrency"
+    assert report["saved"] == 0 and report["next_row"] == 2
+
+
+def test_import_waits_for_admission_mid_file(gf, tenant, limiter, monkeypatch):
+    # الدلو يتسع لدفعة واحدة: الدفعة الثانية تنتظر retry_after بدل ترك ملف نصف مستورد
+    limiter(rate=1000, burst=2)
+    sleeps = []
+    monkeypatch.setattr(gf.time, "sleep", sleeps.append)
+    real_admit = gf.upload_limiter.admit
+    calls = []
+
+    def admit(client_id, n_lines):
+        calls.append(n_lines)
+        if len(calls) == 2:
+            return None, 0.5, "rate"
+        return real_admit(client_id, n_lines)
+
+    monkeypatch.setattr(gf.upload_limiter, "admit", admit)
+    report = gf.import_rows(tenant[0], [["Ref"], ["A"], ["B"], ["C"]], chunk_size=2)
+    assert report["ok"] and report["saved"] == 3
+    assert sleeps == [1]
+
+
+def test_import_stops_mid_file_after_admit_wait(gf, tenant, limiter, monkeypatch):
+    limiter()
+    monkeypatch.setattr(gf, "IMPORT_ADMIT_WAIT", 0)
+    real_admit = gf.upload_limiter.admit
+    calls = []
+
+    def admit(client_id, n_lines):
+        calls.append(n_lines)
+        if len(calls) > 1:
+            return None, 1.0, "write_budget"
+        return real_admit(client_id, n_lines)
+
+    monkeypatch.setattr(gf.upload_limiter, "admit", admit)
+    report = gf.import_rows(tenant[0], [["Ref"], ["A"], ["B"], ["C"]], chunk_size=2)
+    assert report["error"] == "rate_limited"
+    assert report["saved"] == 2 and report["next_row"] == 4
+    assert gf.upload_limiter.active[tenant[0]] == 0
+
+
+def test_import_lines_returns_429(gf, tenant, limiter, monkeypatch):
+    limiter(max_concurrent=0)
+    monkeypatch.setattr(gf, "IMPORT_ADMIT_WAIT", 0)
+    client_id, api_key = tenant
+    res = gf.app.test_client().post(
+        "/api/import_lines",
+        headers={"X-Client-Id": client_id, "X-Api-Key": api_key},
+        data={"file": (io.BytesIO(b"Ref,Prix\nA,1\n"), "cat.csv")},
+    )
+    assert res.status_code == 429
+    assert res.headers["Retry-After"] == "1"
+    assert res.get_json()["saved"] == 0
@@ -0,0 +1,39 @@
+import gzip
+
+
+def css_asset(gf):
+    return next(a for a in gf.STATIC_ASSETS.values() if a.name == "gf.css")
+
+
+def test_asset_filename_carries_content_digest(gf):
+    asset = css_asset(gf)
+    assert asset.filename == f"gf.{asset.digest}.css"
+    other = gf.StaticAsset("gf.css", gf.GF_CSS + "\nbody{}", "text/css")
+    assert other.filename != asset.filename
+
+
+def test_asset_served_immutable_and_compressed(gf):
+    asset = css_asset(gf)
+    client = gf.app.test_client()
+    res = client.get(f"/assets/{asset.filename}", headers={"Accept-Encoding": "gzip"})
+    assert res.status_code == 200
+    assert "immutable" in res.headers["Cache-Control"]
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(res.data) == asset.body
+
+    plain = client.get(f"/assets/{asset.filename}")
+    assert "Content-Encoding" not in plain.headers and plain.data == asset.body
+
+
+def test_asset_etag_and_stale_fingerprint(gf):
+    asset = css_asset(gf)
+    client = gf.app.test_client()
+    res = client.get(f"/assets/{asset.filename}", headers={"If-None-Match": f'"{asset.digest}"'})
+    assert res.status_code == 304
+    assert client.get("/assets/gf.000000000000.css").status_code == 404
+
+
+def test_pages_link_fingerprinted_assets(gf, tenant, web):
+    res = web.get(f"/client/{tenant[0]}/lines")
+    for asset in gf.STATIC_ASSETS.values():
+        assert f"/assets/{asset.filename}".encode() in res.data
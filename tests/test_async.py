@@ -0,0 +1,82 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+gf_async = pytest.importorskip("gf_server_async")
+
+
+def call(method, path, body=b"", query=b""):
+    """طلب HTTP واحد إلى تطبيق ASGI: (status, headers, body)."""
+    sent = []
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query,
+             "headers": []}
+    asyncio.run(gf_async.app(scope, receive, send))
+    start = sent[0]
+    return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def upload_payload(lines):
+    return {"client_id": "LOCAL-TEST", "api_key": "TESTKEY123", "lines": lines}
+
+
+def stored_prices(gf, refs):
+    with gf.engine.connect() as conn:
+        rows = conn.execute(gf.text("SELECT reference, prix FROM lines WHERE client_id = 'LOCAL-TEST'"))
+        return {ref: prix for ref, prix in rows if ref in refs}
+
+
+def test_async_upload_stores_the_same_values_as_flask(gf):
+    tag = uuid.uuid4().hex[:6]
+    lines = lambda side: [{"reference": f"{side}-{tag}-{i}", "prix": p, "fournisseur": "F"}
+                          for i, p in enumerate(["12.5", 3, "", "abc"])]
+
+    status, _, body = call("POST", "/api/upload_lines",
+                           json.dumps(upload_payload(lines("A"))).encode())
+    assert status == 200 and json.loads(body)["saved"] == 4
+    resp = gf.app.test_client().post("/api/upload_lines", json=upload_payload(lines("S")))
+    assert resp.status_code == 200
+
+    stored = stored_prices(gf, {line["reference"] for line in lines("A") + lines("S")})
+    for i, expected in enumerate([12.5, 3.0, None, None]):
+        assert stored[f"A-{tag}-{i}"] == stored[f"S-{tag}-{i}"] == expected
+
+
+def test_async_upload_uses_the_sync_ingest_path(gf, monkeypatch):
+    calls = []
+    monkeypatch.setattr(gf, "ingest_chunked", lambda cid, plan: calls.append(plan) or (0, []))
+    status, _, _ = call("POST", "/api/upload_lines",
+                        json.dumps(upload_payload([{"reference": "X"}])).encode())
+    assert status == 200 and len(calls) == 1
+
+
+def test_async_search_matches_flask(gf, tenant, ingest, web):
+    ingest(tenant[0], ["ASYNC-1", "ASYNC-2", "OTHER"])
+    cookie = web.get_cookie(gf.app.config["SESSION_COOKIE_NAME"])
+    # الجلسة نفسها: نمرر كوكي Flask الموقّع
+    sent = []
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": f"/client/{tenant[0]}/lines",
+             "query_string": b"ajax=1&q=ASYNC",
+             "headers": [(b"cookie", f"{cookie.key}={cookie.value}".encode())]}
+    asyncio.run(gf_async.app(scope, receive, send))
+    assert sent[0]["status"] == 200
+    rows = json.loads(b"".join(m.get("body", b"") for m in sent[1:]))
+    flask_rows = web.get(f"/client/{tenant[0]}/lines?ajax=1&q=ASYNC").get_json()
+    assert [r["reference"] for r in rows] == [r["reference"] for r in flask_rows]
@@ -0,0 +1,62 @@
+import pytest
+
+
+def line_ids(gf, client_id):
+    with gf.engine.connect() as conn:
+        return conn.execute(gf.text("SELECT id FROM lines WHERE client_id = :cid ORDER BY id"),
+                            {"cid": client_id}).scalars().all()
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("3,1,3, 2", [3, 1, 2]),
+    ("", []),
+    (None, []),
+    ("1,,2", [1, 2]),
+])
+def test_parse_ids_param(gf, value, expected):
+    assert gf.parse_ids_param(value) == expected
+
+
+def test_lines_by_ids_with_api_key(gf, tenant, ingest):
+    client_id, api_key = tenant
+    ingest(client_id, ["A", "B"], fournisseur="Garage Nord")
+    ids = line_ids(gf, client_id)
+    other = gf.app.test_client()
+    res = other.get(f"/api/client/{client_id}/lines?ids={ids[1]},{ids[0]},999999999",
+                    headers={"X-Client-Id": client_id, "X-Api-Key": api_key})
+    body = res.get_json()
+    assert body["columns"] == gf.LINES_BATCH_COLUMNS
+    ref, name = body["columns"].index("reference"), body["columns"].index("supplier_name")
+    assert [(r[ref], r[name]) for r in body["rows"]] == [("A", "Garage Nord"), ("B", "Garage Nord")]
+    assert body["missing"] == [999999999]
+
+
+def test_other_tenant_ids_are_missing(gf, tenant, ingest, web):
+    ingest("LOCAL-TEST", ["THEIRS"])
+    theirs = line_ids(gf, "LOCAL-TEST")[-1]
+    body = web.get(f"/api/client/{tenant[0]}/lines?ids={theirs}").get_json()
+    assert body["rows"] == [] and body["missing"] == [theirs]
+
+
+def test_suppliers_by_ids_with_session(gf, tenant, ingest, web):
+    client_id = tenant[0]
+    ingest(client_id, ["A", "B"], fournisseur="Garage Nord")
+    with gf.engine.connect() as conn:
+        sid = conn.execute(gf.text("SELECT id FROM suppliers WHERE client_id = :cid"),
+                           {"cid": client_id}).scalar()
+    body = web.get(f"/api/client/{client_id}/suppliers?ids={sid}").get_json()
+    count = body["columns"].index("line_count")
+    assert body["rows"][0][count] == 2
+
+
+@pytest.mark.parametrize("query, error", [("ids=a", "bad_ids"), ("ids=", "no_ids")])
+def test_batch_api_rejects_bad_ids(gf, tenant, web, query, error):
+    res = web.get(f"/api/client/{tenant[0]}/lines?{query}")
+    assert res.status_code == 400 and res.get_json()["error"] == error
+
+
+def test_batch_api_limits_and_auth(gf, tenant, web, monkeypatch):
+    monkeypatch.setattr(gf, "API_BATCH_MAX", 2)
+    res = web.get(f"/api/client/{tenant[0]}/lines?ids=1,2,3")
+    assert res.get_json()["error"] == "too_many_ids"
+    assert web.get("/api/client/OTHER/lines?ids=1").status_code == 401
@@ -0,0 +1,60 @@
+def changes(gf, tenant, since):
+    client_id, api_key = tenant
+    resp = gf.app.test_client().get(f"/api/lines/changes?since={since}",
+                                    headers={"X-Client-Id": client_id, "X-Api-Key": api_key})
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def rows(gf, sql, client_id):
+    with gf.engine.connect() as conn:
+        return [tuple(r) for r in conn.execute(gf.text(sql), {"cid": client_id}).fetchall()]
+
+
+def test_changes_after_compaction_are_not_skipped(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["A", "B", "C"])
+    first = changes(gf, tenant, 0)
+    assert len(first["rows"]) == 3
+
+    # الضغط يحذف السطور ذات أكبر change_seq: الرقم التالي يجب ألا يعود إلى الوراء
+    assert gf.compact_lines(older_than_days=-1, client_id=client_id, vacuum=False) == 3
+    ingest(client_id, ["NEW"])
+
+    after = changes(gf, tenant, first["next"])
+    assert [row[3] for row in after["rows"]] == ["NEW"]
+    assert int(after["next"]) > int(first["next"])
+
+
+def test_compaction_folds_into_monthly_history(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["A"], prix=10, date="2024-01-05")
+    ingest(client_id, ["A"], prix=14, date="20/01/2024")
+    ingest(client_id, ["A"], prix=9, date="2024-02-01")
+    before = rows(gf, "SELECT * FROM price_stats WHERE client_id = :cid", client_id)
+
+    assert gf.compact_lines(older_than_days=-1, batch_size=2, client_id=client_id,
+                            archive=True, vacuum=False) == 3
+
+    history = rows(gf, """
+        SELECT month, last_price, last_date, min_price, max_price, price_count
+        FROM price_history WHERE client_id = :cid ORDER BY month
+    """, client_id)
+    assert history == [("2024-01", 14.0, "2024-01-20", 10.0, 14.0, 2),
+                       ("2024-02", 9.0, "2024-02-01", 9.0, 9.0, 1)]
+    # price_stats يبقى شاملاً، والسطور الخام في الأرشيف
+    assert rows(gf, "SELECT * FROM price_stats WHERE client_id = :cid", client_id) == before
+    assert rows(gf, "SELECT COUNT(*) FROM lines WHERE client_id = :cid", client_id) == [(0,)]
+    assert rows(gf, "SELECT COUNT(*) FROM lines_archive WHERE client_id = :cid", client_id) == [(3,)]
+
+    # rebuild_price_stats يضيف ملخصات price_history للسطور المضغوطة
+    with gf.write_transaction() as conn:
+        gf.rebuild_price_stats(conn, client_id)
+    assert rows(gf, "SELECT * FROM price_stats WHERE client_id = :cid", client_id) == before
+
+
+def test_compaction_keeps_recent_lines(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["A"])
+    assert gf.compact_lines(older_than_days=1, client_id=client_id, vacuum=False) == 0
+    assert rows(gf, "SELECT COUNT(*) FROM lines WHERE client_id = :cid", client_id) == [(1,)]
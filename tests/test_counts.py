@@ -0,0 +1,54 @@
+def stats(gf, client_id):
+    with gf.engine.connect() as conn:
+        total = conn.execute(gf.text("SELECT total_lines FROM client_stats WHERE client_id = :cid"),
+                             {"cid": client_id}).scalar()
+        per_supplier = conn.execute(gf.text("""
+            SELECT supplier_id, line_count FROM supplier_stats
+            WHERE client_id = :cid AND line_count <> 0 ORDER BY supplier_id
+        """), {"cid": client_id}).all()
+    return total, per_supplier
+
+
+def rebuilt(gf, client_id):
+    with gf.write_transaction() as conn:
+        gf.rebuild_client_stats(conn, client_id)
+    return stats(gf, client_id)
+
+
+def test_incremental_stats_match_rebuild(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["A", "B", "C"])
+    ingest(client_id, ["D"], fournisseur="G")
+    incremental = stats(gf, client_id)
+    assert incremental[0] == 4
+    assert incremental == rebuilt(gf, client_id)
+
+
+def test_subtract_client_stats(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["A", "B", "C"])
+    (sid, _), = stats(gf, client_id)[1]
+    with gf.write_transaction() as conn:
+        gf.subtract_client_stats(conn, [(client_id, sid, 2), (client_id, None, 0)])
+    assert stats(gf, client_id) == (1, [(sid, 1)])
+
+
+def test_compaction_keeps_stats_consistent(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["A", "B"])
+    ingest(client_id, ["C"], fournisseur="G")
+    gf.compact_lines(older_than_days=-1, client_id=client_id, vacuum=False)
+    assert stats(gf, client_id) == (0, [])
+    assert stats(gf, client_id) == rebuilt(gf, client_id)
+
+
+def test_count_headers_and_cap(gf, tenant, ingest, web, monkeypatch):
+    client_id = tenant[0]
+    ingest(client_id, [f"CAP-{i}" for i in range(5)])
+    resp = web.get(f"/client/{client_id}/lines?ajax=1")
+    assert resp.headers["X-Total-Count"] == "5" and resp.headers["X-Total-Capped"] == "0"
+
+    monkeypatch.setattr(gf, "COUNT_CAP", 3)
+    resp = web.get(f"/client/{client_id}/lines?ajax=1&q=CAP")
+    assert resp.headers["X-Total-Count"] == "3" and resp.headers["X-Total-Capped"] == "1"
+    assert gf.count_label(10000, True) == "10 000+"
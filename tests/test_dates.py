@@ -0,0 +1,67 @@
+from datetime import date
+
+import pytest
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("31/12/2023", date(2023, 12, 31)),
+    ("31/12/23", date(2023, 12, 31)),
+    ("31-12-2023", date(2023, 12, 31)),
+    ("31.12.2023", date(2023, 12, 31)),
+    ("31/12/2023 14:30", date(2023, 12, 31)),
+    ("2023/12/31", date(2023, 12, 31)),
+    ("2023-12-31", date(2023, 12, 31)),
+    ("2023-12-31T08:00:00", date(2023, 12, 31)),
+    (" 31/12/2023 ", date(2023, 12, 31)),
+    ("31/02/2023", None),
+    ("bientôt", None),
+    ("", None),
+    (None, None),
+])
+def test_date_parser_formats(gf, value, expected):
+    assert gf.DateParser().parse(value) == expected
+
+
+def test_date_parser_remembers_last_format(gf):
+    dates = gf.DateParser()
+    dates.parse("05.01.2024")
+    assert dates.last_format == "%d.%m.%Y"
+    assert dates.parse("06.01.2024") == date(2024, 1, 6)
+    assert "05.01.2024" in dates.memo
+
+
+def test_ingest_stores_typed_iso_date(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["A"], date="05/01/2024")
+    ingest(client_id, ["B"], date="plus tard")
+    with gf.engine.connect() as conn:
+        rows = conn.execute(gf.text(
+            "SELECT reference, date, date_d FROM lines WHERE client_id = :cid ORDER BY id"
+        ), {"cid": client_id}).fetchall()
+    assert [tuple(r) for r in rows] == [("A", "2024-01-05", "2024-01-05"),
+                                        ("B", "plus tard", None)]
+
+
+def test_lines_date_range_filter(gf, tenant, ingest, web):
+    client_id = tenant[0]
+    ingest(client_id, ["DEC"], date="31/12/2023")
+    ingest(client_id, ["JAN"], date="2024-01-15")
+    ingest(client_id, ["FEB"], date="01.02.2024")
+    ingest(client_id, ["NONE"])
+
+    res = web.get(f"/client/{client_id}/lines?ajax=1&from=01/01/2024&to=2024-01-31")
+    assert [r["reference"] for r in res.get_json()] == ["JAN"]
+    res = web.get(f"/client/{client_id}/lines?ajax=1&from=2024-01-01")
+    assert sorted(r["reference"] for r in res.get_json()) == ["FEB", "JAN"]
+
+
+def test_backfill_line_dates(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["A"], date="2024-03-01")
+    with gf.write_transaction() as conn:
+        conn.execute(gf.text("UPDATE lines SET date = '01/03/2024', date_d = NULL "
+                             "WHERE client_id = :cid"), {"cid": client_id})
+        assert gf.backfill_line_dates(conn) >= 1
+        row = conn.execute(gf.text("SELECT date, date_d FROM lines WHERE client_id = :cid"),
+                           {"cid": client_id}).one()
+    assert tuple(row) == ("2024-03-01", "2024-03-01")
@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+
+import pytest
+
+SLOW_SQL = """
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 50000000)
+    SELECT COUNT(*) FROM n
+"""
+
+
+def test_sqlite_deadline_cancels_query(gf, monkeypatch):
+    monkeypatch.setitem(gf.ROUTE_DEADLINES_MS, "client_lines", 50)
+    with gf.engine.connect() as conn:
+        with pytest.raises(gf.QueryDeadlineExceeded):
+            with gf.query_deadline(conn, "client_lines"):
+                conn.execute(gf.text(SLOW_SQL))
+        conn.rollback()
+        # المعالج أُزيل: نفس الاتصال يعمل بلا مهلة بعدها
+        assert conn.execute(gf.text("SELECT 1")).scalar() == 1
+
+
+def test_zero_deadline_disables_limit(gf, monkeypatch):
+    monkeypatch.setitem(gf.ROUTE_DEADLINES_MS, "client_lines", 0)
+    with gf.engine.connect() as conn, gf.query_deadline(conn, "client_lines"):
+        assert conn.execute(gf.text("SELECT 1")).scalar() == 1
+
+
+@pytest.fixture
+def first_query_times_out(gf, monkeypatch):
+    """أول query_deadline يتجاوز المهلة، والتالية تمر (مثل بحث واسع ثم نافذة أصغر)."""
+    real = gf.query_deadline
+    calls = []
+
+    @contextmanager
+    def flaky(conn, route):
+        calls.append(route)
+        if len(calls) == 1:
+            raise gf.QueryDeadlineExceeded(route)
+        with real(conn, route):
+            yield
+
+    monkeypatch.setattr(gf, "query_deadline", flaky)
+    return calls
+
+
+def test_search_degrades_to_partial_results(gf, tenant, ingest, web, first_query_times_out):
+    client_id = tenant[0]
+    ingest(client_id, ["FILTRE-1", "AUTRE"])
+    res = web.get(f"/client/{client_id}/lines?ajax=1&q=filtre")
+    assert res.status_code == 200
+    assert res.headers["X-Search-Partial"] == "1"
+    assert [r["reference"] for r in res.get_json()] == ["FILTRE-1"]
+    assert first_query_times_out == ["client_lines", "client_lines"]
+
+
+def test_api_deadline_returns_503(gf, tenant, web, first_query_times_out):
+    res = web.get(f"/api/client/{tenant[0]}/lines?ids=1")
+    assert res.status_code == 503
+    assert res.headers["Retry-After"] == "5"
+    assert res.get_json()["error"] == "query_timeout"
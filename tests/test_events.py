@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def hub(gf, monkeypatch):
+    hub = gf.LineEventHub()
+    monkeypatch.setattr(gf, "line_events", hub)
+    return hub
+
+
+def test_hub_limit_and_publish_per_tenant(gf, hub):
+    hub.limit = 2
+    a = hub.subscribe("A")
+    b = hub.subscribe("B")
+    assert hub.subscribe("A") is None and hub.count() == 2
+
+    hub.publish("A")
+    assert a.is_set() and not b.is_set()
+
+    hub.unsubscribe("A", a)
+    assert hub.subscribe("A") is not None
+
+
+def test_hub_limit_leaves_free_threads(gf, hub, monkeypatch):
+    monkeypatch.setattr(gf, "SSE_MAX_CLIENTS", 50)
+    hub.limit_to_threads(8)
+    assert hub.limit == 8 - gf.SSE_FREE_THREADS
+    hub.limit_to_threads(1)
+    assert hub.limit == 0
+
+
+def test_events_rejected_above_limit(gf, tenant, web, hub):
+    hub.limit = 0
+    res = web.get(f"/client/{tenant[0]}/events")
+    assert res.status_code == 503 and res.headers["Retry-After"] == "30"
+
+
+def test_events_resume_from_last_event_id(gf, tenant, ingest, web, hub, monkeypatch):
+    monkeypatch.setattr(gf, "SSE_MAX_SECONDS", 5)
+    client_id = tenant[0]
+    ingest(client_id, ["A", "B"])
+    res = web.get(f"/client/{client_id}/events", headers={"Last-Event-ID": "0"}, buffered=False)
+    assert res.mimetype == "text/event-stream" and hub.count() == 1
+
+    chunks = iter(res.response)
+    assert next(chunks).startswith(b"retry:")
+    events = [next(chunks).decode() for _ in range(2)]
+    res.close()
+
+    data = [json.loads(e.split("data: ", 1)[1]) for e in events]
+    assert [d["reference"] for d in data] == ["A", "B"]
+    assert all(e.startswith("id: ") and "event: line" in e for e in events)
+    assert hub.count() == 0
+
+
+def test_events_require_own_session(gf, web):
+    assert web.get("/client/OTHER/events").status_code == 403
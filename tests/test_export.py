@@ -0,0 +1,42 @@
+import csv
+import gzip
+import io
+import json
+
+
+def test_export_csv(gf, tenant, ingest, web):
+    client_id = tenant[0]
+    ingest(client_id, ["A", "B"], designation="Filtre à huile")
+    res = web.get(f"/client/{client_id}/export.csv", headers={"Accept-Encoding": "identity"})
+    assert res.status_code == 200 and res.mimetype == "text/csv"
+    assert "Content-Encoding" not in res.headers
+
+    rows = list(csv.reader(io.StringIO(res.get_data(as_text=True))))
+    assert rows[0] == gf.EXPORT_COLUMNS
+    ref = gf.EXPORT_COLUMNS.index("reference")
+    assert [r[ref] for r in rows[1:]] == ["A", "B"]
+
+
+def test_export_ndjson_gzip_with_filters(gf, tenant, ingest, web):
+    client_id = tenant[0]
+    ingest(client_id, ["OLD"], date="2023-06-01")
+    ingest(client_id, ["NEW"], date="15/02/2024")
+    res = web.get(f"/client/{client_id}/export.ndjson?from=01/01/2024",
+                  headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+
+    lines = gzip.decompress(res.data).decode("utf-8").splitlines()
+    assert [json.loads(line)["reference"] for line in lines] == ["NEW"]
+
+
+def test_export_chunks_stay_bounded(gf, monkeypatch):
+    monkeypatch.setattr(gf, "EXPORT_CHUNK_BYTES", 64)
+    rows = [(i, "2024-01-01", f"R{i}", "d", "m", 1.0, 1, "c", "s", None) for i in range(50)]
+    chunks = list(gf._csv_chunks(iter(rows)))
+    assert len(chunks) > 5
+    assert all(len(c) < 64 + 100 for c in chunks)
+
+
+def test_export_requires_own_session(gf, tenant, web):
+    assert web.get("/client/OTHER/export.csv").status_code == 403
+    assert web.get(f"/client/{tenant[0]}/export.xml").status_code == 404
@@ -0,0 +1,63 @@
+import pytest
+
+
+def test_fragment_cache_evicts_least_recent_by_bytes(gf):
+    cache = gf.FragmentCache(10)
+    cache.put_many([("a", "xxxx"), ("b", "yyyy")])
+    assert cache.get_many(["a"]) == ["xxxx"]      # a يصبح الأحدث
+    cache.put_many([("c", "zzzz")])
+    assert cache.get_many(["a", "b", "c"]) == ["xxxx", None, "zzzz"]
+    assert cache.size == 8
+
+
+def test_fragment_cache_replaces_key_size(gf):
+    cache = gf.FragmentCache(100)
+    cache.put_many([("a", "x" * 10)])
+    cache.put_many([("a", "x" * 3)])
+    assert cache.size == 3
+
+
+@pytest.fixture
+def request_ctx(gf):
+    """render_cards يستعمل url_for: يحتاج سياق طلب."""
+    with gf.app.test_request_context():
+        yield
+
+
+def test_render_cards_reuses_cached_html(gf, tenant, ingest, request_ctx, monkeypatch):
+    client_id = tenant[0]
+    ingest(client_id, ["A", "B"])
+    rows, _ = gf.hot_pages.get(client_id)
+    monkeypatch.setattr(gf, "card_cache", gf.FragmentCache(1 << 20))
+    html = gf.render_cards(client_id, rows)
+    assert "A" in html and len(gf.card_cache.items) == 2
+
+    def no_render(**kwargs):
+        raise AssertionError("cached card rendered again")
+
+    monkeypatch.setattr(gf._card_template, "render", no_render)
+    assert gf.render_cards(client_id, rows) == html
+
+
+def test_supplier_change_invalidates_card(gf, tenant, ingest, request_ctx, monkeypatch):
+    client_id = tenant[0]
+    ingest(client_id, ["A"])
+    rows, _ = gf.hot_pages.get(client_id)
+    monkeypatch.setattr(gf, "card_cache", gf.FragmentCache(1 << 20))
+    gf.render_cards(client_id, rows)
+
+    changed = [dict(rows[0], supplier_name="Autre", supplier_seq=(rows[0]["supplier_seq"] or 0) + 1)]
+    assert "Autre" in gf.render_cards(client_id, changed)
+    assert len(gf.card_cache.items) == 2
+
+
+def test_lines_page_does_not_compile_templates(gf, tenant, ingest, web, monkeypatch):
+    ingest(tenant[0], ["A"])
+
+    def no_compile(source, *args, **kwargs):
+        raise AssertionError("template compiled per request")
+
+    monkeypatch.setattr(gf.app.jinja_env, "from_string", no_compile)
+    res = web.get(f"/client/{tenant[0]}/lines")
+    assert res.status_code == 200
+    assert b"A" in res.data
@@ -0,0 +1,70 @@
+import pytest
+
+from test_partitions import RecordingConn
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    ("rb5021", "rb5021", 0),
+    ("rb5021", "r5b021", 1),     # تبديل حرفين متجاورين = خطأ واحد
+    ("rb5021", "rb502", 1),
+    ("rb5021", "rx5022", 2),
+    ("abcd", "badc", 2),
+])
+def test_edit_distance_osa(gf, a, b, expected):
+    assert gf.edit_distance(a, b, 3) == expected
+
+
+def test_edit_distance_stops_at_limit(gf):
+    assert gf.edit_distance("rb5021", "zzzzzz", 2) == 3
+    assert gf.edit_distance("rb", "rb5021", 2) == 3
+
+
+def test_ref_grams_padding_matches_pg_trgm(gf):
+    assert gf.ref_grams("ab") == {"  a", " ab", "ab "}
+
+
+def test_rank_references_orders_by_distance(gf):
+    ranked = gf.rank_references("rb5021", ["RB-5021X", "RB5021", "R5B021", "ZZ9999"])
+    assert ranked == ["RB5021", "R5B021", "RB-5021X"]
+
+
+def test_ref_index_keeps_spelling_variants(gf):
+    index = gf.RefNgramIndex()
+    for ref in ("RB-5021", "rb5021", "RB-5021", "XY1234"):
+        index.add(ref)
+    assert index.keys == ["rb5021", "xy1234"]
+    assert index.candidates("r5b021", 1) == ["RB-5021", "rb5021"]
+
+
+def test_fuzzy_references_from_tenant_lines(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["RB5021", "XY1234"])
+    gf.ref_indexes._build(client_id)
+    assert gf.fuzzy_references(client_id, "R5B021") == ["RB5021"]
+
+    # المراجع الجديدة تدخل الفهرس عبر change_seq بدون إعادة بناء
+    ingest(client_id, ["QW7788"])
+    assert gf.fuzzy_references(client_id, "QW7878") == ["QW7788"]
+    assert gf.fuzzy_references(client_id, "abc") == []
+
+
+def test_fuzzy_search_fallback_header(gf, tenant, ingest, web):
+    client_id = tenant[0]
+    ingest(client_id, ["RB5021"])
+    gf.ref_indexes._build(client_id)
+    res = web.get(f"/client/{client_id}/lines?ajax=1&q=R5B021")
+    assert res.status_code == 200
+    assert res.headers.get("X-Search-Fuzzy") == "1"
+    assert [row["reference"] for row in res.get_json()] == ["RB5021"]
+
+
+@pytest.mark.parametrize("btree_gin, lead", [(True, "client_id, "), (False, "")])
+def test_pg_reference_trigram_index_on_lines(gf, monkeypatch, btree_gin, lead):
+    conn = RecordingConn()
+    monkeypatch.setattr(gf, "IS_POSTGRES", True)
+    monkeypatch.setattr(gf, "pg_extension_installed",
+                        lambda conn, name: name == "pg_trgm" or btree_gin)
+    gf.create_lines_indexes(conn, "lines_new", suffix="_new")
+    # نفس مجموعة SQLite: مراجع lines (وأجزائه)، لا price_stats
+    assert (f"CREATE INDEX IF NOT EXISTS {gf.LINES_REF_TRGM_INDEX}_new ON lines_new "
+            f"USING gin ({lead}({gf.PG_REF_KEY_SQL}) gin_trgm_ops)") in conn.sql
@@ -0,0 +1,75 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+
+def count_lines(gf, client_id):
+    with gf.engine.connect() as conn:
+        return conn.execute(gf.text("SELECT COUNT(*) FROM lines WHERE client_id = :c"),
+                            {"c": client_id}).scalar()
+
+
+@pytest.fixture
+def writer(gf, monkeypatch):
+    """كاتب بلا خيط: الاختبار يتحكم في متى (وهل) تبدأ الكتابة."""
+    writer = gf.GroupCommitWriter(wait_ms=0, max_group_lines=1000, timeout=0.05)
+    monkeypatch.setattr(writer, "_ensure_thread", lambda: None)
+    return writer
+
+
+def test_group_commit_writes_all_requests(gf, tenant, writer):
+    client_id = tenant[0]
+    group = [(client_id, [{"reference": ref, "prix": 1}], Future()) for ref in ("A", "B")]
+    writer._commit(group)
+    assert [future.result() for _, _, future in group] == [1, 1]
+    assert count_lines(gf, client_id) == 2
+
+
+def test_group_commit_fallback_isolates_bad_request(gf, tenant, writer, monkeypatch):
+    client_id = tenant[0]
+    ingest_lines = gf.ingest_lines
+
+    def picky(conn, cid, lines, supplier_cache=None):
+        if lines[0]["reference"] == "BAD":
+            raise ValueError("bad line")
+        return ingest_lines(conn, cid, lines, supplier_cache)
+
+    monkeypatch.setattr(gf, "ingest_lines", picky)
+    group = [(client_id, [{"reference": ref, "prix": 1}], Future()) for ref in ("A", "BAD", "C")]
+    writer._commit(group)
+
+    assert group[0][2].result() == 1 and group[2][2].result() == 1
+    with pytest.raises(ValueError):
+        group[1][2].result()
+    assert count_lines(gf, client_id) == 2
+
+
+def test_timeout_before_start_is_never_written(gf, tenant, writer):
+    client_id = tenant[0]
+    with pytest.raises(gf.FutureTimeoutError):
+        writer.ingest(client_id, [{"reference": "LATE", "prix": 1}])
+
+    # الطلب الملغى يُتجاوز: المجموعة التالية تبدأ بالطلب الحي فقط
+    live = Future()
+    writer.queue.put((client_id, [{"reference": "LIVE", "prix": 1}], live))
+    group = writer._collect()
+    assert [item[2] for item in group] == [live]
+    writer._commit(group)
+    assert count_lines(gf, client_id) == 1
+
+
+def test_timeout_after_start_waits_for_result(gf, tenant, writer):
+    release = threading.Event()
+
+    def slow_writer():
+        _, lines, future = writer.queue.get()
+        future.set_running_or_notify_cancel()
+        release.wait(5)
+        future.set_result(len(lines))
+
+    thread = threading.Thread(target=slow_writer, daemon=True)
+    thread.start()
+    threading.Timer(0.2, release.set).start()
+    assert writer.ingest(tenant[0], [{"reference": "A"}, {"reference": "B"}]) == 2
+    thread.join(1)
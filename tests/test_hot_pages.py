@@ -0,0 +1,108 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+def test_hot_page_sees_commits_inside_check_window(gf, tenant, ingest, monkeypatch):
+    client_id = tenant[0]
+    monkeypatch.setattr(gf.hot_pages, "check", 3600.0)
+    ingest(client_id, ["A", "B"])
+    rows, total = gf.hot_pages.get(client_id)
+    assert [r["reference"] for r in rows] == ["B", "A"] and total == 2
+
+    # lines_committed يكفي لإبطال العنصر رغم أن نافذة الفحص لم تنته
+    ingest(client_id, ["C"])
+    rows, total = gf.hot_pages.get(client_id)
+    assert [r["reference"] for r in rows] == ["C", "B", "A"] and total == 3
+
+
+def test_hot_page_detects_deletes_from_other_writers(gf, tenant, ingest, monkeypatch):
+    client_id = tenant[0]
+    monkeypatch.setattr(gf.hot_pages, "check", 0.0)
+    ingest(client_id, ["A", "B"])
+    assert len(gf.hot_pages.get(client_id)[0]) == 2
+
+    # الضغط لا يمر عبر lines_committed: فحص النسخة هو الذي يكشف الحذف
+    gf.compact_lines(older_than_days=-1, client_id=client_id, vacuum=False)
+    rows, _ = gf.hot_pages.get(client_id)
+    assert rows == []
+
+
+def test_hot_page_on_commit_does_not_query(gf, tenant, ingest, monkeypatch):
+    client_id = tenant[0]
+    ingest(client_id, ["A"])
+    gf.hot_pages.get(client_id)
+
+    def no_db():
+        raise AssertionError("on_commit must not touch the database")
+
+    monkeypatch.setattr(gf.engine, "connect", no_db)
+    gf.hot_pages.on_commit(client_id)
+    assert gf.hot_pages.entries[client_id]["checked"] == 0.0
+
+
+def commit_during_refresh(gf, monkeypatch, client_id):
+    """on_commit يصل بعد قراءة النسخة وقبل نهاية التحديث."""
+    connect = gf.engine.connect
+
+    class Conn:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def execute(self, *args, **kwargs):
+            result = self.conn.execute(*args, **kwargs)
+            gf.hot_pages.on_commit(client_id)
+            return result
+
+    @contextmanager
+    def racing_connect():
+        with connect() as conn:
+            yield Conn(conn)
+
+    monkeypatch.setattr(gf.engine, "connect", racing_connect)
+
+
+def test_hot_page_load_keeps_commit_mark(gf, tenant, ingest, monkeypatch):
+    client_id = tenant[0]
+    monkeypatch.setattr(gf.hot_pages, "check", 3600.0)
+    ingest(client_id, ["A"])
+    commit_during_refresh(gf, monkeypatch, client_id)
+    gf.hot_pages.get(client_id)
+    assert gf.hot_pages.entries[client_id]["checked"] == 0.0
+
+
+def test_hot_page_unchanged_version_keeps_commit_mark(gf, tenant, ingest, monkeypatch):
+    client_id = tenant[0]
+    monkeypatch.setattr(gf.hot_pages, "check", 3600.0)
+    ingest(client_id, ["A"])
+    gf.hot_pages.get(client_id)
+    gf.hot_pages.on_commit(client_id)
+
+    commit_during_refresh(gf, monkeypatch, client_id)
+    gf.hot_pages.get(client_id)
+    assert gf.hot_pages.entries[client_id]["checked"] == 0.0
+
+
+def test_hot_page_single_flight(gf, tenant, ingest, monkeypatch):
+    client_id = tenant[0]
+    ingest(client_id, ["A"])
+    connect = gf.engine.connect
+    loads = []
+
+    def slow_connect():
+        loads.append(threading.current_thread().name)
+        time.sleep(0.2)
+        return connect()
+
+    monkeypatch.setattr(gf.engine, "connect", slow_connect)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(gf.hot_pages.get(client_id)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(loads) == 1
+    assert [total for _, total in results] == [1] * 5
+    assert client_id not in gf.hot_pages.loading
@@ -0,0 +1,94 @@
+import io
+import json
+
+import pytest
+
+
+def post_import(gf, tenant, data: bytes, filename="cat.csv", **form):
+    client_id, api_key = tenant
+    return gf.app.test_client().post(
+        "/api/import_lines",
+        headers={"X-Client-Id": client_id, "X-Api-Key": api_key},
+        data=dict(form, file=(io.BytesIO(data), filename)),
+    )
+
+
+def test_csv_cp1252_header_is_decoded(gf, tenant):
+    data = "Référence;Désignation;Prix\nA1;Filtre à huile;12,50\n".encode("cp1252")
+    rows = list(gf._iter_csv_rows(io.BytesIO(data)))
+    assert rows == [["Référence", "Désignation", "Prix"], ["A1", "Filtre à huile", "12,50"]]
+
+    report = gf.import_rows(tenant[0], rows)
+    assert report["saved"] == 1 and report["error_count"] == 0
+
+
+def test_csv_utf8_bom_is_stripped(gf):
+    data = "﻿Référence,Prix\nA1,3\n".encode("utf-8")
+    assert next(gf._iter_csv_rows(io.BytesIO(data))) == ["Référence", "Prix"]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("12.5", 12.5),
+    ("12,50", 12.5),
+    ("1 234,50", 1234.5),
+    ("1 234,50", 1234.5),
+    ("1.234,50", 1234.5),
+    ("1,234.50", 1234.5),
+    ("1,234,567", 1234567.0),
+    ("0,125", 0.125),
+    ("-3,5", -3.5),
+    (7, 7.0),
+    ("", None),
+])
+def test_import_price_formats(gf, value, expected):
+    assert gf._parse_import_price(value) == expected
+
+
+@pytest.mark.parametrize("value", ["1,234", "1.234", "12,5.3", "1,23.4", "1.2.3", "abc"])
+def test_import_ambiguous_price_is_rejected(gf, value):
+    with pytest.raises(ValueError):
+        gf._parse_import_price(value)
+
+
+def test_import_reports_bad_price_per_row(gf, tenant):
+    rows = [["Ref", "Prix"], ["A", "1,234.50"], ["B", "1,234"], ["C", "2"]]
+    report = gf.import_rows(tenant[0], rows)
+    assert report["saved"] == 2
+    assert report["errors"] == [{"row": 3, "error": "bad_price"}]
+
+
+def test_import_failed_batch_becomes_row_errors(gf, tenant, monkeypatch):
+    ingest_lines = gf.ingest_lines
+    calls = []
+
+    def flaky(conn, client_id, lines, supplier_cache=None):
+        calls.append(len(lines))
+        if len(calls) == 2:
+            raise RuntimeError("boom")
+        return ingest_lines(conn, client_id, lines, supplier_cache)
+
+    monkeypatch.setattr(gf, "ingest_lines", flaky)
+    rows = [["Ref"]] + [[f"R{i}"] for i in range(5)]
+    report = gf.import_rows(tenant[0], rows, chunk_size=2)
+    assert report["saved"] == 3
+    assert [e["row"] for e in report["errors"]] == [4, 5]
+
+
+
+def test_import_mapping_override(gf, tenant):
+    res = post_import(gf, tenant, b"Code article,Tarif\nX1,4\n",
+                      mapping=json.dumps({"reference": "Code article", "prix": "Tarif"}))
+    assert res.status_code == 200
+    assert res.get_json()["saved"] == 1
+
+
+@pytest.mark.parametrize("mapping", ["not json", "[]", '"reference"', '{"reference": 3}',
+                                     '{"reference": null}', '{"prix": ["Tarif"]}'])
+def test_import_bad_mapping(gf, tenant, mapping):
+    res = post_import(gf, tenant, b"Ref\nA\n", mapping=mapping)
+    assert res.status_code == 400
+    assert res.get_json()["error"] == "bad_mapping"
+
+
+def test_import_unsupported_format(gf, tenant):
+    assert post_import(gf, tenant, b"x", filename="cat.pdf").status_code == 415
@@ -0,0 +1,103 @@
+from datetime import date, datetime
+
+import sqlalchemy
+
+
+def test_month_arithmetic_crosses_years(gf):
+    assert gf._add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert gf._add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert gf._month_start(date(2024, 5, 17)) == date(2024, 5, 1)
+
+
+def test_partition_name_round_trips(gf):
+    name = gf._partition_name(date(2024, 3, 1))
+    assert name == "lines_y2024m03"
+    assert gf.PARTITION_NAME_RE.fullmatch(name).groups() == ("2024", "03")
+
+
+def test_line_month_hint(gf):
+    assert gf.line_month({"created_at": datetime(2024, 5, 17, 10, 0)}) == "2024-05"
+    assert gf.line_month({"created_at": "2024-05-17 10:00:00"}) == "2024-05"
+    assert gf.line_month({"created_at": None}) == ""
+
+
+def test_serial_id_table_is_rebuilt(gf, tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (id SERIAL PRIMARY KEY, name TEXT)")
+        conn.exec_driver_sql("INSERT INTO t (id, name) VALUES (7, 'a')")
+        conn.exec_driver_sql("INSERT INTO t (name) VALUES ('b')")
+        assert gf.rebuild_serial_id_table(conn, "t")
+        assert not gf.rebuild_serial_id_table(conn, "t")
+        new_id = conn.exec_driver_sql("INSERT INTO t (name) VALUES ('c') RETURNING id").scalar()
+        rows = conn.exec_driver_sql("SELECT id, name FROM t ORDER BY name").all()
+    assert new_id is not None
+    assert rows[0] == (7, "a") and rows[1][0] is not None
+
+
+def line_id(gf, client_id):
+    with gf.engine.connect() as conn:
+        return conn.execute(gf.text("SELECT MAX(id) FROM lines WHERE client_id = :cid"),
+                            {"cid": client_id}).scalar()
+
+
+def test_line_detail_month_hint_falls_back(gf, tenant, ingest, web, monkeypatch):
+    monkeypatch.setattr(gf, "LINES_PARTITIONED", True)
+    ingest(tenant[0], ["HINT-1"])
+    lid = line_id(gf, tenant[0])
+    this_month = datetime.utcnow().strftime("%Y-%m")
+    for hint in (this_month, "1999-01", "garbage", ""):
+        resp = web.get(f"/client/{tenant[0]}/line/{lid}?m={hint}")
+        assert resp.status_code == 200 and b"HINT-1" in resp.data
+
+
+def test_line_detail_is_scoped_to_client(gf, tenant, ingest, web):
+    ingest("OTHER-" + tenant[0], ["SECRET"])
+    other = line_id(gf, "OTHER-" + tenant[0])
+    assert web.get(f"/client/{tenant[0]}/line/{other}").status_code == 404
+    assert web.get(f"/client/OTHER-{tenant[0]}/line/{other}").status_code == 403
+
+
+class RecordingConn:
+    """يسجّل نص كل استعلام بدل تنفيذه (DDL PostgreSQL بدون قاعدة PostgreSQL)."""
+
+    def __init__(self, existing=()):
+        self.sql = []
+        self.existing = set(existing)
+
+    def execute(self, stmt, params=None):
+        self.sql.append(" ".join(str(stmt).split()))
+        exists = params is not None and params.get("n") in self.existing
+        return type("Result", (), {"scalar": lambda _self: exists})()
+
+
+def test_partition_ddl_monthly_ranges(gf, monkeypatch):
+    monkeypatch.setattr(gf, "PG_HASH_PARTITIONS", 0)
+    today = gf._month_start(datetime.utcnow().date())
+    conn = RecordingConn(existing={gf._partition_name(today)})
+    created = gf.ensure_line_partitions(conn, first_month=gf._add_months(today, -1),
+                                        months_ahead=1)
+    assert created == 2
+    ddl = [s for s in conn.sql if s.startswith("CREATE TABLE")]
+    prev, nxt = gf._add_months(today, -1), gf._add_months(today, 1)
+    assert ddl == [
+        f"CREATE TABLE {gf._partition_name(prev)} PARTITION OF lines "
+        f"FOR VALUES FROM ('{prev}') TO ('{today}')",
+        f"CREATE TABLE {gf._partition_name(nxt)} PARTITION OF lines "
+        f"FOR VALUES FROM ('{nxt}') TO ('{gf._add_months(nxt, 1)}')",
+    ]
+    assert "pg_advisory_xact_lock" in conn.sql[0]
+
+
+def test_partition_ddl_hash_subpartitions(gf, monkeypatch):
+    monkeypatch.setattr(gf, "PG_HASH_PARTITIONS", 2)
+    today = gf._month_start(datetime.utcnow().date())
+    conn = RecordingConn()
+    assert gf.ensure_line_partitions(conn, months_ahead=0) == 1
+    name = gf._partition_name(today)
+    ddl = [s for s in conn.sql if s.startswith("CREATE TABLE")]
+    assert ddl[0].endswith("PARTITION BY HASH (client_id)")
+    assert ddl[1:] == [
+        f"CREATE TABLE {name}_h{i} PARTITION OF {name} FOR VALUES WITH (MODULUS 2, REMAINDER {i})"
+        for i in range(2)
+    ]
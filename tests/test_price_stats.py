@@ -0,0 +1,69 @@
+import pytest
+
+
+def price_stats(gf, client_id):
+    with gf.engine.connect() as conn:
+        rows = conn.execute(gf.text("""
+            SELECT reference, supplier_id, last_price, last_date, min_price, max_price,
+                   sum_price, price_count
+            FROM price_stats WHERE client_id = :cid
+            ORDER BY reference, supplier_id
+        """), {"cid": client_id}).fetchall()
+    return [tuple(r) for r in rows]
+
+
+def ingest_rows(gf, client_id, lines):
+    with gf.write_transaction() as conn:
+        gf.ingest_lines(conn, client_id, lines)
+    gf.lines_committed(client_id)
+
+
+def test_incremental_stats_match_rebuild(gf, tenant):
+    client_id = tenant[0]
+    ingest_rows(gf, client_id, [
+        {"reference": "A", "prix": 10, "date": "31/12/2023", "fournisseur": "F1"},
+        {"reference": "A", "prix": 12, "date": "2024-01-05", "fournisseur": "F1"},
+        {"reference": "A", "prix": 8, "fournisseur": "F1"},
+        {"reference": "A", "prix": 7, "date": "01/01/2024", "fournisseur": "F2"},
+        {"reference": "B", "prix": "n/a", "fournisseur": "F1"},
+    ])
+    ingest_rows(gf, client_id, [
+        {"reference": "A", "prix": 9, "date": "02/01/2024", "fournisseur": "F1"},
+        {"reference": "A", "prix": 11, "date": "05.01.2024", "fournisseur": "F1"},
+        {"reference": "B", "prix": 3, "date": "bientôt", "fournisseur": "F1"},
+    ])
+    incremental = price_stats(gf, client_id)
+
+    with gf.write_transaction() as conn:
+        assert gf.rebuild_price_stats(conn, client_id) == 3
+    assert price_stats(gf, client_id) == incremental
+
+    a_f1 = incremental[0]
+    # الأحدث تاريخاً، وعند التساوي آخر سطر وصل (11 بعد 12 في 2024-01-05)
+    assert a_f1[2:4] == (11.0, "2024-01-05")
+    assert a_f1[4:] == (8.0, 12.0, 50.0, 5)
+    # تاريخ غير مفهوم → NULL بدل مقارنة نصية خاطئة
+    assert incremental[2][2:4] == (3.0, None)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("31/12/2023", "2023-12-31"),
+    ("2024-01-05", "2024-01-05"),
+    ("05.01.2024", "2024-01-05"),
+    ("bientôt", None),
+    ("", None),
+    (None, None),
+])
+def test_iso_date_text(gf, value, expected):
+    assert gf.iso_date_text(value, gf.DateParser()) == expected
+
+
+def test_normalize_price_dates_migrates_legacy_text(gf, tenant):
+    client_id = tenant[0]
+    ingest_rows(gf, client_id, [{"reference": "A", "prix": 1, "date": "2024-01-05",
+                                 "fournisseur": "F"}])
+    with gf.write_transaction() as conn:
+        conn.execute(gf.text("UPDATE price_stats SET last_date = '05/01/2024' WHERE client_id = :cid"),
+                     {"cid": client_id})
+        gf.normalize_price_dates(conn)
+    assert price_stats(gf, client_id)[0][3] == "2024-01-05"
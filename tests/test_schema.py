@@ -0,0 +1,47 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def cold(gf, monkeypatch):
+    """عملية «باردة»: المخطط لم يُفحص بعد، والنسخة المخزنة أقدم."""
+    monkeypatch.setattr(gf, "_schema_ready", False)
+    monkeypatch.setattr(gf, "current_schema_version", lambda: gf.SCHEMA_VERSION - 1)
+    calls = []
+    monkeypatch.setattr(gf, "init_db", lambda: calls.append(1))
+    return calls
+
+
+def test_outdated_schema_returns_503_without_auto_migrate(gf, cold, monkeypatch):
+    monkeypatch.setattr(gf, "AUTO_MIGRATE", False)
+    res = gf.app.test_client().get("/login")
+    assert res.status_code == 503 and res.get_json()["error"] == "schema_outdated"
+    assert cold == [] and not gf._schema_ready
+
+
+def test_outdated_schema_migrates_once_on_first_request(gf, cold, monkeypatch):
+    monkeypatch.setattr(gf, "AUTO_MIGRATE", True)
+    client = gf.app.test_client()
+    client.get("/login")
+    client.get("/login")
+    assert cold == [1] and gf._schema_ready
+
+
+def test_init_db_is_idempotent(gf):
+    gf.init_db()
+    gf.init_db()
+    assert gf.current_schema_version() == gf.SCHEMA_VERSION
+
+
+def test_import_runs_no_ddl(tmp_path):
+    # الاستيراد وحده لا ينشئ أي جدول: المخطط عند أول طلب أو بالأمر migrate
+    db = tmp_path / "cold.db"
+    code = ("import sqlalchemy as sa, gf_server; "
+            "print(sa.inspect(gf_server.engine).get_table_names())")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         env={"DATABASE_URL": f"sqlite:///{db}", "PATH": ""},
+                         cwd=Path(__file__).resolve().parent.parent)
+    assert out.stdout.strip() == "[]"
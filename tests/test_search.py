@@ -0,0 +1,50 @@
+import pytest
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("Régulateur", "regulateur"),
+    ("ABC-123", "abc123"),
+    ("  Straße ", "strasse"),
+    ("Ｒ５", "r5"),
+    ("", ""),
+    (None, ""),
+])
+def test_normalize_search(gf, value, expected):
+    assert gf.normalize_search(value) == expected
+
+
+def test_search_key_does_not_match_across_fields(gf):
+    key = gf.line_search_key("AB-1", "Filtre", None)
+    assert key == "ab1|filtre|"
+    assert "1filtre" not in key
+
+
+def search(web, client_id, q):
+    res = web.get(f"/client/{client_id}/lines", query_string={"ajax": "1", "q": q, "fuzzy": "0"})
+    assert res.status_code == 200
+    return sorted(r["reference"] for r in res.get_json())
+
+
+def test_search_folds_accents_and_separators(gf, tenant, ingest, web, monkeypatch):
+    monkeypatch.setattr(gf, "FUZZY_SEARCH", False)
+    client_id = tenant[0]
+    ingest(client_id, ["RB-5021"], designation="Régulateur de pression")
+    ingest(client_id, ["XY1"], fournisseur="Pièces Étoile")
+
+    assert search(web, client_id, "regulateur") == ["RB-5021"]
+    assert search(web, client_id, "rb5021") == ["RB-5021"]
+    # المورد عبر suppliers.search_name
+    assert search(web, client_id, "etoile") == ["XY1"]
+    assert search(web, client_id, "absent") == []
+
+
+def test_backfill_search_columns(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["É-1"], designation="Câble")
+    with gf.write_transaction() as conn:
+        conn.execute(gf.text("UPDATE lines SET search_key = NULL WHERE client_id = :cid"),
+                     {"cid": client_id})
+        gf.backfill_search_columns(conn, "lines")
+        key = conn.execute(gf.text("SELECT search_key FROM lines WHERE client_id = :cid"),
+                           {"cid": client_id}).scalar()
+    assert key == "e1|cable|"
@@ -0,0 +1,32 @@
+import pytest
+
+
+def test_serve_command_passes_options(gf, monkeypatch):
+    calls = []
+    monkeypatch.setattr(gf, "serve", lambda *args: calls.append(args))
+    gf.main(["serve", "--port", "9001", "--workers", "3", "--threads", "16"])
+    assert calls == [(gf.SERVE_DEFAULTS["host"], 9001, 3, 16,
+                      gf.SERVE_DEFAULTS["connection_limit"], gf.SERVE_DEFAULTS["channel_timeout"],
+                      gf.SERVE_DEFAULTS["backlog"])]
+
+
+def test_single_worker_serves_on_bound_socket(gf, monkeypatch):
+    waitress = pytest.importorskip("waitress")
+    served = {}
+
+    def fake_serve(app, **kwargs):
+        served.update(kwargs, app=app)
+
+    monkeypatch.setattr(waitress, "serve", fake_serve)
+    # serve ضبط سقف SSE العام: يُستعاد بعد الاختبار
+    monkeypatch.setattr(gf.line_events, "limit", gf.line_events.limit)
+    gf.serve("127.0.0.1", 0, 1, 6, 50, 30, 16)
+
+    sock = served["sockets"][0]
+    try:
+        assert sock.getsockname()[0] == "127.0.0.1"
+        assert served["app"] is gf.app
+        assert (served["threads"], served["connection_limit"], served["channel_timeout"],
+                served["backlog"]) == (6, 50, 30, 16)
+    finally:
+        sock.close()
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+
+def test_tuned_pragmas_applied(gf):
+    if not gf.SQLITE_TUNED:
+        pytest.skip("GF_SQLITE_TUNED=0")
+    with gf.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == gf.SQLITE_BUSY_MS
+        assert conn.exec_driver_sql("PRAGMA cache_size").scalar() == -gf.SQLITE_CACHE_MB * 1024
+
+
+def test_writer_queue_serves_in_arrival_order(gf):
+    writer = gf.WriterQueue()
+    order = []
+    first = writer.turn()
+    first.__enter__()
+
+    def wait_turn(i):
+        with writer.turn():
+            order.append(i)
+
+    threads = []
+    for i in range(5):
+        thread = threading.Thread(target=wait_turn, args=(i,))
+        thread.start()
+        threads.append(thread)
+        # التذكرة تُحجز عند الدخول: ننتظر حتى يأخذ كل خيط تذكرته بالترتيب
+        while writer.next_ticket != i + 2:
+            time.sleep(0.001)
+    first.__exit__(None, None, None)
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2, 3, 4]
+
+
+def test_writer_queue_releases_turn_on_error(gf):
+    writer = gf.WriterQueue()
+    with pytest.raises(RuntimeError):
+        with writer.turn():
+            raise RuntimeError("boom")
+    with writer.turn():
+        pass
+    assert writer.serving == 2
+
+
+def test_concurrent_writes_do_not_fail_with_locked(gf, tenant, ingest):
+    client_id = tenant[0]
+    errors = []
+
+    def write(i):
+        try:
+            for j in range(5):
+                ingest(client_id, [f"R{i}-{j}"])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert errors == []
+    with gf.engine.connect() as conn:
+        assert conn.execute(gf.text("SELECT COUNT(*) FROM lines WHERE client_id = :cid"),
+                            {"cid": client_id}).scalar() == 40
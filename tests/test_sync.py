@@ -0,0 +1,45 @@
+def changes(gf, tenant, table="lines", **params):
+    client_id, api_key = tenant
+    resp = gf.app.test_client().get(f"/api/{table}/changes", query_string=params,
+                                    headers={"X-Client-Id": client_id, "X-Api-Key": api_key})
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def test_changes_pages_with_cursor(gf, tenant, ingest):
+    client_id = tenant[0]
+    ingest(client_id, ["A", "B", "C"])
+
+    first = changes(gf, tenant, since=0, limit=2)
+    assert first["columns"] == gf.LINES_CHANGES_COLUMNS
+    assert [row[3] for row in first["rows"]] == ["A", "B"] and first["more"]
+
+    rest = changes(gf, tenant, since=first["next"], limit=2)
+    assert [row[3] for row in rest["rows"]] == ["C"] and not rest["more"]
+
+    # لا جديد: نفس المؤشر يعود
+    empty = changes(gf, tenant, since=rest["next"])
+    assert empty["rows"] == [] and empty["next"] == rest["next"]
+
+
+def test_changes_are_scoped_to_tenant(gf, tenant, ingest):
+    ingest("LOCAL-TEST", ["OTHER"])
+    ingest(tenant[0], ["MINE"])
+    assert [row[3] for row in changes(gf, tenant, since=0)["rows"]] == ["MINE"]
+
+
+def test_supplier_changes(gf, tenant, ingest):
+    ingest(tenant[0], ["A"], fournisseur="Garage Nord")
+    result = changes(gf, tenant, table="suppliers", since=0)
+    name = result["columns"].index("name")
+    assert [row[name] for row in result["rows"]] == ["Garage Nord"]
+
+
+def test_changes_rejects_bad_credentials_and_cursor(gf, tenant):
+    client = gf.app.test_client()
+    resp = client.get("/api/lines/changes", headers={"X-Client-Id": tenant[0], "X-Api-Key": "x"})
+    assert resp.status_code == 401
+
+    resp = client.get("/api/lines/changes?since=abc",
+                      headers={"X-Client-Id": tenant[0], "X-Api-Key": tenant[1]})
+    assert resp.status_code == 400 and resp.get_json()["error"] == "bad_cursor"
@@ -0,0 +1,93 @@
+import json
+import uuid
+
+import pytest
+
+
+def payload(lines, **extra):
+    return dict({"client_id": "LOCAL-TEST", "api_key": "TESTKEY123", "lines": lines}, **extra)
+
+
+def refs_count(gf, tag):
+    with gf.engine.connect() as conn:
+        return dict(conn.execute(gf.text("""
+            SELECT reference, COUNT(*) FROM lines
+            WHERE client_id = 'LOCAL-TEST' AND reference LIKE :tag GROUP BY reference
+        """), {"tag": tag + "%"}).all())
+
+
+def test_plan_defaults_to_one_transaction(gf):
+    lines = list(range(25000))
+    assert gf.plan_upload_chunks({}, lines)[0] == 25000
+    assert len(gf.plan_upload_chunks({"chunk_size": 0}, lines)[1]) == 1
+    assert len(gf.plan_upload_chunks({"chunk_size": "0"}, lines)[1]) == 1
+    size, plan = gf.plan_upload_chunks({"chunk_size": 50000}, lines)
+    assert size == gf.UPLOAD_CHUNK_SIZE_MAX and len(plan) == 2
+
+
+def test_plan_resume_and_explicit_chunks(gf):
+    lines = list(range(10))
+    _, plan = gf.plan_upload_chunks({"chunk_size": 3, "resume_from": 2}, lines)
+    assert [i for i, _ in plan] == [2, 3] and plan[-1][1] == [9]
+    _, plan = gf.plan_upload_chunks({"chunk_size": 3, "chunks": [0, 3]}, lines)
+    assert [i for i, _ in plan] == [0, 3]
+
+
+def test_bad_chunk_params(gf):
+    resp = gf.app.test_client().post("/api/upload_lines",
+                                     json=payload([{"reference": "x"}], chunk_size="big"))
+    assert resp.status_code == 400 and resp.get_json()["error"] == "bad_chunk_params"
+
+
+def failing_chunk(gf, monkeypatch, bad_call):
+    ingest_lines = gf.ingest_lines
+    calls = []
+
+    def flaky(conn, client_id, lines, supplier_cache=None):
+        calls.append(1)
+        if len(calls) == bad_call:
+            raise RuntimeError("boom")
+        return ingest_lines(conn, client_id, lines, supplier_cache)
+
+    monkeypatch.setattr(gf, "ingest_lines", flaky)
+
+
+def test_resume_after_failure_does_not_duplicate(gf, monkeypatch):
+    tag = "RES-" + uuid.uuid4().hex[:6]
+    lines = [{"reference": f"{tag}-{i}"} for i in range(6)]
+    client = gf.app.test_client()
+
+    failing_chunk(gf, monkeypatch, bad_call=2)
+    resp = client.post("/api/upload_lines", json=payload(lines, chunk_size=2))
+    body = resp.get_json()
+    assert resp.status_code == 207 and body["saved"] == 2
+    assert body["failed_chunks"] == [{"index": 1, "error": "RuntimeError"},
+                                     {"index": 2, "error": "not_attempted"}]
+    assert body["resume_from"] == 1
+
+    monkeypatch.undo()
+    resp = client.post("/api/upload_lines",
+                       json=payload(lines, chunk_size=2, resume_from=body["resume_from"]))
+    assert resp.get_json()["ok"]
+    assert refs_count(gf, tag) == {line["reference"]: 1 for line in lines}
+
+
+def test_explicit_chunks_failure_has_no_resume_watermark(gf, monkeypatch):
+    tag = "RET-" + uuid.uuid4().hex[:6]
+    lines = [{"reference": f"{tag}-{i}"} for i in range(8)]
+    failing_chunk(gf, monkeypatch, bad_call=1)
+    body = gf.app.test_client().post(
+        "/api/upload_lines", json=payload(lines, chunk_size=2, chunks=[1, 3])).get_json()
+    assert [f["index"] for f in body["failed_chunks"]] == [1, 3]
+    assert "resume_from" not in body
+
+
+def test_async_upload_reports_the_same_watermark(gf, monkeypatch):
+    call = pytest.importorskip("test_async").call
+    tag = "ARS-" + uuid.uuid4().hex[:6]
+    lines = [{"reference": f"{tag}-{i}"} for i in range(6)]
+    failing_chunk(gf, monkeypatch, bad_call=2)
+    status, _, body = call("POST", "/api/upload_lines",
+                                      json.dumps(payload(lines, chunk_size=2)).encode())
+    body = json.loads(body)
+    assert status == 207 and body["resume_from"] == 1 and body["saved"] == 2